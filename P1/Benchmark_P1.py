@@ -0,0 +1,216 @@
+import argparse
+import csv
+import functools
+import json
+import os
+import platform
+import random
+import shutil
+import string
+import time
+import tracemalloc
+
+import Credits_P1
+import Titles_P1
+from Instrument_P1 import stage, collect_stages
+from Keys_P1 import KEYS_DIRECTORY, SurrogateKeys
+from Match_P1 import match_titles, apply_title_matches
+from Merge_P1 import titles_table, merge_titles_table, table_to_movies
+from Parallel_P1 import map_in_pool
+from Persons_P1 import resolve_persons, apply_person_mapping
+from Search_P1 import build_search_index
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+BENCHMARK_DIRECTORY = os.path.join(SCRIPT_DIRECTORY, "benchmark")
+RESULTS_FILE = os.path.join(BENCHMARK_DIRECTORY, "results.jsonl")
+# Person ids of the k-th copy of the data are shifted by k * PERSON_ID_STRIDE, above any real person id
+PERSON_ID_STRIDE = 10_000_000
+
+
+# Id of the k-th copy of a title. The same title gets the same id in every provider, so the cross-provider overlap of
+# the bundled data is kept at every scale. Copies also get their own title name, so title matching (Match_P1) does
+# not take them for the same title listed under different ids.
+def copy_id(value, k):
+    return value if k == 0 or not value else f"{value}s{k}"
+
+
+# Letter substitution of the k-th copy, a permutation of the alphabet drawn for k
+@functools.lru_cache(maxsize=None)
+def copy_alphabet(k):
+    letters = list(string.ascii_lowercase)
+    random.Random(k).shuffle(letters)
+    letters = ''.join(letters)
+    return str.maketrans(string.ascii_lowercase + string.ascii_uppercase, letters + letters.upper())
+
+
+# Name of a person in the k-th copy. The letters go through the substitution of the copy, so every copy has names of
+# its own, with the same near-duplicates among them as the bundled data. With the names repeated in every copy, the
+# LSH buckets of Persons_P1 would grow with the scale until they are all skipped.
+def copy_name(name, k):
+    return name if k == 0 else name.translate(copy_alphabet(k))
+
+
+def add_line_break(text, rng):
+    spaces = [i for i, character in enumerate(text) if character == ' ']
+    if not spaces:
+        return text
+    i = rng.choice(spaces)
+    return text[:i] + rng.choice(['\n', '\n\n']) + text[i + 1:]
+
+
+# Write `scale` copies of the bundled provider files to output_directory, along with the providers file. Besides the
+# overlap, conflicting imdb_ids and multiline descriptions of the bundled data, a share of the rows get a conflicting
+# imdb_id, a line break in the description or an exact duplicate.
+def generate_feeds(output_directory, scale, source_directory=SCRIPT_DIRECTORY, seed=0, conflict_rate=0.02,
+                   multiline_rate=0.02, duplicate_rate=0.01):
+    rng = random.Random(seed)
+    os.makedirs(output_directory, exist_ok=True)
+    rows_written = 0
+
+    for filename in sorted(os.listdir(source_directory)):
+        if filename == Titles_P1.PROVIDERS_FILE:
+            shutil.copy(os.path.join(source_directory, filename), output_directory)
+            continue
+        is_titles = filename.endswith("Titles.csv")
+        if not (is_titles or filename.lower().endswith("credits.csv")):
+            continue
+        with open(os.path.join(source_directory, filename), newline='', encoding='utf-8') as infile:
+            reader = csv.reader(infile)
+            header = next(reader)
+            rows = [row for row in reader if row]
+
+        with open(os.path.join(output_directory, filename), 'w', newline='', encoding='utf-8') as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(header)
+            for k in range(scale):
+                for row in rows:
+                    row = list(row)
+                    if is_titles:
+                        row[0] = copy_id(row[0], k)
+                        row[1] = copy_id(row[1], k)
+                        row[10] = copy_id(row[10], k)
+                        if row[10] and rng.random() < conflict_rate:
+                            row[10] = f"tt{rng.randrange(10 ** 7, 10 ** 8)}"
+                        if rng.random() < multiline_rate:
+                            row[3] = add_line_break(row[3], rng)
+                    else:
+                        row[0] = str(int(row[0]) + k * PERSON_ID_STRIDE)
+                        row[1] = copy_id(row[1], k)
+                        row[2] = copy_name(row[2], k)
+                    writer.writerow(row)
+                    rows_written += 1
+                    if rng.random() < duplicate_rate:
+                        writer.writerow(row)
+                        rows_written += 1
+
+    return rows_written
+
+
+# Run every pipeline stage on the feeds in directory and return the list of stage measurements (Instrument_P1 stage
+# metrics). Peak memory is measured with ru_maxrss (whole process, so far) and, with trace_memory, with tracemalloc
+# (Python allocations of this process, per stage). tracemalloc slows the stages down a lot, so timings are only
+# comparable between runs with the same setting.
+def run_benchmark(directory, workers=1, legacy=False, trace_memory=True):
+    stages = []
+    previous_directory = os.getcwd()
+    os.chdir(directory)
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        with collect_stages(stages):
+            titles_files = Titles_P1.list_titles_files(directory)
+            # Every run assigns its surrogate ids from scratch, like a first pipeline run
+            shutil.rmtree(os.path.join(directory, KEYS_DIRECTORY), ignore_errors=True)
+            keys = SurrogateKeys()
+            # In a subdirectory, so the sanitized files are not taken for provider files on the next run
+            sanitized_directory = os.path.join(directory, "sanitized")
+            os.makedirs(sanitized_directory, exist_ok=True)
+            sanitized_files = [os.path.join(sanitized_directory, "sanitized_" + os.path.basename(file))
+                               for file in titles_files]
+            with stage("sanitize"):
+                map_in_pool(Titles_P1.sanitize_titles_file, titles_files, sanitized_files, workers=workers)
+            with stage("load_titles"):
+                title_ids = {}
+                table = titles_table(Titles_P1.read_title_store(sanitized_files, title_ids))
+            with stage("match_titles"):
+                canonical_ids = {title_id: canonical_id for title_id, canonical_id, _, _ in match_titles(table)}
+            with stage("merge_movies"):
+                merged = merge_titles_table(apply_title_matches(table, canonical_ids))
+            with stage("save_titles"):
+                Titles_P1.save_movies_to_csv(table_to_movies(merged), remove_empty_lists=True)
+            if legacy:
+                with stage("merge_movies_legacy"):
+                    Titles_P1.merge_movies(Titles_P1.read_movies_from_csv(sanitized_files))
+            with stage("provider_table"):
+                title_ids = {titles_file: title_ids[sanitized_file]
+                             for titles_file, sanitized_file in zip(titles_files, sanitized_files)}
+                Titles_P1.create_provider_movie_table(directory, canonical_ids, title_ids, keys)
+            with stage("search_index"):
+                build_search_index(directory)
+
+            credits_files = Credits_P1.list_credits_files(directory)
+            with stage("credits_normalize"):
+                provider_rows = map_in_pool(Credits_P1.normalize_credits_file, credits_files, workers=workers)
+            with stage("credits_dedup_merge"):
+                tables = Credits_P1.build_credit_tables(provider_rows, keys)
+            with stage("resolve_persons"):
+                mapping = resolve_persons(tables[1], tables[0], keys)
+                tables = apply_person_mapping(*tables, {row[0]: row[1] for row in mapping})
+            with stage("credits_save"):
+                Credits_P1.save_credit_tables(*tables, keys)
+            del provider_rows, tables
+
+            if legacy:
+                with stage("credits_dedup_legacy"):
+                    import pandas as pd
+
+                    merged_df = pd.concat([Credits_P1.process_csv(file) for file in credits_files], ignore_index=True)
+                    merged_df.to_csv("Credits_merged_raw_csv.csv", index=False)
+                    Credits_P1.process_csv(os.path.join(directory, "Credits_merged_raw_csv.csv")).to_csv(
+                        "Credits_deduplicated_csv.csv", index=False)
+                    person_titles = Credits_P1.read_csv_and_create_objects("Credits_deduplicated_csv.csv")
+                    Credits_P1.save_person_titles_to_csv(person_titles, "person_titles.csv")
+                    Credits_P1.remove_duplicates_from_csv("person_titles.csv")
+                with stage("actor_director_merge_legacy"):
+                    Credits_P1.merge_actor_director_lines("person_titles.csv")
+    finally:
+        tracemalloc.stop()
+        os.chdir(previous_directory)
+    return stages
+
+
+def input_rows(directory):
+    rows = 0
+    for filename in os.listdir(directory):
+        if filename.endswith("Titles.csv") or filename.lower().endswith("credits.csv"):
+            with open(os.path.join(directory, filename), newline='', encoding='utf-8') as file:
+                rows += sum(1 for _ in csv.reader(file)) - 1
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the P1 pipelines on synthetic provider feeds")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100],
+                        help="sizes of the synthetic feeds, as multiples of the bundled data")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--legacy", action="store_true", help="also time merge_movies and the pandas credits chain")
+    parser.add_argument("--no-trace-memory", action="store_true", help="skip tracemalloc, for undisturbed timings")
+    parser.add_argument("--results", default=RESULTS_FILE, help="JSON lines file the results are appended to")
+    args = parser.parse_args()
+
+    for scale in args.scales:
+        directory = os.path.join(BENCHMARK_DIRECTORY, f"scale_{scale}")
+        print(f"Generating {scale}x feeds in {directory}")
+        generate_feeds(directory, scale, seed=args.seed)
+        stages = run_benchmark(directory, args.workers, args.legacy, not args.no_trace_memory)
+        for measured in stages:
+            print(f"{measured['stage']:<24}{measured['seconds']:>10.2f} s")
+        result = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "scale": scale, "seed": args.seed,
+                  "workers": args.workers, "trace_memory": not args.no_trace_memory,
+                  "input_rows": input_rows(directory), "python": platform.python_version(),
+                  "machine": platform.machine(), "stages": stages}
+        os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+        with open(args.results, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(result) + "\n")
+        print(f"Results appended to {args.results}")
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+
+from Chunks_P1 import worth_splitting
+from Intermediate_P1 import intermediate_filename
+from Parallel_P1 import WORKERS, map_in_pool
+
+CACHE_DIRECTORY = "cache"
+MANIFEST_FILE = "manifest.json"
+# Bump when a cached stage changes its output so old cache entries are rebuilt
+CACHE_VERSION = 2
+
+
+def file_hash(filepath, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(cache_directory):
+    manifest_path = os.path.join(cache_directory, MANIFEST_FILE)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    # Entries written by another version of the stages cannot be trusted
+    if manifest.pop("version", None) != CACHE_VERSION:
+        return {}
+    return manifest
+
+
+def save_manifest(cache_directory, manifest):
+    os.makedirs(cache_directory, exist_ok=True)
+    manifest_path = os.path.join(cache_directory, MANIFEST_FILE)
+    temp_file = manifest_path + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump({"version": CACHE_VERSION, **manifest}, f, indent=2, sort_keys=True)
+    os.replace(temp_file, manifest_path)
+
+
+# Return the cached result of `stage` for input_file, running build(input_file, output_file) only when the
+# content hash of input_file differs from the one recorded in the manifest
+def get_cached_file(cache_directory, manifest, stage, input_file, build):
+    return get_cached_files(cache_directory, manifest, stage, [input_file], build, workers=1)[0]
+
+
+# Same as get_cached_file for several inputs, the stale ones are rebuilt in a process pool of `workers` processes.
+# The cached files are returned in the order of input_files.
+def get_cached_files(cache_directory, manifest, stage, input_files, build, workers=WORKERS, split_large_files=False):
+    os.makedirs(cache_directory, exist_ok=True)
+    output_files = []
+    stale = []
+
+    for input_file in input_files:
+        filename = os.path.basename(input_file)
+        output_file = os.path.join(cache_directory, intermediate_filename(f"{stage}_{filename}"))
+        # Keyed on the output file, so switching the intermediate format never picks up an outdated file
+        key = f"{stage}/{os.path.basename(output_file)}"
+        digest = file_hash(input_file)
+        output_files.append(output_file)
+
+        if manifest.get(key) == digest and os.path.exists(output_file):
+            print(f"Using cached {stage} result for {filename}")
+        else:
+            stale.append((input_file, output_file, key, digest))
+
+    if stale:
+        # With split_large_files, files big enough to be parsed in several byte ranges (Chunks_P1) are built one at a
+        # time by build(input_file, output_file, workers=workers), which spreads their ranges over the workers; the
+        # others are built one file per worker. A worker never starts a pool of its own.
+        large = [item for item in stale if split_large_files and worth_splitting(item[0], workers)]
+        small = [item for item in stale if item not in large]
+        map_in_pool(build, [item[0] for item in small], [item[1] for item in small], workers=workers)
+        for input_file, output_file, _, _ in large:
+            build(input_file, output_file, workers=workers)
+        for input_file, output_file, key, digest in stale:
+            manifest[key] = digest
+            print(f"Rebuilt {stage} result for {os.path.basename(input_file)}")
+
+    return output_files
@@ -0,0 +1,121 @@
+import csv
+import io
+import os
+
+from Parallel_P1 import WORKERS, map_in_pool, imap_in_pool
+
+# A file is parsed in one byte range per worker, but never in ranges smaller than this (P1_CHUNK_MB): below it the
+# process start-up and the pickling of the rows back cost more than the parsing they spread
+MIN_CHUNK_BYTES = int(float(os.environ.get("P1_CHUNK_MB", "8")) * 1024 * 1024)
+# Bytes read at a time while looking for record boundaries
+SCAN_BLOCK_BYTES = 1 << 20
+
+# A CSV file can not be cut at any newline: a quoted field (a description, a character name) may hold newlines of its
+# own. In a file written by csv.writer or pandas a quote only appears inside a quoted field, where a literal quote is
+# doubled, so a newline ends a record exactly when the number of quotes before it is even. The quotes are counted in
+# one sequential pass over the bytes (bytes.count, far faster than parsing them), then every range is parsed on its own.
+
+
+# Offset just after the first record-ending newline at or after each of targets (ascending offsets). Targets served by
+# the same newline give one boundary, targets in the last record give none.
+def record_boundaries(path, targets):
+    targets = list(targets)
+    boundaries = []
+    if not targets:
+        return boundaries
+    with open(path, 'rb') as f:
+        offset = 0
+        # Inside a quoted field at block[position]
+        quoted = False
+        for block in iter(lambda: f.read(SCAN_BLOCK_BYTES), b''):
+            position = 0
+            while targets and targets[0] < offset + len(block):
+                newline = block.find(b'\n', max(targets[0] - offset, position))
+                if newline == -1:
+                    break
+                quoted ^= block.count(b'"', position, newline) & 1
+                position = newline
+                if quoted:
+                    # A newline inside a field, the next one may end the record
+                    targets[0] = offset + newline + 1
+                    continue
+                boundaries.append(offset + newline + 1)
+                while targets and targets[0] <= offset + newline:
+                    targets.pop(0)
+            if not targets:
+                break
+            quoted ^= block.count(b'"', position) & 1
+            offset += len(block)
+    return boundaries
+
+
+# (start, end) byte ranges of about equal size covering the records of path after the header, one per worker as long as
+# the ranges stay above min_chunk_bytes
+def record_ranges(path, workers=WORKERS, min_chunk_bytes=MIN_CHUNK_BYTES):
+    size = os.path.getsize(path)
+    data_start = (record_boundaries(path, [0]) or [size])[0]
+    chunks = max(1, min(workers, (size - data_start) // max(1, min_chunk_bytes)))
+    starts = [data_start] + record_boundaries(path, [data_start + (size - data_start) * k // chunks
+                                                     for k in range(1, chunks)])
+    return [(start, end) for start, end in zip(starts, starts[1:] + [size]) if end > start]
+
+
+def read_range(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start)
+
+
+# True when path is big enough for record_ranges to cut it in more than one range
+def worth_splitting(path, workers=WORKERS, min_chunk_bytes=MIN_CHUNK_BYTES):
+    return workers > 1 and os.path.getsize(path) >= 2 * max(1, min_chunk_bytes)
+
+
+# Rows of a byte range, as csv.reader gives them (blank lines are []). With a transform (a module level function, so
+# it can be sent to the workers) the rows are transform(header, rows) instead, worked out in the worker.
+def parse_record_range(path, start, end, header=None, transform=None):
+    rows = csv.reader(io.StringIO(read_range(path, start, end).decode('utf-8'), newline=''))
+    return list(transform(header, rows) if transform else rows)
+
+
+# Header of path and an iterator over the batches of rows that follow, in file order: one batch per byte range, the
+# ranges parsed in a pool of workers processes. Together the batches hold the rows csv.reader reads from the file, or
+# what transform makes of them (see parse_record_range).
+def read_csv_batches(path, workers=WORKERS, min_chunk_bytes=MIN_CHUNK_BYTES, transform=None):
+    with open(path, newline='', encoding='utf-8') as f:
+        header = next(csv.reader(f), [])
+    ranges = record_ranges(path, workers, min_chunk_bytes)
+    return header, imap_in_pool(parse_record_range, [path] * len(ranges), [start for start, _ in ranges],
+                                [end for _, end in ranges], [header] * len(ranges), [transform] * len(ranges),
+                                workers=workers)
+
+
+def parse_frame_range(path, start, end, columns, dtype=None):
+    import pandas as pd
+
+    return pd.read_csv(io.BytesIO(read_range(path, start, end)), header=None, names=columns, dtype=dtype)
+
+
+# pd.read_csv(path) with the byte ranges parsed in a pool of workers processes. Every range infers its own column
+# types; a column read as text in some ranges and as numbers (or all missing) in others is read again as text where it
+# was not, like a single read_csv of the whole column would have kept it.
+def read_csv_frame(path, workers=WORKERS, min_chunk_bytes=MIN_CHUNK_BYTES):
+    import pandas as pd
+
+    ranges = record_ranges(path, workers, min_chunk_bytes)
+    if len(ranges) <= 1:
+        return pd.read_csv(path)
+    columns = list(pd.read_csv(path, nrows=0).columns)
+    paths, starts, ends = [path] * len(ranges), [start for start, _ in ranges], [end for _, end in ranges]
+    frames = map_in_pool(parse_frame_range, paths, starts, ends, [columns] * len(ranges), workers=workers)
+
+    is_text = pd.api.types.is_string_dtype
+    mixed = [column for column in columns if len({is_text(frame[column]) for frame in frames}) > 1]
+    if mixed:
+        reread = [i for i, frame in enumerate(frames) if not all(is_text(frame[column]) for column in mixed)]
+        text_frames = map_in_pool(parse_frame_range, [path] * len(reread), [starts[i] for i in reread],
+                                  [ends[i] for i in reread], [columns] * len(reread),
+                                  [dict.fromkeys(mixed, str)] * len(reread), workers=workers)
+        for i, frame in zip(reread, text_frames):
+            frames[i] = frame
+    return pd.concat(frames, ignore_index=True)
@@ -1,8 +1,17 @@
 import csv
+import functools
 import itertools
 import os
-import pandas as pd
-from unidecode import unidecode
+
+from Dedup_P1 import unique_rows, record_dedup
+from Instrument_P1 import instrumented, record
+from Match_P1 import matches_file, read_title_matches
+from Persons_P1 import MAPPING_FILE, resolve_persons, save_person_mapping, apply_person_mapping, read_credit_tables
+from Intermediate_P1 import read_rows, write_rows
+from Keys_P1 import SurrogateKeys, run_keys
+from Cache_P1 import CACHE_DIRECTORY, load_manifest, save_manifest, get_cached_files
+from Chunks_P1 import read_csv_batches, read_csv_frame, worth_splitting
+from Parallel_P1 import WORKERS, map_in_pool
 
 class Person_Title:
     def __init__(self, title_ID, person_id, actor, director, character):
@@ -17,13 +26,33 @@ class Person_Title:
 def remove_hyphens(text):
     return text.replace("-", "") if isinstance(text, str) else text
 
+# pandas, numpy and unidecode are imported where they are used, so importing a helper of this module stays cheap
 def normalize_text(text):
+    from unidecode import unidecode
     return unidecode(text.lower()) if isinstance(text, str) else text
 
+# Names and characters repeat a lot across providers, so normalized values are memoized. The cache is bounded and
+# lives for the whole process, so it is shared by every file a process normalizes.
+NORMALIZATION_CACHE_SIZE = 1 << 20
+
+@functools.lru_cache(maxsize=NORMALIZATION_CACHE_SIZE)
+def normalize_cell(text):
+    return normalize_text(remove_hyphens(text))
+
+# Vectorized remove_hyphens + normalize_text: each distinct value is normalized once and the results are spread
+# back over the column through its factorized codes (missing values keep code -1 and stay missing)
+def normalize_series(series):
+    import numpy as np
+    import pandas as pd
+
+    codes, uniques = pd.factorize(series)
+    normalized = pd.Index([normalize_cell(value) for value in uniques], dtype=object)
+    return pd.Series(normalized.take(codes, allow_fill=True, fill_value=np.nan), index=series.index, dtype=object)
+
 #de-duplicate lines
+@instrumented()
 def remove_duplicates_from_csv(csv_file):
-    # Create a set to store unique lines
-    unique_lines = set()
+    stats = {}
 
     # Create a temporary file to store unique lines
     temp_file = csv_file + '.tmp'
@@ -34,44 +63,47 @@ def remove_duplicates_from_csv(csv_file):
         reader = csv.reader(infile)
         writer = csv.writer(outfile)
 
-        # Iterate over each line in the CSV file
-        for line in reader:
-            # Convert the line to a tuple to make it hashable
-            line_tuple = tuple(line)
-            # Check if the line is unique
-            if line_tuple not in unique_lines:
-                # If unique, add it to the set and write it to the temporary file
-                unique_lines.add(line_tuple)
-                writer.writerow(line)
+        # Write the first occurrence of every line; lines are compared by digest within the deduplication memory
+        # budget (Dedup_P1)
+        writer.writerows(unique_rows(reader, stats=stats))
 
     # Replace the original file with the temporary file
     os.replace(temp_file, csv_file)
+    record_dedup(stats)
 
 #De-duplicate CSV further with panda
+# Large files are parsed in byte ranges by worker processes (Chunks_P1)
+@instrumented()
 def process_csv(file_path):
     script_directory = os.path.dirname(os.path.abspath(__file__))
     full_file_path = os.path.join(script_directory, file_path)
-    df = pd.read_csv(full_file_path)
+    df = read_csv_frame(full_file_path)
+    rows_in = len(df)
 
-    df["name"] = df["name"].apply(remove_hyphens)
-    df["character"] = df["character"].apply(remove_hyphens)
-    df["name"] = df["name"].apply(normalize_text)
-    df["character"] = df["character"].apply(normalize_text)
+    df["name"] = normalize_series(df["name"])
+    df["character"] = normalize_series(df["character"])
 
     df.drop_duplicates(subset=["person_id", "id", "name", "character", "role"], inplace=True, ignore_index=True)
+    record(rows_in=rows_in, rows_out=len(df), duplicates_dropped=rows_in - len(df))
     return df
 
+@instrumented()
 def read_csv_and_create_objects(filename):
     person_title_set = set()  # Initialize an empty set to store Person_Title objects
 
-    with open(filename, newline='') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            title_ID = row['id']
-            person_id = row['person_id']
-            actor = True if row["role"] == "ACTOR" else False
-            director = True if row["role"] == "DIRECTOR" else False
-            character = row['character']
+    # Batches of rows in file order, parsed in byte ranges by worker processes (Chunks_P1)
+    header, batches = read_csv_batches(filename)
+    title_column, person_column, role_column, character_column = (header.index(column) for column in
+                                                                  ['id', 'person_id', 'role', 'character'])
+    for batch in batches:
+        for row in batch:
+            if not row:
+                continue
+            title_ID = row[title_column]
+            person_id = row[person_column]
+            actor = True if row[role_column] == "ACTOR" else False
+            director = True if row[role_column] == "DIRECTOR" else False
+            character = row[character_column]
 
             # Create a Person_Title object
             person_title = Person_Title(title_ID, person_id, actor, director, character)
@@ -79,8 +111,10 @@ def read_csv_and_create_objects(filename):
             # Add the object to the set
             person_title_set.add(person_title)
 
+    record(rows_out=len(person_title_set))
     return person_title_set
 
+@instrumented()
 def save_person_titles_to_csv(person_titles, csv_file):
     with open(csv_file, mode='w', newline='', encoding='utf-8') as file:
         writer = csv.writer(file)
@@ -89,6 +123,7 @@ def save_person_titles_to_csv(person_titles, csv_file):
             writer.writerow([person_title.id, person_title.title_ID, person_title.person_id, person_title.actor, person_title.director])
 
 
+@instrumented()
 def save_persons_to_csv(unique_persons_set, csv_file):
     # Open the CSV file in write mode
     with open(csv_file, mode='w', newline='', encoding='utf-8') as file:
@@ -105,6 +140,7 @@ def save_persons_to_csv(unique_persons_set, csv_file):
         for person_id, name in unique_persons_set.items():
             writer.writerow({'id': person_id, 'name': name})
 
+@instrumented()
 def save_person_character_to_csv(person_character_set, csv_file):
     with open(csv_file, mode='w', newline='', encoding='utf-8') as file:
         writer = csv.writer(file)
@@ -113,6 +149,7 @@ def save_person_character_to_csv(person_character_set, csv_file):
             writer.writerow([id, person_title_id, character])
 
 #Function to read list of people
+@instrumented()
 def read_unique_persons_from_csv(csv_file):
     unique_persons_set = {}
 
@@ -123,12 +160,15 @@ def read_unique_persons_from_csv(csv_file):
             name = row['name']
             unique_persons_set[person_id] = name
 
+    record(rows_out=len(unique_persons_set))
     return unique_persons_set
 
 # remove almost identical lines of person_titles (to merge actor, director values)
+@instrumented()
 def merge_actor_director_lines(csv_file):
     # Create a dictionary to store merged lines
     merged_lines = {}
+    rows_in = 0
 
     # Open the CSV file for reading
     with open(csv_file, mode='r', newline='', encoding='utf-8') as infile:
@@ -136,6 +176,7 @@ def merge_actor_director_lines(csv_file):
 
         # Iterate over each line in the CSV file
         for row in reader:
+            rows_in += 1
             # Create a unique identifier for the line based on id, title_id, and person_id
             identifier = (row['id'], row['title_id'], row['person_id'])
 
@@ -161,7 +202,9 @@ def merge_actor_director_lines(csv_file):
 
     # Replace the original file with the temporary file
     os.replace(temp_file, csv_file)
+    record(rows_in=rows_in, rows_out=len(merged_lines), duplicates_dropped=rows_in - len(merged_lines))
 
+@instrumented()
 def read_person_character_from_csv(csv_file):
     person_character_set = set()
 
@@ -173,6 +216,7 @@ def read_person_character_from_csv(csv_file):
             title = row['id']
             person_character_set.add((person_id+"_"+character, person_id+"_"+title, character))
 
+    record(rows_out=len(person_character_set))
     return person_character_set
 
 def delete_files_with_prefix(directory, prefix):
@@ -185,41 +229,264 @@ def delete_files_with_prefix(directory, prefix):
             except OSError as e:
                 print(f"Error deleting file {filename}: {e}")
 
-# Process all "Credits.csv" files in the same directory
-merged_df = pd.DataFrame()
-for filename in os.listdir():
-    if filename.lower().endswith("credits.csv"):
-        df = process_csv(filename)
-        merged_df = pd.concat([merged_df, df], ignore_index=True)
-
-# Save the merged data to "merged_raw_csv.csv"
-merged_file_path = "Credits_merged_raw_csv.csv"
-merged_df.to_csv(merged_file_path, index=False)
-print(f"Merged data saved to {merged_file_path}")
-
-# Remove duplicates from the merged data
-deduplicated_df = process_csv(merged_file_path)
-script_directory = os.path.dirname(os.path.abspath(__file__))
-delete_files_with_prefix(script_directory, "Credits_merged_raw")
-# Save the cleaned data to "deduplicated_csv.csv"
-deduplicated_file_path = "Credits_deduplicated_csv.csv"
-deduplicated_df.to_csv(deduplicated_file_path, index=False)
-
-print(f"Deduplicated data saved to {deduplicated_file_path}")
-
-csv_filename = "Credits_deduplicated_csv.csv"
-person_titles = read_csv_and_create_objects(csv_filename)
-
-# save person_titles
-save_person_titles_to_csv(person_titles, 'person_titles.csv')
-# De-duplicate person_titles
-remove_duplicates_from_csv('person_titles.csv')
-merge_actor_director_lines('person_titles.csv')
-
-# Load person table
-unique_persons = read_unique_persons_from_csv(csv_filename)
-save_persons_to_csv(unique_persons, 'unique_persons.csv')
-
-# Load Person Character table
-person_character_set = read_person_character_from_csv(csv_filename)
-save_person_character_to_csv(person_character_set, 'person_characters.csv')
\ No newline at end of file
+# Values pd.read_csv turns into NaN by default. The legacy chain wrote the credits to CSV and read them back
+# with pandas twice, so the streaming mode has to blank the same values to produce the same output.
+PANDAS_NA_VALUES = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>',
+                    'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'}
+
+@functools.lru_cache(maxsize=NORMALIZATION_CACHE_SIZE)
+def normalize_credit_field(text):
+    # Same result as running a name/character through process_csv twice (per provider file and on the merged file).
+    # None is a field missing from a short row, which pandas reads as NaN too.
+    for _ in range(2):
+        if text is None or text in PANDAS_NA_VALUES:
+            return ''
+        text = normalize_text(remove_hyphens(text))
+    return text
+
+# (title_id, person_id, name, character, role) of every row of a provider credits file, normalized. rows are
+# csv.reader rows after the header; like csv.DictReader, blank rows are skipped and missing fields read as None.
+def normalized_credit_rows(header, rows):
+    columns = [header.index(column) for column in ['id', 'person_id', 'name', 'character', 'role']]
+    width = len(header)
+    for row in rows:
+        if not row:
+            continue
+        if len(row) < width:
+            row = row + [None] * (width - len(row))
+        title_ID, person_id, name, character, role = (row[column] for column in columns)
+        yield title_ID, person_id, normalize_credit_field(name), normalize_credit_field(character), role
+
+# Yield the normalized rows of a provider credits file. With workers > 1 a big file is parsed and normalized in byte
+# ranges by worker processes (Chunks_P1); otherwise it is streamed here, so a worker never starts a pool of its own.
+def read_normalized_credits(csv_file, workers=1):
+    if worth_splitting(csv_file, workers):
+        header, batches = read_csv_batches(csv_file, workers, transform=normalized_credit_rows)
+        for batch in batches:
+            yield from batch
+        return
+    with open(csv_file, newline='', encoding='utf-8') as csvfile:
+        reader = csv.reader(csvfile)
+        yield from normalized_credit_rows(next(reader, []), reader)
+
+# Normalized credits of one provider, this is what gets cached between runs
+@instrumented()
+def save_normalized_credits(input_file, output_file, workers=1):
+    write_rows(output_file, ['id', 'person_id', 'name', 'character', 'role'],
+               read_normalized_credits(input_file, workers))
+
+# List version of read_normalized_credits, so worker processes can send the rows back
+@instrumented()
+def normalize_credits_file(csv_file, workers=1):
+    rows = list(read_normalized_credits(csv_file, workers))
+    record(rows_out=len(rows))
+    return rows
+
+# normalize_credits_file of every file, in file order: the small files one per worker, then the big ones one at a
+# time with their byte ranges spread over the workers
+def normalize_credits_files(csv_files, workers=WORKERS):
+    large = [worth_splitting(csv_file, workers) for csv_file in csv_files]
+    small_rows = iter(map_in_pool(normalize_credits_file, [csv_file for csv_file, is_large in zip(csv_files, large)
+                                                           if not is_large], workers=workers))
+    return [normalize_credits_file(csv_file, workers) if is_large else next(small_rows)
+            for csv_file, is_large in zip(csv_files, large)]
+
+# Merge the normalized rows of every provider (an iterable of row iterables, in provider order) into the
+# person_titles, unique_persons and person_characters tables. The tables are keyed on the surrogate ids of keys
+# (Keys_P1), so every join and deduplication compares integers; save_credit_tables writes the string keys back.
+# Title ids found in canonical_ids are replaced by the id of the title they were merged into (Match_P1).
+@instrumented()
+def build_credit_tables(provider_rows, keys, canonical_ids=None):
+    canonical_ids = canonical_ids or {}
+    encode_title, encode_person, encode_character = keys.titles.encode, keys.persons.encode, keys.characters.encode
+    # (title, person) -> [actor, director], same merge as merge_actor_director_lines
+    person_titles = {}
+    # person -> name
+    unique_persons = {}
+    # (person, title, character), dict used as an ordered set
+    person_characters = {}
+
+    rows_in = 0
+    for rows in provider_rows:
+        # Duplicate rows need no separate pass: every table below is keyed, so a repeated row changes nothing
+        for title_ID, person_id, name, character, role in rows:
+            rows_in += 1
+            title = encode_title(canonical_ids.get(title_ID, title_ID))
+            person = encode_person(person_id)
+            roles = person_titles.setdefault((title, person), [False, False])
+            if role == "ACTOR":
+                roles[0] = True
+            if role == "DIRECTOR":
+                roles[1] = True
+
+            unique_persons[person] = name
+            person_characters[(person, title, encode_character(character))] = None
+
+    record(rows_in=rows_in, rows_out=len(person_titles), persons=len(unique_persons),
+           person_characters=len(person_characters))
+    return person_titles, unique_persons, person_characters
+
+# Write the tables of build_credit_tables with their string keys, and persist the surrogate ids, link rows included
+@instrumented()
+def save_credit_tables(person_titles, unique_persons, person_characters, keys, person_titles_file='person_titles.csv',
+                       persons_file='unique_persons.csv', characters_file='person_characters.csv'):
+    titles, persons, characters = keys.titles.keys, keys.persons.keys, keys.characters.keys
+    save_person_titles_to_csv((Person_Title(titles[title], persons[person], actor, director, None)
+                               for (title, person), (actor, director) in person_titles.items()),
+                              person_titles_file)
+    save_persons_to_csv({persons[person]: name for person, name in unique_persons.items()}, persons_file)
+    save_person_character_to_csv(((persons[person] + "_" + characters[character], persons[person] + "_" + titles[title],
+                                   characters[character]) for person, title, character in person_characters),
+                                 characters_file)
+
+    for person_title in person_titles:
+        keys.person_titles.encode(person_title)
+    for person_character in person_characters:
+        keys.person_characters.encode(person_character)
+    keys.save()
+    print(f"Credits saved to {person_titles_file}, {persons_file} and {characters_file}")
+
+# "Credits.csv" files of directory, in the order they are merged
+def list_credits_files(directory):
+    return [os.path.join(directory, filename) for filename in sorted(os.listdir(directory))
+            if filename.lower().endswith("credits.csv")]
+
+# Read every "Credits.csv" once and build person_titles, unique_persons and person_characters in memory.
+# With use_cache, the normalized rows of each provider are cached by content hash and only changed providers
+# are normalized again. Providers are normalized in a pool of `workers` processes and merged in file name order,
+# so the output is the same for any number of workers. With resolve, persons listed under several ids are merged
+# into one id (Persons_P1) and the mapping is saved to mapping_file.
+@instrumented()
+def process_credits_streaming(directory, person_titles_file='person_titles.csv', persons_file='unique_persons.csv',
+                              characters_file='person_characters.csv', use_cache=True, workers=WORKERS, resolve=True,
+                              mapping_file=MAPPING_FILE):
+    credits_files = list_credits_files(directory)
+
+    cache_directory = os.path.join(directory, CACHE_DIRECTORY)
+    if use_cache:
+        manifest = load_manifest(cache_directory)
+        cached_files = get_cached_files(cache_directory, manifest, "normalized", credits_files,
+                                        save_normalized_credits, workers=workers, split_large_files=True)
+        save_manifest(cache_directory, manifest)
+        provider_rows = (read_rows(cached_file) for cached_file in cached_files)
+    else:
+        provider_rows = normalize_credits_files(credits_files, workers=workers)
+
+    # Title matches written by the titles pipeline, if it ran first
+    canonical_ids = read_title_matches(matches_file(directory))
+    keys = SurrogateKeys()
+    person_titles, unique_persons, person_characters = build_credit_tables(provider_rows, keys, canonical_ids)
+    if resolve:
+        mapping = resolve_persons(unique_persons, person_titles, keys)
+        save_person_mapping(mapping, keys, mapping_file)
+        person_titles, unique_persons, person_characters = apply_person_mapping(
+            person_titles, unique_persons, person_characters, {row[0]: row[1] for row in mapping})
+    save_credit_tables(person_titles, unique_persons, person_characters, keys, person_titles_file, persons_file,
+                       characters_file)
+
+# Pipeline stages, in the order they run, the same steps as process_credits_streaming. Like the titles stages
+# (Titles_P1.TITLES_STAGES) they share a state dict within one run and otherwise start from the files earlier runs
+# left behind, so any stage can be run on its own (see Pipeline_P1.py).
+
+# Normalized credits of every provider, cached by content hash
+def normalized_credits_files(directory, state):
+    if 'normalized_files' not in state:
+        cache_directory = os.path.join(directory, CACHE_DIRECTORY)
+        manifest = load_manifest(cache_directory)
+        state['normalized_files'] = get_cached_files(cache_directory, manifest, "normalized",
+                                                     list_credits_files(directory), save_normalized_credits,
+                                                     workers=state.get('workers', WORKERS), split_large_files=True)
+        save_manifest(cache_directory, manifest)
+    return state['normalized_files']
+
+# Paths of the credit tables the stages write to directory, next to the titles tables
+def credit_table_files(directory):
+    return [os.path.join(directory, filename)
+            for filename in ('person_titles.csv', 'unique_persons.csv', 'person_characters.csv')]
+
+@instrumented()
+def normalize_stage(directory, state):
+    if state.get('use_cache', True):
+        normalized_credits_files(directory, state)
+    else:
+        print("Cache disabled, the credits are normalized while the tables are built")
+
+# The tables are only saved here when resolve_persons does not run after this stage and save them anyway
+@instrumented()
+def credit_tables_stage(directory, state):
+    if state.get('use_cache', True):
+        provider_rows = (read_rows(normalized_file) for normalized_file in normalized_credits_files(directory, state))
+    else:
+        provider_rows = normalize_credits_files(list_credits_files(directory), workers=state.get('workers', WORKERS))
+    # Title matches written by the titles pipeline, if it ran first
+    canonical_ids = read_title_matches(matches_file(directory))
+    state['credit_tables'] = build_credit_tables(provider_rows, run_keys(directory, state), canonical_ids)
+    if "resolve_persons" not in state.get('stages', ()):
+        save_credit_tables(*state['credit_tables'], run_keys(directory, state), *credit_table_files(directory))
+
+@instrumented()
+def resolve_persons_stage(directory, state):
+    keys = run_keys(directory, state)
+    person_titles, unique_persons, person_characters = (state.get('credit_tables')
+                                                        or read_credit_tables(keys, *credit_table_files(directory)))
+    mapping = resolve_persons(unique_persons, person_titles, keys)
+    save_person_mapping(mapping, keys, os.path.join(directory, MAPPING_FILE))
+    state['credit_tables'] = apply_person_mapping(person_titles, unique_persons, person_characters,
+                                                  {row[0]: row[1] for row in mapping})
+    save_credit_tables(*state['credit_tables'], keys, *credit_table_files(directory))
+
+CREDITS_STAGES = [
+    ("normalize", normalize_stage),
+    ("credit_tables", credit_tables_stage),
+    ("resolve_persons", resolve_persons_stage),
+]
+
+if __name__ == "__main__":
+    # Set to False to run the old multi-pass pipeline (pandas + temporary CSV files)
+    STREAMING = True
+
+    script_directory = os.path.dirname(os.path.abspath(__file__))
+    if STREAMING:
+        from Pipeline_P1 import run_stages
+
+        run_stages(CREDITS_STAGES, script_directory)
+    else:
+        import pandas as pd
+
+        # Process all "Credits.csv" files in the same directory
+        merged_df = pd.DataFrame()
+        for filename in os.listdir():
+            if filename.lower().endswith("credits.csv"):
+                df = process_csv(filename)
+                merged_df = pd.concat([merged_df, df], ignore_index=True)
+
+        # Save the merged data to "merged_raw_csv.csv"
+        merged_file_path = "Credits_merged_raw_csv.csv"
+        merged_df.to_csv(merged_file_path, index=False)
+        print(f"Merged data saved to {merged_file_path}")
+
+        # Remove duplicates from the merged data
+        deduplicated_df = process_csv(merged_file_path)
+        delete_files_with_prefix(script_directory, "Credits_merged_raw")
+        # Save the cleaned data to "deduplicated_csv.csv"
+        deduplicated_file_path = "Credits_deduplicated_csv.csv"
+        deduplicated_df.to_csv(deduplicated_file_path, index=False)
+
+        print(f"Deduplicated data saved to {deduplicated_file_path}")
+
+        csv_filename = "Credits_deduplicated_csv.csv"
+        person_titles = read_csv_and_create_objects(csv_filename)
+
+        # save person_titles
+        save_person_titles_to_csv(person_titles, 'person_titles.csv')
+        # De-duplicate person_titles
+        remove_duplicates_from_csv('person_titles.csv')
+        merge_actor_director_lines('person_titles.csv')
+
+        # Load person table
+        unique_persons = read_unique_persons_from_csv(csv_filename)
+        save_persons_to_csv(unique_persons, 'unique_persons.csv')
+
+        # Load Person Character table
+        person_character_set = read_person_character_from_csv(csv_filename)
+        save_person_character_to_csv(person_character_set, 'person_characters.csv')
\ No newline at end of file
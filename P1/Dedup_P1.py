@@ -0,0 +1,104 @@
+import csv
+import hashlib
+import heapq
+import os
+import tempfile
+
+from Instrument_P1 import record
+
+# Memory the set of row digests may take before deduplication spills to disk (P1_DEDUP_MEMORY_MB)
+MEMORY_BUDGET = int(float(os.environ.get("P1_DEDUP_MEMORY_MB", "256")) * 1024 * 1024)
+# Approximate size of one digest in the set: a 16 byte bytes object (49 bytes) plus its hash table slots
+DIGEST_ENTRY_BYTES = 100
+# Partitions of a spilled deduplication: each one is processed on its own, with about 1/SPILL_PARTITIONS of the
+# digests in memory
+SPILL_PARTITIONS = 64
+
+
+# Fixed-size digest of a row: 16 bytes whatever the row length. Fields are joined with NUL, which CSV text does
+# not contain. A blank line ([]) gets the empty digest, so it does not collide with [''].
+def row_digest(row):
+    if not row:
+        return b''
+    return hashlib.blake2b("\0".join(row).encode('utf-8'), digest_size=16).digest()
+
+
+def spill_partition(digest):
+    return digest[0] % SPILL_PARTITIONS if digest else 0
+
+
+# Yield the first occurrence of every distinct row of rows (lists of strings), in input order. Only digests are kept
+# in memory; once they would take more than memory_budget bytes, the rest of the input is hash-partitioned to files
+# in a temporary directory (under spill_directory) and deduplicated one partition at a time, then merged back in
+# input order. stats, when given, gets rows_in, rows_out and spilled.
+def unique_rows(rows, memory_budget=MEMORY_BUDGET, spill_directory=None, stats=None):
+    stats = stats if stats is not None else {}
+    stats.update(rows_in=0, rows_out=0, spilled=False)
+    max_digests = max(1, memory_budget // DIGEST_ENTRY_BYTES)
+    seen = set()
+    rows = iter(rows)
+
+    for row in rows:
+        stats['rows_in'] += 1
+        digest = row_digest(row)
+        if digest in seen:
+            continue
+        seen.add(digest)
+        stats['rows_out'] += 1
+        yield row
+        if len(seen) >= max_digests:
+            break
+    else:
+        return
+
+    stats['spilled'] = True
+    with tempfile.TemporaryDirectory(prefix="dedup_", dir=spill_directory) as directory:
+        partition_files = [open(os.path.join(directory, f"partition_{i}.csv"), 'w', newline='', encoding='utf-8')
+                           for i in range(SPILL_PARTITIONS)]
+        try:
+            writers = [csv.writer(f) for f in partition_files]
+            # Rows already yielded go first, as bare digests: later copies of them are duplicates
+            for digest in seen:
+                writers[spill_partition(digest)].writerow(["-1", digest.hex()])
+            seen.clear()
+            for sequence, row in enumerate(rows):
+                stats['rows_in'] += 1
+                digest = row_digest(row)
+                writers[spill_partition(digest)].writerow([sequence, digest.hex(), *row])
+        finally:
+            for f in partition_files:
+                f.close()
+
+        # First occurrence of every digest of a partition, still in input order within the partition
+        survivor_files = []
+        for i in range(SPILL_PARTITIONS):
+            partition_file = os.path.join(directory, f"partition_{i}.csv")
+            survivor_file = os.path.join(directory, f"survivors_{i}.csv")
+            partition_seen = set()
+            with open(partition_file, newline='', encoding='utf-8') as infile, \
+                    open(survivor_file, 'w', newline='', encoding='utf-8') as outfile:
+                writer = csv.writer(outfile)
+                for sequence, digest, *row in csv.reader(infile):
+                    if digest in partition_seen:
+                        continue
+                    partition_seen.add(digest)
+                    if sequence != "-1":
+                        writer.writerow([sequence, *row])
+            os.remove(partition_file)
+            survivor_files.append(survivor_file)
+
+        inputs = [open(survivor_file, newline='', encoding='utf-8') for survivor_file in survivor_files]
+        try:
+            readers = [((int(sequence), row) for sequence, *row in csv.reader(f)) for f in inputs]
+            for _, row in heapq.merge(*readers, key=lambda item: item[0]):
+                stats['rows_out'] += 1
+                yield row
+        finally:
+            for f in inputs:
+                f.close()
+
+
+# Record the counters of a unique_rows run in the running instrumented stage
+def record_dedup(stats):
+    record(rows_in=stats['rows_in'], rows_out=stats['rows_out'],
+           duplicates_dropped=stats['rows_in'] - stats['rows_out'], spilled=stats['spilled'])
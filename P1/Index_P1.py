@@ -0,0 +1,298 @@
+import argparse
+import csv
+import json
+import os
+import time
+
+import numpy as np
+
+from Store_P1 import TITLE_COLUMNS, LIST_COLUMNS, Vocabulary
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+INDEX_DIRECTORY = "catalogue_index"
+INDEX_VERSION = 2
+
+# On-disk layout, one .npy file per array, all opened as read-only memory maps:
+#   title_keys, person_keys     sorted ids (bytes), the position of an id is its row in every array below
+#   titles.data/.offsets        JSON row of final_titles.csv for the title at each position, concatenated
+#   persons.data/.offsets       name (UTF-8) of the person at each position, concatenated
+#   titles.genres, titles.production_countries
+#                               bitset of the list of each title, a (titles, words) uint64 array: bit i (of word
+#                               i // 64) is value i of the vocabulary of the column in index.json
+#   provider_keys               sorted provider ids, provider_titles.offsets/.titles their title positions
+#   cast.offsets/.persons/.actor/.director             credits of each title, by person position
+#   filmography.offsets/.titles/.actor/.director       credits of each person, by title position
+# Every *.offsets array has one more entry than its keys: the values of key i are values[offsets[i]:offsets[i + 1]].
+
+
+def read_csv_rows(filename):
+    with open(filename, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader)
+        return [row for row in reader if row]
+
+
+def save_array(directory, name, array):
+    np.save(os.path.join(directory, name + ".npy"), array)
+
+
+# Sorted unique keys of ids, and the position in the sorted keys of every id
+def sorted_keys(ids):
+    keys = np.unique(np.array([value.encode('utf-8') for value in ids], dtype=bytes))
+    return keys, {key.decode('utf-8'): i for i, key in enumerate(keys.tolist())}
+
+
+def save_blob(directory, name, values):
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    save_array(directory, name + ".data", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    save_array(directory, name + ".offsets", offsets)
+
+
+# Group values by key position (0 <= key < count), values of a key ordered by `by`. Returns the offsets and the
+# reordered columns.
+def group_by_key(keys, count, by, columns):
+    order = np.lexsort((by, keys))
+    offsets = np.searchsorted(keys[order], np.arange(count + 1)).astype(np.int64)
+    return offsets, [column[order] for column in columns]
+
+
+# Sorted provider ids of directory/final_provider_movie.csv with the positions of their titles (offsets and titles, see
+# group_by_key), and the number of rows left out because their title is not in title_positions
+def provider_title_arrays(directory, title_positions):
+    providers = []
+    provider_titles = []
+    skipped_providers = 0
+    for _, title_id, provider_id in read_csv_rows(os.path.join(directory, "final_provider_movie.csv")):
+        if title_id not in title_positions:
+            skipped_providers += 1
+            continue
+        providers.append(int(provider_id))
+        provider_titles.append(title_positions[title_id])
+    providers = np.array(providers, dtype=np.int64)
+    provider_titles = np.array(provider_titles, dtype=np.int32)
+    provider_keys, provider_positions = np.unique(providers, return_inverse=True)
+    offsets, (provider_titles,) = group_by_key(provider_positions, len(provider_keys), provider_titles,
+                                               [provider_titles])
+    return provider_keys, offsets, provider_titles, skipped_providers
+
+
+# Compile the final catalogue tables of directory into an index in output_directory. Credits or provider rows whose
+# title or person is not in the catalogue are left out (and counted in the manifest).
+def build_index(directory=SCRIPT_DIRECTORY, output_directory=None):
+    output_directory = output_directory or os.path.join(directory, INDEX_DIRECTORY)
+    os.makedirs(output_directory, exist_ok=True)
+
+    titles = {}
+    for row in read_csv_rows(os.path.join(directory, "final_titles.csv")):
+        titles.setdefault(row[0], row)
+    title_keys, title_positions = sorted_keys(titles)
+    save_array(output_directory, "title_keys", title_keys)
+    save_blob(output_directory, "titles", (json.dumps(titles[key], ensure_ascii=False)
+                                           for key in title_positions))
+    vocabularies = {column: Vocabulary() for column in LIST_COLUMNS}
+    for column, vocabulary in vocabularies.items():
+        i = TITLE_COLUMNS.index(column)
+        save_array(output_directory, "titles." + column,
+                   vocabulary.bitset_array([vocabulary.text_bitset(titles[key][i]) for key in title_positions]))
+
+    persons = {}
+    for person_id, name in read_csv_rows(os.path.join(directory, "unique_persons.csv")):
+        persons.setdefault(person_id, name)
+    person_keys, person_positions = sorted_keys(persons)
+    save_array(output_directory, "person_keys", person_keys)
+    save_blob(output_directory, "persons", (persons[key] for key in person_positions))
+
+    provider_keys, offsets, provider_titles, skipped_providers = provider_title_arrays(directory, title_positions)
+    save_array(output_directory, "provider_keys", provider_keys)
+    save_array(output_directory, "provider_titles.offsets", offsets)
+    save_array(output_directory, "provider_titles.titles", provider_titles)
+
+    credit_titles = []
+    credit_persons = []
+    actor = []
+    director = []
+    skipped_credits = 0
+    for _, title_id, person_id, is_actor, is_director in read_csv_rows(os.path.join(directory, "person_titles.csv")):
+        if title_id not in title_positions or person_id not in person_positions:
+            skipped_credits += 1
+            continue
+        credit_titles.append(title_positions[title_id])
+        credit_persons.append(person_positions[person_id])
+        actor.append(is_actor == 'True')
+        director.append(is_director == 'True')
+    credit_titles = np.array(credit_titles, dtype=np.int32)
+    credit_persons = np.array(credit_persons, dtype=np.int32)
+    actor = np.array(actor, dtype=bool)
+    director = np.array(director, dtype=bool)
+
+    offsets, columns = group_by_key(credit_titles, len(title_keys), credit_persons,
+                                    [credit_persons, actor, director])
+    save_array(output_directory, "cast.offsets", offsets)
+    for name, column in zip(["persons", "actor", "director"], columns):
+        save_array(output_directory, "cast." + name, column)
+    offsets, columns = group_by_key(credit_persons, len(person_keys), credit_titles,
+                                    [credit_titles, actor, director])
+    save_array(output_directory, "filmography.offsets", offsets)
+    for name, column in zip(["titles", "actor", "director"], columns):
+        save_array(output_directory, "filmography." + name, column)
+
+    manifest = {"version": INDEX_VERSION, "titles": len(title_keys), "persons": len(person_keys),
+                "providers": len(provider_keys), "provider_titles": len(provider_titles),
+                "credits": len(credit_titles), "skipped_provider_rows": skipped_providers,
+                "skipped_credit_rows": skipped_credits,
+                "vocabularies": {column: vocabulary.values for column, vocabulary in vocabularies.items()}}
+    # Written last: an index without a manifest is incomplete
+    with open(os.path.join(output_directory, "index.json"), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+# Manifest to print, with the size of the vocabularies instead of their values
+def manifest_summary(manifest):
+    return {**manifest, "vocabularies": {column: len(values) for column, values in manifest["vocabularies"].items()}}
+
+
+# Pipeline stage (Pipeline_P1.py): index the tables the titles and credits pipelines wrote to directory
+def build_index_stage(directory, state):
+    manifest = build_index(directory)
+    print(f"Catalogue index built: {manifest_summary(manifest)}")
+
+
+INDEX_STAGES = [("build_index", build_index_stage)]
+
+
+# Every .npy file of directory by name (without extension), opened as a read-only memory map
+def map_arrays(directory):
+    arrays = {}
+    for filename in os.listdir(directory):
+        if filename.endswith(".npy"):
+            path = os.path.join(directory, filename)
+            try:
+                # Plain ndarray view of the memory map, numpy.memmap adds overhead to every small slice
+                array = np.asarray(np.load(path, mmap_mode='r'))
+            except ValueError:
+                # An empty array can not be memory mapped
+                array = np.load(path)
+            arrays[filename[:-len(".npy")]] = array
+    return arrays
+
+
+# Read-only view of an index built by build_index. Opening it only maps the files; lookups are binary searches on
+# the sorted keys and slices of the offset arrays.
+class CatalogueIndex:
+    def __init__(self, directory=os.path.join(SCRIPT_DIRECTORY, INDEX_DIRECTORY)):
+        with open(os.path.join(directory, "index.json"), encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        if self.manifest["version"] != INDEX_VERSION:
+            raise ValueError(f"Index version {self.manifest['version']} in {directory}, expected {INDEX_VERSION}")
+        self.arrays = map_arrays(directory)
+        self.codes = {column: {value: code for code, value in enumerate(values)}
+                      for column, values in self.manifest["vocabularies"].items()}
+
+    # Position of key in the sorted keys array, None when it is not there
+    def position(self, keys, key):
+        keys = self.arrays[keys]
+        i = int(keys.searchsorted(key))
+        if i < len(keys) and keys[i] == key:
+            return i
+        return None
+
+    def values(self, name, column, i):
+        start, end = self.arrays[name + ".offsets"][i:i + 2].tolist()
+        return self.arrays[f"{name}.{column}"][start:end]
+
+    def blob(self, name, i):
+        start, end = self.arrays[name + ".offsets"][i:i + 2].tolist()
+        return self.arrays[name + ".data"][start:end].tobytes().decode('utf-8')
+
+    # Ids at an array of positions of a keys array
+    def ids(self, keys, positions):
+        return [key.decode('utf-8') for key in self.arrays[keys][positions].tolist()]
+
+    # final_titles.csv row of a title as a dict, None for an unknown id
+    def title(self, title_id):
+        i = self.position("title_keys", title_id.encode('utf-8'))
+        return None if i is None else dict(zip(TITLE_COLUMNS, json.loads(self.blob("titles", i))))
+
+    def person_name(self, person_id):
+        i = self.position("person_keys", str(person_id).encode('utf-8'))
+        return None if i is None else self.blob("persons", i)
+
+    # Ids of the titles of a provider, sorted
+    def titles_by_provider(self, provider_id):
+        i = self.position("provider_keys", int(provider_id))
+        return [] if i is None else self.ids("title_keys", self.values("provider_titles", "titles", i))
+
+    # (person_id, name, actor, director) of every credit of a title
+    def cast(self, title_id):
+        i = self.position("title_keys", title_id.encode('utf-8'))
+        if i is None:
+            return []
+        persons = self.values("cast", "persons", i)
+        return list(zip(self.ids("person_keys", persons), [self.blob("persons", p) for p in persons.tolist()],
+                        self.values("cast", "actor", i).tolist(), self.values("cast", "director", i).tolist()))
+
+    # (title_id, actor, director) of every credit of a person
+    def filmography(self, person_id):
+        i = self.position("person_keys", str(person_id).encode('utf-8'))
+        if i is None:
+            return []
+        return list(zip(self.ids("title_keys", self.values("filmography", "titles", i)),
+                        self.values("filmography", "actor", i).tolist(),
+                        self.values("filmography", "director", i).tolist()))
+
+    # Ids of the titles with every genre of genres and every country of countries, only among the titles of
+    # provider_id when given, sorted. Each value is one bit test over the bitset column.
+    def filter_titles(self, genres=(), countries=(), provider_id=None):
+        positions = None
+        if provider_id is not None:
+            i = self.position("provider_keys", int(provider_id))
+            if i is None:
+                return []
+            positions = self.values("provider_titles", "titles", i)
+        for column, values in (("genres", genres), ("production_countries", countries)):
+            if not values:
+                continue
+            codes = self.codes[column]
+            if any(value not in codes for value in values):
+                return []
+            bitsets = self.arrays["titles." + column]
+            mask = np.zeros(bitsets.shape[1], dtype=np.uint64)
+            for value in values:
+                mask[codes[value] // 64] |= np.uint64(1 << (codes[value] % 64))
+            selected = ((bitsets if positions is None else bitsets[positions]) & mask == mask).all(axis=1)
+            positions = np.flatnonzero(selected) if positions is None else positions[selected]
+        if positions is None:
+            positions = np.arange(len(self.arrays["title_keys"]))
+        return self.ids("title_keys", positions)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the memory-mapped catalogue index")
+    parser.add_argument("--directory", default=SCRIPT_DIRECTORY, help="directory with the final CSV tables")
+    parser.add_argument("--index", help="index directory, default catalogue_index in --directory")
+    parser.add_argument("query", nargs="*", metavar="QUERY",
+                        help="title ID, provider ID, cast ID, filmography ID or filter; build the index when empty")
+    parser.add_argument("--genre", action="append", default=[], help="filter: titles with this genre (repeatable)")
+    parser.add_argument("--country", action="append", default=[],
+                        help="filter: titles produced in this country (repeatable)")
+    parser.add_argument("--provider", help="filter: only the titles of this provider ID")
+    args = parser.parse_args()
+    index_directory = args.index or os.path.join(args.directory, INDEX_DIRECTORY)
+
+    if not args.query:
+        start = time.perf_counter()
+        manifest = build_index(args.directory, index_directory)
+        print(f"Index built in {index_directory} in {time.perf_counter() - start:.2f} s: {manifest_summary(manifest)}")
+    else:
+        index = CatalogueIndex(index_directory)
+        if args.query == ["filter"]:
+            print(json.dumps(index.filter_titles(args.genre, args.country, args.provider), indent=2))
+            parser.exit()
+        queries = {"title": index.title, "provider": index.titles_by_provider, "cast": index.cast,
+                   "filmography": index.filmography}
+        if len(args.query) != 2 or args.query[0] not in queries:
+            parser.error(f"a query is one of {list(queries)} followed by an id")
+        print(json.dumps(queries[args.query[0]](args.query[1]), ensure_ascii=False, indent=2))
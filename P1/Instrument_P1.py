@@ -0,0 +1,118 @@
+import cProfile
+import functools
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# With P1_METRICS_FILE=<file> every finished stage appends one JSON line to it, metrics are off when it is not set.
+# P1_TRACEMALLOC=1 adds the peak of traced Python allocations per stage (slow), P1_PROFILE_DIR=<dir> dumps a cProfile
+# of every outermost stage to <dir>/<stage>-<pid>-<n>.prof.
+METRICS_FILE = os.environ.get("P1_METRICS_FILE", "")
+TRACE_MEMORY = os.environ.get("P1_TRACEMALLOC", "") == "1"
+PROFILE_DIRECTORY = os.environ.get("P1_PROFILE_DIR", "")
+
+# Stages currently running in this process, innermost last
+active_stages = []
+# Lists the metrics of every outermost stage finished in this process are appended to (see collect_stages)
+collectors = []
+profile_count = 0
+
+
+def max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def write_metrics(metrics):
+    if not METRICS_FILE:
+        return
+    # One write per line in append mode, so stages finishing in pool workers do not interleave
+    with open(METRICS_FILE, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(metrics) + "\n")
+
+
+# Set counters of the innermost running stage, e.g. record(rows_in=..., rows_out=..., duplicates_dropped=...)
+def record(**counters):
+    if active_stages:
+        active_stages[-1]["metrics"].update(counters)
+
+
+@contextmanager
+def stage(name, **fields):
+    global profile_count
+    if TRACE_MEMORY and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    tracing = tracemalloc.is_tracing()
+    if tracing and active_stages:
+        # The peak is reset for this stage, keep what the enclosing stage reached so far
+        parent = active_stages[-1]
+        parent["peak"] = max(parent["peak"], tracemalloc.get_traced_memory()[1])
+    if tracing:
+        tracemalloc.reset_peak()
+
+    profiler = None
+    if PROFILE_DIRECTORY and not any(running["profiler"] for running in active_stages):
+        profiler = cProfile.Profile()
+
+    current = {"metrics": {"stage": name, **fields}, "peak": 0, "profiler": profiler}
+    active_stages.append(current)
+    started = time.time()
+    start = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+        seconds = time.perf_counter() - start
+        active_stages.pop()
+
+        metrics = current["metrics"]
+        metrics["started"] = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started))
+        metrics["seconds"] = round(seconds, 4)
+        metrics["max_rss_mb"] = round(max_rss_mb(), 2)
+        if tracing:
+            peak = max(current["peak"], tracemalloc.get_traced_memory()[1])
+            metrics["peak_traced_mb"] = round(peak / (1024 * 1024), 2)
+            if active_stages:
+                active_stages[-1]["peak"] = max(active_stages[-1]["peak"], peak)
+        metrics["pid"] = os.getpid()
+        if profiler:
+            os.makedirs(PROFILE_DIRECTORY, exist_ok=True)
+            profile_count += 1
+            profile_file = os.path.join(PROFILE_DIRECTORY, f"{name}-{os.getpid()}-{profile_count}.prof")
+            profiler.dump_stats(profile_file)
+            metrics["profile"] = profile_file
+        write_metrics(metrics)
+        if not active_stages:
+            for stages in collectors:
+                stages.append(metrics)
+
+
+# Append the metrics of the outermost stages finished in this process while the block runs to stages, whether or not
+# they are written to METRICS_FILE
+@contextmanager
+def collect_stages(stages):
+    collectors.append(stages)
+    try:
+        yield stages
+    finally:
+        collectors.remove(stages)
+
+
+# Decorator running the whole function as a stage. String arguments are recorded as the stage "inputs".
+def instrumented(name=None):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            inputs = [value for value in list(args) + list(kwargs.values()) if isinstance(value, str)]
+            with stage(name or function.__name__, **({"inputs": inputs} if inputs else {})):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
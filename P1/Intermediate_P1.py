@@ -0,0 +1,70 @@
+import csv
+import importlib.util
+import os
+
+# Format of the intermediate files passed between stages: "csv" or "arrow" (Arrow IPC file, read through a memory
+# map). Arrow needs pyarrow, without it the stages fall back to CSV. Final deliverables are always CSV. pyarrow is only
+# imported when an Arrow file is written or read, so CSV runs do not pay for loading it.
+INTERMEDIATE_FORMAT = os.environ.get("P1_INTERMEDIATE_FORMAT", "csv")
+EXTENSIONS = {"csv": ".csv", "arrow": ".arrow"}
+# Rows per Arrow record batch, writers and readers never hold more than one batch of Python rows
+BATCH_SIZE = 65536
+
+if INTERMEDIATE_FORMAT == "arrow" and importlib.util.find_spec("pyarrow") is None:
+    print("pyarrow is not installed, intermediate files are written as CSV")
+    INTERMEDIATE_FORMAT = "csv"
+
+
+# Name of the intermediate file for `filename` in the configured format
+def intermediate_filename(filename, format=None):
+    return os.path.splitext(filename)[0] + EXTENSIONS[format or INTERMEDIATE_FORMAT]
+
+
+def write_arrow_batch(writer, header, batch):
+    import pyarrow as pa
+
+    columns = list(zip(*batch))
+    writer.write_batch(pa.record_batch([pa.array(column, type=pa.string()) for column in columns], names=header))
+
+
+# Write header + rows, as Arrow IPC if filepath ends with ".arrow", as CSV otherwise
+def write_rows(filepath, header, rows):
+    if not filepath.endswith(EXTENSIONS["arrow"]):
+        with open(filepath, 'w', newline='', encoding='utf-8') as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(header)
+            writer.writerows(rows)
+        return
+
+    import pyarrow as pa
+
+    schema = pa.schema([(name, pa.string()) for name in header])
+    with pa.OSFile(filepath, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == BATCH_SIZE:
+                write_arrow_batch(writer, header, batch)
+                batch = []
+        if batch:
+            write_arrow_batch(writer, header, batch)
+
+
+# Yield the rows (without header) of a file written by write_rows as tuples of strings
+def read_rows(filepath):
+    if not filepath.endswith(EXTENSIONS["arrow"]):
+        with open(filepath, 'r', newline='', encoding='utf-8') as infile:
+            reader = csv.reader(infile)
+            next(reader)  # Skip the header row
+            for row in reader:
+                yield tuple(row)
+        return
+
+    import pyarrow as pa
+
+    # The memory map makes the record batches zero-copy views of the file, only the current batch becomes Python rows
+    with pa.memory_map(filepath, 'r') as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            yield from zip(*(column.to_pylist() for column in batch.columns))
@@ -0,0 +1,145 @@
+import csv
+import os
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory file locks (Windows): runs sharing a keys directory must then not overlap
+    fcntl = None
+
+KEYS_DIRECTORY = "surrogate_keys"
+LOCK_FILE = "keys.lock"
+
+
+# Dictionary encoding of one kind of key: every distinct key gets an integer surrogate id (1, 2, 3... in order of
+# first appearance). The ids are persisted in <directory>/<kind>.csv, which is only ever appended to, so a key keeps
+# its id in every later run and ids are never reused. Keys are strings, or for link rows tuples of ids of other
+# dictionaries. With directory None the dictionary only lives in memory.
+class KeyDictionary:
+    def __init__(self, kind, key_columns, directory=KEYS_DIRECTORY):
+        self.kind = kind
+        self.key_columns = key_columns
+        self.path = os.path.join(directory, kind + ".csv") if directory else None
+        self.ids = {}
+        # keys[id] is the key of id, id 0 is never assigned
+        self.keys = [None]
+        # Bytes of the file read or written so far
+        self.file_size = 0
+        self.load()
+
+    def __len__(self):
+        return len(self.keys) - 1
+
+    # Read the ids appended to the file since the last load or save, all of them the first time. They have to follow
+    # on from the ids of this dictionary, so there can be no unsaved ids of its own when another run appended some.
+    def load(self):
+        if self.path and os.path.exists(self.path):
+            composite = len(self.key_columns) > 1
+            with open(self.path, newline='', encoding='utf-8') as f:
+                f.seek(self.file_size)
+                reader = csv.reader(f)
+                if self.file_size == 0:
+                    next(reader, None)  # Skip the header row
+                for row in reader:
+                    if not row:
+                        continue
+                    if int(row[0]) != len(self.keys):
+                        raise ValueError(f"{self.path}: id {row[0]} out of sequence, expected {len(self.keys)}")
+                    key = tuple(int(value) for value in row[1:]) if composite else row[1]
+                    self.ids[key] = len(self.keys)
+                    self.keys.append(key)
+                self.file_size = os.fstat(f.fileno()).st_size
+        self.saved = len(self.keys)
+
+    def encode(self, key):
+        key_id = self.ids.get(key)
+        if key_id is None:
+            key_id = self.ids[key] = len(self.keys)
+            self.keys.append(key)
+        return key_id
+
+    def decode(self, key_id):
+        return self.keys[key_id]
+
+    # Append the ids assigned since the last save
+    def save(self):
+        if not self.path or self.saved == len(self.keys):
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        new_file = not os.path.exists(self.path)
+        with open(self.path, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(['id'] + self.key_columns)
+            if len(self.key_columns) > 1:
+                writer.writerows([key_id, *key] for key_id, key in enumerate(self.keys[self.saved:], self.saved))
+            else:
+                writer.writerows([key_id, key] for key_id, key in enumerate(self.keys[self.saved:], self.saved))
+        self.file_size = os.path.getsize(self.path)
+        self.saved = len(self.keys)
+
+
+# The surrogate key dictionaries of the catalogue: titles, persons and characters, and the link rows of
+# final_provider_movie.csv (provider id, title), person_titles.csv (title, person) and person_characters.csv (person,
+# title, character). The pipelines join and deduplicate on these ids and only write the string keys back out. Each
+# dictionary is loaded the first time it is used.
+# From that first use until save() the keys hold the lock of their directory, so two runs started together (the
+# titles and the credits pipeline) can not both hand out the ids that follow the files: the second one waits. Used
+# again after save(), the keys take the lock again and first read the ids other runs appended in the meantime.
+class SurrogateKeys:
+    def __init__(self, directory=KEYS_DIRECTORY):
+        self.directory = directory
+        self.dictionaries = {}
+        self.lock_file = None
+
+    def dictionary(self, kind, key_columns):
+        if self.lock_file is None and self.directory and fcntl:
+            os.makedirs(self.directory, exist_ok=True)
+            self.lock_file = open(os.path.join(self.directory, LOCK_FILE), 'a')
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+            for dictionary in self.dictionaries.values():
+                dictionary.load()
+        if kind not in self.dictionaries:
+            self.dictionaries[kind] = KeyDictionary(kind, key_columns, self.directory)
+        return self.dictionaries[kind]
+
+    @property
+    def titles(self):
+        return self.dictionary("titles", ["title_id"])
+
+    @property
+    def persons(self):
+        return self.dictionary("persons", ["person_id"])
+
+    @property
+    def characters(self):
+        return self.dictionary("characters", ["character"])
+
+    @property
+    def provider_titles(self):
+        return self.dictionary("provider_titles", ["provider_id", "title"])
+
+    @property
+    def person_titles(self):
+        return self.dictionary("person_titles", ["title", "person"])
+
+    @property
+    def person_characters(self):
+        return self.dictionary("person_characters", ["person", "title", "character"])
+
+    # Persist the ids assigned to the dictionaries used so far and let other runs have the keys
+    def save(self):
+        for dictionary in self.dictionaries.values():
+            dictionary.save()
+        if self.lock_file is not None:
+            # Closing the file releases the lock
+            self.lock_file.close()
+            self.lock_file = None
+
+
+# Surrogate keys of a pipeline run (Pipeline_P1.run_stages state), kept in directory next to the tables they key,
+# loaded once and shared by its stages
+def run_keys(directory, state):
+    if 'keys' not in state:
+        state['keys'] = SurrogateKeys(os.path.join(directory, KEYS_DIRECTORY))
+    return state['keys']
@@ -0,0 +1,157 @@
+import csv
+import itertools
+import os
+import re
+from collections import defaultdict
+
+from Instrument_P1 import instrumented, record
+
+MATCHES_FILE = "title_matches.csv"
+# Titles in the same block are only matched when their score reaches MATCH_THRESHOLD
+MATCH_THRESHOLD = 0.8
+# Blocks with more titles than this are skipped (a very common title in a very busy year) so one block can not make
+# the stage quadratic again
+MAX_BLOCK_SIZE = 200
+
+
+def normalize_title(title):
+    from unidecode import unidecode
+    return re.sub(r'[^a-z0-9]+', ' ', unidecode(title.lower())).strip()
+
+
+# Blocking keys of a title: its normalized title with its release year, and its imdb_id when it has one.
+# Only titles sharing a key are ever compared.
+def blocking_keys(title, release_year, imdb_id):
+    keys = []
+    normalized = normalize_title(title)
+    if normalized and release_year == release_year:  # not NaN
+        keys.append(("title", normalized, release_year))
+    if imdb_id:
+        keys.append(("imdb_id", imdb_id))
+    return keys
+
+
+# Score of two candidate titles (dicts of one row of the titles table) between 0 and 1, and the evidence it rests on.
+# A shared imdb_id is a match, two different imdb_ids never are. Otherwise titles of the same type (they already
+# share title and release year) are scored on runtime and genres (Jaccard similarity of their bitsets).
+def match_score(title, other):
+    if title['type'] != other['type']:
+        return 0.0, None
+    if title['imdb_id'] and other['imdb_id']:
+        return (1.0, "imdb_id") if title['imdb_id'] == other['imdb_id'] else (0.0, None)
+    if normalize_title(title['title']) != normalize_title(other['title']) or \
+            title['release_year'] != other['release_year']:
+        return 0.0, None
+
+    runtime, other_runtime = title['runtime'], other['runtime']
+    if runtime == runtime and other_runtime == other_runtime and max(runtime, other_runtime) > 0:
+        runtime_similarity = 1 - abs(runtime - other_runtime) / max(runtime, other_runtime)
+    else:
+        runtime_similarity = 0.5
+    genres, other_genres = title['_genres'], other['_genres']
+    genre_similarity = bin(genres & other_genres).count("1") / bin(genres | other_genres).count("1") \
+        if genres or other_genres else 0.5
+    return 0.5 * runtime_similarity + 0.5 * genre_similarity, "title_year"
+
+
+def find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+# Find titles listed under different ids (by different providers) in a titles table (Merge_P1.titles_table).
+# Titles are grouped into blocks by blocking_keys and only pairs inside a block are scored. Matched titles are
+# clustered transitively, except that a cluster never takes in two different imdb_ids, not even through a title
+# without one matched to both; the canonical id of a cluster is its id seen first in the table.
+# Returns the match table: a list of (id, canonical_id, score, method), one per id that is merged into another.
+@instrumented()
+def match_titles(table, threshold=MATCH_THRESHOLD, max_block_size=MAX_BLOCK_SIZE):
+    titles = table.drop_duplicates('id')[['id', 'title', 'type', 'release_year', 'runtime', '_genres',
+                                          'imdb_id']].to_dict('records')
+
+    blocks = defaultdict(list)
+    for i, title in enumerate(titles):
+        for key in blocking_keys(title['title'], title['release_year'], title['imdb_id']):
+            blocks[key].append(i)
+
+    parent = list(range(len(titles)))
+    # root -> the imdb_id of its cluster, for the clusters that have one
+    cluster_imdb_ids = {i: title['imdb_id'] for i, title in enumerate(titles) if title['imdb_id']}
+    evidence = {}
+    pairs = 0
+    skipped_blocks = 0
+    refused = 0
+    for block in blocks.values():
+        if len(block) > max_block_size:
+            skipped_blocks += 1
+            continue
+        for i, j in itertools.combinations(block, 2):
+            if (i, j) in evidence:
+                continue
+            pairs += 1
+            score, method = match_score(titles[i], titles[j])
+            evidence[(i, j)] = (score, method)
+            if score >= threshold:
+                root, other_root = find(parent, i), find(parent, j)
+                if root == other_root:
+                    continue
+                imdb_id, other_imdb_id = cluster_imdb_ids.get(root), cluster_imdb_ids.get(other_root)
+                if imdb_id and other_imdb_id and imdb_id != other_imdb_id:
+                    refused += 1
+                    continue
+                # The smaller index, the id seen first, stays the root
+                root, other_root = min(root, other_root), max(root, other_root)
+                parent[other_root] = root
+                if imdb_id or other_imdb_id:
+                    cluster_imdb_ids[root] = imdb_id or other_imdb_id
+
+    # A row for every title of a cluster but its root, from the pairs that ended up inside one cluster
+    matches = []
+    for (i, j), (score, method) in evidence.items():
+        canonical = find(parent, i)
+        if score >= threshold and find(parent, j) == canonical:
+            matches.extend((titles[k]['id'], titles[canonical]['id'], round(score, 4), method)
+                           for k in (i, j) if k != canonical)
+    # One line per merged id, with the best evidence found for it
+    best = {}
+    for match in sorted(matches, key=lambda match: -match[2]):
+        best.setdefault(match[0], match)
+    matches = sorted(best.values())
+
+    record(rows_in=len(titles), blocks=len(blocks), skipped_blocks=skipped_blocks, pairs_scored=pairs,
+           refused_imdb_merges=refused, rows_out=len(matches))
+    return matches
+
+
+def save_title_matches(matches, filename=MATCHES_FILE):
+    with open(filename, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'canonical_id', 'score', 'method'])
+        writer.writerows(matches)
+
+
+# The match table of the titles pipeline run on directory, where the credits pipeline reads it back
+def matches_file(directory):
+    return os.path.join(directory, MATCHES_FILE)
+
+
+# id -> canonical id of a match table file, empty when there is none
+def read_title_matches(filename=MATCHES_FILE):
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader)
+        return {row[0]: row[1] for row in reader if row}
+
+
+# Give every matched title its canonical id, so merge_titles_table merges it with the rules used for titles listed
+# under the same id
+def apply_title_matches(table, canonical_ids):
+    if not canonical_ids:
+        return table
+    table = table.copy()
+    table['id'] = table['id'].map(lambda title_id: canonical_ids.get(title_id, title_id))
+    return table
@@ -0,0 +1,125 @@
+import pandas as pd
+
+from Instrument_P1 import instrumented, record
+from Store_P1 import TITLE_COLUMNS, LIST_COLUMNS, parse_list_text, list_text
+
+# Columns the rules compare. Missing values become -inf so they compare like the empty strings did before
+# ('' < '1.0' and '' == '').
+COMPARED_COLUMNS = ['release_year', 'seasons', 'imdb_votes']
+# Age certifications from least to most restrictive, used by the "strictest" combine
+AGE_CERTIFICATION_ORDER = ['', 'G', 'TV-Y', 'TV-G', 'TV-Y7', 'PG', 'TV-PG', 'PG-13', 'TV-14', 'R', 'TV-MA', 'NC-17']
+
+
+class MergeRule:
+    # condition(merged, movie) gets the typed columns of the merged titles and of the incoming rows, aligned on id,
+    # and returns a boolean Series. Where it holds, every column in `combine` is combined with "take" (value of the
+    # incoming row), "union" (bitwise OR of the list bitsets, the list text keeps the first-seen order) or
+    # "strictest" (most restrictive certification).
+    def __init__(self, name, condition, combine):
+        self.name = name
+        self.condition = condition
+        self.combine = combine
+
+
+NEWEST_COLUMNS = ['seasons', 'description', 'runtime', 'tmdb_popularity', 'tmdb_score', 'release_year']
+
+# Same policy as merge_movies, in the same order, but with numeric comparisons. The age certification of a merged
+# title is the strictest of the two: a newer version "shall not have less restriction" (merge_movies took the newer
+# one, or joined both when the votes decided).
+MERGE_RULES = [
+    # Same imdb_id: more seasons or a more recent release year means more recent information
+    MergeRule("newest wins",
+              lambda merged, movie: (merged['imdb_id'] == movie['imdb_id']) &
+                                    ((movie['seasons'] > merged['seasons']) |
+                                     (movie['release_year'] > merged['release_year'])),
+              {**{column: "take" for column in NEWEST_COLUMNS}, 'age_certification': "strictest", 'genres': "union",
+               'production_countries': "union"}),
+    # Different imdb_id for the same release year: the one with more votes is the current one
+    MergeRule("max votes wins",
+              lambda merged, movie: (merged['imdb_id'] != movie['imdb_id']) &
+                                    (movie['release_year'] == merged['release_year']) &
+                                    (movie['imdb_votes'] > merged['imdb_votes']) &
+                                    (movie['seasons'] >= merged['seasons']),
+              {**{column: "take" for column in NEWEST_COLUMNS + ['imdb_votes', 'imdb_id', 'imdb_score']},
+               'age_certification': "strictest", 'genres': "union", 'production_countries': "union"}),
+]
+
+
+# Union of two list texts, values in first-seen order
+def union(text, other_text):
+    return list_text(dict.fromkeys(parse_list_text(text) + parse_list_text(other_text)))
+
+
+def strictest(certification, other_certification):
+    rank = {value: i for i, value in enumerate(AGE_CERTIFICATION_ORDER)}
+    return max(certification, other_certification, key=lambda value: rank.get(value, -1))
+
+
+COMBINES = {"union": union, "strictest": strictest}
+
+
+# Typed table of a TitleStore: its columns (numbers as float64 with NaN for missing values) plus "_<name>" copies of
+# COMPARED_COLUMNS with -inf for missing values and of LIST_COLUMNS as bitsets (TitleStore.bitsets)
+@instrumented()
+def titles_table(store):
+    table = pd.DataFrame({column: store.numeric_column(column) if column in store.missing
+                          else pd.Series(store.columns[column], dtype=object)
+                          for column in TITLE_COLUMNS})
+    for column in COMPARED_COLUMNS:
+        table['_' + column] = table[column].fillna(float('-inf'))
+    for column in LIST_COLUMNS:
+        table['_' + column] = pd.Series(store.bitsets[column], dtype=object)
+    return table
+
+
+def typed_view(table):
+    view = table[['imdb_id']].copy()
+    for column in COMPARED_COLUMNS:
+        view[column] = table['_' + column]
+    return view
+
+
+# Merge the rows sharing an id. Titles listed once (most of them) pass through untouched; the rest are folded in
+# rounds: round k merges the k-th listing of every id into its merged row, for all ids at once.
+# Returns a table with TITLE_COLUMNS, in order of first appearance of each id, like merge_movies.
+@instrumented()
+def merge_titles_table(table, rules=MERGE_RULES):
+    table = table.reset_index(drop=True)
+    member = table.groupby('id', sort=False).cumcount()
+
+    merged = table[member == 0].set_index('id', drop=False)
+    rounds = int(member.max()) if len(table) else 0
+    for k in range(1, rounds + 1):
+        movies = table[member == k].set_index('id', drop=False)
+        for rule in rules:
+            current = merged.loc[movies.index]
+            fires = rule.condition(typed_view(current), typed_view(movies)).to_numpy()
+            if not fires.any():
+                continue
+            ids = movies.index[fires]
+            for column, combine in rule.combine.items():
+                if combine == "take":
+                    values = movies.loc[ids, column]
+                elif combine == "union":
+                    # Bitwise OR of the bitsets, the text is only rebuilt for the titles that gain values
+                    bitsets = current.loc[ids, '_' + column].to_numpy()
+                    union_bitsets = bitsets | movies.loc[ids, '_' + column].to_numpy()
+                    values = [text if union_bitset == bitset else union(text, other_text)
+                              for text, other_text, bitset, union_bitset in zip(current.loc[ids, column],
+                                                                                movies.loc[ids, column], bitsets,
+                                                                                union_bitsets)]
+                    merged.loc[ids, '_' + column] = pd.Series(union_bitsets, index=ids, dtype=object)
+                else:
+                    values = [COMBINES[combine](a, b)
+                              for a, b in zip(current.loc[ids, column], movies.loc[ids, column])]
+                merged.loc[ids, column] = pd.Series(values, index=ids, dtype=merged[column].dtype)
+                if column in COMPARED_COLUMNS:
+                    merged.loc[ids, '_' + column] = movies.loc[ids, '_' + column]
+
+    record(rows_in=len(table), rows_out=len(merged), duplicates_dropped=len(table) - len(merged))
+    return merged[TITLE_COLUMNS].reset_index(drop=True)
+
+
+# Rows of the merged table as objects with the Movie attributes, so save_movies_to_csv can write them
+def table_to_movies(table):
+    return table[TITLE_COLUMNS].itertuples(index=False, name="Title")
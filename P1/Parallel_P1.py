@@ -0,0 +1,26 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Number of worker processes for the per-provider stages, P1_WORKERS overrides the number of cores
+WORKERS = int(os.environ.get("P1_WORKERS", os.cpu_count() or 1))
+
+
+# Like map(function, *iterables) but run in a process pool. Results always come back in input order, whatever the
+# number of workers, so the merge that follows is deterministic.
+def map_in_pool(function, *iterables, workers=WORKERS):
+    arguments = list(zip(*iterables))
+    if workers <= 1 or len(arguments) <= 1:
+        return [function(*args) for args in arguments]
+    with ProcessPoolExecutor(max_workers=min(workers, len(arguments))) as executor:
+        return list(executor.map(function, *zip(*arguments)))
+
+
+# Generator version of map_in_pool: results are yielded in input order as soon as they are ready, so the caller works
+# on the first ones while the pool is still busy with the others
+def imap_in_pool(function, *iterables, workers=WORKERS):
+    arguments = list(zip(*iterables))
+    if workers <= 1 or len(arguments) <= 1:
+        yield from (function(*args) for args in arguments)
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(arguments))) as executor:
+        yield from executor.map(function, *zip(*arguments))
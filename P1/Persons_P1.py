@@ -0,0 +1,237 @@
+import csv
+import os
+import zlib
+from collections import defaultdict
+
+from Instrument_P1 import instrumented, record
+from Keys_P1 import SurrogateKeys
+from Match_P1 import find
+
+MAPPING_FILE = "person_mapping.csv"
+# MinHash signatures of NUM_PERMUTATIONS values, cut into BANDS bands. Two names land in the same bucket of a band
+# with probability s ** (NUM_PERMUTATIONS / BANDS) for a trigram Jaccard similarity s, so pairs above ~0.6 are
+# almost always found and pairs below ~0.3 almost never.
+NUM_PERMUTATIONS = 32
+BANDS = 8
+# Buckets holding more names than this (very short or very common names) are not expanded into pairs
+MAX_BUCKET_SIZE = 50
+# A pair is merged when the names are this similar...
+NAME_THRESHOLD = 0.85
+# ...and they co-appear: in the same title, or with at least this many collaborators in common
+MIN_SHARED_COLLABORATORS = 3
+# Pairs whose signatures agree on less than this share of their values are dropped before the exact comparison
+ESTIMATE_THRESHOLD = 0.6
+# Name parts telling apart relatives with the same name ("douglas fairbanks" and "douglas fairbanks jr.")
+GENERATION_TOKENS = {'jr', 'sr', 'ii', 'iii', 'iv', 'v', 'vi', 'vii', 'viii'}
+MERSENNE_PRIME = (1 << 61) - 1
+
+
+def name_tokens(name):
+    return name.replace(".", " ").split()
+
+
+# Trigrams of a name with its words sorted, so "kim minjun" and "minjun kim" get the same trigrams
+def shingles(name):
+    padded = f" {' '.join(sorted(name_tokens(name)))} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)} or {padded}
+
+
+def jaccard(name_shingles, other_shingles):
+    return len(name_shingles & other_shingles) / len(name_shingles | other_shingles)
+
+
+# True when two similar names can still not be the same person: one adds words to the other ("michael jordan" and
+# "michael b. jordan") or they carry different generations ("king george v" and "king george vi")
+def names_conflict(name, other_name):
+    tokens, other_tokens = set(name_tokens(name)), set(name_tokens(other_name))
+    if tokens != other_tokens and (tokens < other_tokens or other_tokens < tokens):
+        return True
+    return tokens & GENERATION_TOKENS != other_tokens & GENERATION_TOKENS
+
+
+# Same words in another order ("keith david" and "david keith")
+def names_reordered(name, other_name):
+    tokens, other_tokens = name_tokens(name), name_tokens(other_name)
+    return tokens != other_tokens and sorted(tokens) == sorted(other_tokens)
+
+
+# MinHash signature of every set of trigrams: a (len(name_shingles), num_permutations) array. The trigram hashes of all
+# names are kept in one flat array, so each permutation is a single vectorized pass with a minimum per name.
+def minhash_signatures(name_shingles, num_permutations=NUM_PERMUTATIONS, seed=0):
+    import numpy as np
+
+    hashes = []
+    offsets = []
+    for trigrams in name_shingles:
+        offsets.append(len(hashes))
+        hashes.extend(zlib.crc32(shingle.encode('utf-8')) for shingle in trigrams)
+    hashes = np.array(hashes, dtype=np.uint64)
+    offsets = np.array(offsets, dtype=np.int64)
+
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 32, size=num_permutations, dtype=np.uint64)
+    b = rng.integers(0, 1 << 32, size=num_permutations, dtype=np.uint64)
+    signatures = np.empty((len(name_shingles), num_permutations), dtype=np.uint64)
+    for k in range(num_permutations):
+        # a, b and the crc32 hashes are below 2**32, so a * hash + b can not overflow 64 bits
+        signatures[:, k] = np.minimum.reduceat((a[k] * hashes + b[k]) % MERSENNE_PRIME, offsets)
+    return signatures
+
+
+# Index pairs of names sharing a bucket in at least one band, as an (n, 2) array with i < j, whose signatures agree on
+# at least estimate_threshold of their values
+def candidate_pairs(signatures, bands=BANDS, max_bucket_size=MAX_BUCKET_SIZE, estimate_threshold=ESTIMATE_THRESHOLD):
+    import numpy as np
+
+    rows = signatures.shape[1] // bands
+    multipliers = np.random.default_rng(1).integers(1, 1 << 63, size=rows, dtype=np.uint64)
+    pairs = [np.empty((0, 2), dtype=np.int64)]
+    skipped_buckets = 0
+    for band in range(bands):
+        # One 64 bit key per name and band (wrapping arithmetic, collisions only add a few extra candidates)
+        keys = (signatures[:, band * rows:(band + 1) * rows] * multipliers).sum(axis=1, dtype=np.uint64)
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        sizes = np.diff(np.r_[starts, len(keys)])
+        skipped_buckets += int((sizes > max_bucket_size).sum())
+        # All buckets of one size expand to pairs at once
+        for size in np.unique(sizes[(sizes > 1) & (sizes <= max_bucket_size)]).tolist():
+            first, second = np.triu_indices(size, 1)
+            bucket_starts = starts[sizes == size][:, None]
+            i, j = order[bucket_starts + first].ravel(), order[bucket_starts + second].ravel()
+            estimates = (signatures[i] == signatures[j]).mean(axis=1)
+            keep = estimates >= estimate_threshold
+            pairs.append(np.column_stack([np.minimum(i, j)[keep], np.maximum(i, j)[keep]]))
+
+    return np.unique(np.concatenate(pairs), axis=0), skipped_buckets
+
+
+# Number of persons other than the two found in a title of each of them, worked out for this pair only
+def shared_collaborator_count(person_id, other_id, titles_of, persons_of):
+    collaborators = set().union(*(persons_of[title_id] for title_id in titles_of[person_id]))
+    shared = set().union(*(persons_of[title_id] & collaborators for title_id in titles_of[other_id]))
+    return len(shared - {person_id, other_id})
+
+
+def person_sort_key(person_id):
+    return (0, int(person_id), '') if person_id.isdigit() else (1, 0, person_id)
+
+
+# Find persons listed under several ids. unique_persons maps person -> normalized name and person_titles is keyed by
+# (title, person), on the surrogate ids of keys, as built by Credits_P1.build_credit_tables. Candidate pairs come from
+# MinHash LSH over the name trigrams; a candidate is merged when the names are similar enough, do not conflict, and
+# the two ids co-appear (shared title or shared collaborators, a shared title for reordered names). Matches are
+# clustered and the lowest person id (not surrogate id) of a cluster is its canonical id.
+# Returns the mapping: a list of (person, canonical person, name_similarity, shared_titles, shared_collaborators), one
+# per person merged into another. Collaborators are only counted for pairs without a shared title, shared_collaborators
+# is None for the others.
+@instrumented()
+def resolve_persons(unique_persons, person_titles, keys, name_threshold=NAME_THRESHOLD,
+                    min_shared_collaborators=MIN_SHARED_COLLABORATORS):
+    person_ids = sorted(unique_persons, key=lambda person: person_sort_key(keys.persons.decode(person)))
+    names = [unique_persons[person_id] or '' for person_id in person_ids]
+    name_shingles = [shingles(name) for name in names]
+    pairs, skipped_buckets = candidate_pairs(minhash_signatures(name_shingles))
+
+    titles_of = defaultdict(set)
+    persons_of = defaultdict(set)
+    for title_id, person_id in person_titles:
+        titles_of[person_id].add(title_id)
+        persons_of[title_id].add(person_id)
+
+    parent = list(range(len(person_ids)))
+    evidence = {}
+    for i, j in pairs.tolist():
+        similarity = jaccard(name_shingles[i], name_shingles[j])
+        if similarity < name_threshold or names_conflict(names[i], names[j]):
+            continue
+        person_id, other_id = person_ids[i], person_ids[j]
+        shared_titles = len(titles_of[person_id] & titles_of[other_id])
+        shared_collaborators = None
+        if shared_titles == 0 and not names_reordered(names[i], names[j]):
+            shared_collaborators = shared_collaborator_count(person_id, other_id, titles_of, persons_of)
+        if shared_titles > 0 or (shared_collaborators or 0) >= min_shared_collaborators:
+            evidence[j] = (round(similarity, 4), shared_titles, shared_collaborators)
+            root, other_root = find(parent, i), find(parent, j)
+            if root != other_root:
+                parent[max(root, other_root)] = min(root, other_root)
+
+    mapping = []
+    for i in range(len(person_ids)):
+        root = find(parent, i)
+        if root != i:
+            mapping.append((person_ids[i], person_ids[root], *evidence.get(i, (None, None, None))))
+
+    record(rows_in=len(person_ids), candidate_pairs=len(pairs), skipped_buckets=skipped_buckets,
+           rows_out=len(mapping))
+    return mapping
+
+
+def save_person_mapping(mapping, keys, filename=MAPPING_FILE):
+    persons = keys.persons.keys
+    with open(filename, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'canonical_id', 'name_similarity', 'shared_titles', 'shared_collaborators'])
+        writer.writerows([persons[person], persons[canonical], *evidence] for person, canonical, *evidence in mapping)
+
+
+# Rewrite the credit tables with every person id replaced by its canonical id. Roles of a person listed under
+# several ids in one title are merged like merge_actor_director_lines does.
+@instrumented()
+def apply_person_mapping(person_titles, unique_persons, person_characters, canonical_ids):
+    if not canonical_ids:
+        return person_titles, unique_persons, person_characters
+
+    merged_titles = {}
+    for (title_id, person_id), (actor, director) in person_titles.items():
+        roles = merged_titles.setdefault((title_id, canonical_ids.get(person_id, person_id)), [False, False])
+        roles[0] = roles[0] or actor
+        roles[1] = roles[1] or director
+
+    persons = {person_id: name for person_id, name in unique_persons.items() if person_id not in canonical_ids}
+
+    characters = {}
+    for person, title, character in person_characters:
+        characters[(canonical_ids.get(person, person), title, character)] = None
+
+    record(rows_in=len(person_titles), rows_out=len(merged_titles), persons=len(persons),
+           person_characters=len(characters))
+    return merged_titles, persons, characters
+
+
+# The credit tables as written by Credits_P1.save_credit_tables, in the shapes build_credit_tables returns (keyed on
+# the surrogate ids of keys)
+def read_credit_tables(keys, person_titles_file='person_titles.csv', persons_file='unique_persons.csv',
+                       characters_file='person_characters.csv'):
+    encode_title, encode_person, encode_character = keys.titles.encode, keys.persons.encode, keys.characters.encode
+    with open(person_titles_file, newline='', encoding='utf-8') as f:
+        person_titles = {(encode_title(row['title_id']), encode_person(row['person_id'])):
+                         [row['actor'] == 'True', row['director'] == 'True'] for row in csv.DictReader(f)}
+    with open(persons_file, newline='', encoding='utf-8') as f:
+        unique_persons = {encode_person(row['id']): row['name'] for row in csv.DictReader(f)}
+    person_characters = {}
+    with open(characters_file, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader)
+        for row in reader:
+            if row:
+                # person_title_id is person_id + "_" + title_id, and person ids have no "_"
+                person_id, title_id = row[1].split("_", 1)
+                person_characters[(encode_person(person_id), encode_title(title_id), encode_character(row[2]))] = None
+    return person_titles, unique_persons, person_characters
+
+
+if __name__ == "__main__":
+    import Credits_P1
+
+    # Resolve the persons of the credit tables in this directory and rewrite them with canonical ids
+    script_directory = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_directory)
+    keys = SurrogateKeys()
+    person_titles, unique_persons, person_characters = read_credit_tables(keys)
+    mapping = resolve_persons(unique_persons, person_titles, keys)
+    save_person_mapping(mapping, keys)
+    print(f"{len(mapping)} person ids merged into another one, mapping saved to {MAPPING_FILE}")
+    Credits_P1.save_credit_tables(*apply_person_mapping(person_titles, unique_persons, person_characters,
+                                                        {row[0]: row[1] for row in mapping}), keys)
@@ -0,0 +1,66 @@
+import argparse
+import os
+
+from Parallel_P1 import WORKERS
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PIPELINES = ["titles", "credits", "index"]
+
+
+# Stages of a pipeline, imported on demand so listing or running one pipeline does not load the other
+def pipeline_stages(pipeline):
+    if pipeline == "titles":
+        from Titles_P1 import TITLES_STAGES
+        return TITLES_STAGES
+    if pipeline == "credits":
+        from Credits_P1 import CREDITS_STAGES
+        return CREDITS_STAGES
+    if pipeline == "index":
+        from Index_P1 import INDEX_STAGES
+        return INDEX_STAGES
+    raise ValueError(f"Unknown pipeline {pipeline!r}, expected one of {PIPELINES}")
+
+
+# Run the selected stages (all of them when selected is empty) in pipeline order and return the shared state. Without
+# use_cache the per-provider stages stream from the provider files and write no intermediate files.
+def run_stages(stages, directory, selected=None, workers=WORKERS, use_cache=True):
+    names = [name for name, _ in stages]
+    unknown = [name for name in selected or [] if name not in names]
+    if unknown:
+        raise ValueError(f"Unknown stages {unknown}, expected some of {names}")
+    selected = selected or names
+    state = {'stages': selected, 'workers': workers, 'use_cache': use_cache}
+    for name, run in stages:
+        if name in selected:
+            run(directory, state)
+    return state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the P1 pipelines, or only some of their stages")
+    parser.add_argument("pipeline", nargs="?", choices=PIPELINES + ["all"], default="all")
+    parser.add_argument("--stages", nargs="+", metavar="STAGE", help="stages to run, default all of them")
+    parser.add_argument("--directory", default=SCRIPT_DIRECTORY, help="directory with the provider CSV files")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--no-cache", action="store_true",
+                        help="stream the provider files instead of caching their sanitized/normalized rows")
+    parser.add_argument("--list", action="store_true", help="list the stages of the pipeline and exit")
+    args = parser.parse_args()
+
+    pipelines = {pipeline: pipeline_stages(pipeline)
+                 for pipeline in (PIPELINES if args.pipeline == "all" else [args.pipeline])}
+    if args.list:
+        for pipeline, stages in pipelines.items():
+            print(f"{pipeline}: {' '.join(name for name, _ in stages)}")
+        parser.exit()
+
+    known = [name for stages in pipelines.values() for name, _ in stages]
+    unknown = [name for name in args.stages or [] if name not in known]
+    if unknown:
+        parser.error(f"unknown stages {unknown}, expected some of {known}")
+    for pipeline, stages in pipelines.items():
+        selected = [name for name, _ in stages if name in (args.stages or [])]
+        # Selecting stages of one pipeline skips the other one
+        if args.stages and not selected:
+            continue
+        run_stages(stages, args.directory, selected, args.workers, not args.no_cache)
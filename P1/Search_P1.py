@@ -0,0 +1,324 @@
+import argparse
+import bisect
+import json
+import math
+import os
+import re
+import time
+
+import numpy as np
+
+from Credits_P1 import normalize_text
+from Index_P1 import SCRIPT_DIRECTORY, read_csv_rows, save_array, save_blob, sorted_keys, group_by_key, \
+    provider_title_arrays, map_arrays
+from Store_P1 import TITLE_COLUMNS, Vocabulary
+
+SEARCH_DIRECTORY = "search_index"
+SEARCH_VERSION = 1
+# BM25 parameters. Title and description are scored as one text where a title word counts TITLE_WEIGHT times
+# (a simplified BM25F), so a word of the title ranks a title above the same word in a description.
+K1 = 1.2
+B = 0.75
+TITLE_WEIGHT = 3
+# Longer tokens (URLs, long numbers) are cut to this length, at build and at query time alike
+MAX_TOKEN_LENGTH = 32
+# A prefix expands to at most this many terms, the ones in the most titles
+MAX_PREFIX_TERMS = 256
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+# Query clauses: a "quoted phrase" or a word, a word ending with * is a prefix
+CLAUSE_PATTERN = re.compile(r'"([^"]*)"?|(\S+)')
+
+# On-disk layout, one .npy file per array opened as a read-only memory map (like Index_P1). A title is a document,
+# numbered by the position of its id in title_keys.
+#   title_keys                  sorted title ids
+#   titles.data/.offsets        title of each document
+#   documents.length            length of each document in words, title words counted TITLE_WEIGHT times
+#   titles.genres               genre bitset of each document, a (documents, words) uint64 array (see Index_P1)
+#   provider_keys               sorted provider ids, provider_titles.offsets/.titles their documents
+#   terms                       sorted distinct tokens (bytes)
+#   postings.offsets            the postings of term i are postings.*[offsets[i]:offsets[i + 1]], sorted by document
+#   postings.documents/.title_tf/.description_tf
+#   positions.offsets/.values   word positions of each posting: title words first, then the description words after
+#                               a gap, so a phrase never spans both
+# index.json holds the BM25 statistics (documents, average length, K1, B, TITLE_WEIGHT) and the genre vocabulary.
+
+
+# Words of a text, normalized like the credits (Credits_P1.normalize_text: transliterated to ASCII) and lowercased
+# again, as the transliteration can give capitals ("你好" -> "Ni Hao")
+def tokenize(text):
+    return [token[:MAX_TOKEN_LENGTH] for token in TOKEN_PATTERN.findall((normalize_text(text) or '').lower())]
+
+
+# Index the title and description of every title of directory/final_titles.csv into output_directory, with the genres
+# and providers (final_provider_movie.csv) of the titles for filtering
+def build_search_index(directory=SCRIPT_DIRECTORY, output_directory=None):
+    output_directory = output_directory or os.path.join(directory, SEARCH_DIRECTORY)
+    os.makedirs(output_directory, exist_ok=True)
+    title_column, description_column, genres_column = (TITLE_COLUMNS.index(column)
+                                                       for column in ("title", "description", "genres"))
+
+    titles = {}
+    for row in read_csv_rows(os.path.join(directory, "final_titles.csv")):
+        titles.setdefault(row[0], row)
+    title_keys, title_positions = sorted_keys(titles)
+    save_array(output_directory, "title_keys", title_keys)
+    save_blob(output_directory, "titles", (titles[key][title_column] for key in title_positions))
+    genres = Vocabulary()
+    save_array(output_directory, "titles.genres",
+               genres.bitset_array([genres.text_bitset(titles[key][genres_column]) for key in title_positions]))
+
+    provider_keys, offsets, provider_titles, _ = provider_title_arrays(directory, title_positions)
+    save_array(output_directory, "provider_keys", provider_keys)
+    save_array(output_directory, "provider_titles.offsets", offsets)
+    save_array(output_directory, "provider_titles.titles", provider_titles)
+
+    # One posting per document and term, in document order; term_ids numbers the terms in order of first appearance
+    term_ids = {}
+    posting_terms = []
+    posting_documents = []
+    title_tfs = []
+    description_tfs = []
+    position_counts = []
+    positions = []
+    lengths = []
+    for document, key in enumerate(title_positions):
+        title_tokens = tokenize(titles[key][title_column])
+        description_tokens = tokenize(titles[key][description_column])
+        lengths.append(TITLE_WEIGHT * len(title_tokens) + len(description_tokens))
+        term_positions = {}
+        for position, token in enumerate(title_tokens):
+            term_positions.setdefault(token, []).append(position)
+        for position, token in enumerate(description_tokens, len(title_tokens) + 1):
+            term_positions.setdefault(token, []).append(position)
+        for token, token_positions in term_positions.items():
+            title_tf = bisect.bisect_left(token_positions, len(title_tokens))
+            posting_terms.append(term_ids.setdefault(token, len(term_ids)))
+            posting_documents.append(document)
+            title_tfs.append(title_tf)
+            description_tfs.append(len(token_positions) - title_tf)
+            position_counts.append(len(token_positions))
+            positions.extend(token_positions)
+
+    terms = sorted(term_ids)
+    term_ranks = np.empty(len(terms), dtype=np.int64)
+    term_ranks[[term_ids[term] for term in terms]] = np.arange(len(terms))
+    posting_terms = term_ranks[np.array(posting_terms, dtype=np.int64)]
+    posting_documents = np.array(posting_documents, dtype=np.int32)
+    position_counts = np.array(position_counts, dtype=np.int64)
+    offsets, (posting_documents, title_tfs, description_tfs, order) = group_by_key(
+        posting_terms, len(terms), posting_documents,
+        [posting_documents, np.minimum(title_tfs, 65535).astype(np.uint16),
+         np.minimum(description_tfs, 65535).astype(np.uint16), np.arange(len(posting_terms))])
+    save_array(output_directory, "terms", np.array([term.encode('utf-8') for term in terms], dtype=bytes))
+    save_array(output_directory, "postings.offsets", offsets)
+    save_array(output_directory, "postings.documents", posting_documents)
+    save_array(output_directory, "postings.title_tf", title_tfs)
+    save_array(output_directory, "postings.description_tf", description_tfs)
+
+    # The positions of each posting move with it: a run of position_counts values per posting, in the new order
+    starts = np.zeros(len(position_counts) + 1, dtype=np.int64)
+    np.cumsum(position_counts, out=starts[1:])
+    position_counts = position_counts[order]
+    position_offsets = np.zeros(len(position_counts) + 1, dtype=np.int64)
+    np.cumsum(position_counts, out=position_offsets[1:])
+    source = np.repeat(starts[:-1][order] - position_offsets[:-1], position_counts) + np.arange(position_offsets[-1])
+    save_array(output_directory, "positions.offsets", position_offsets)
+    save_array(output_directory, "positions.values", np.array(positions, dtype=np.int32)[source])
+    save_array(output_directory, "documents.length", np.array(lengths, dtype=np.int32))
+
+    manifest = {"version": SEARCH_VERSION, "documents": len(title_keys), "terms": len(terms),
+                "postings": len(posting_documents), "positions": int(position_offsets[-1]),
+                "average_length": float(np.mean(lengths)) if lengths else 0.0, "k1": K1, "b": B,
+                "title_weight": TITLE_WEIGHT, "max_token_length": MAX_TOKEN_LENGTH, "providers": len(provider_keys),
+                "genres": genres.values}
+    # Written last: an index without a manifest is incomplete
+    with open(os.path.join(output_directory, "index.json"), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+# Manifest to print, with the size of the genre vocabulary instead of its values
+def search_manifest_summary(manifest):
+    return {**manifest, "genres": len(manifest["genres"])}
+
+
+# Parsed query: a list of ("term", token), ("prefix", token) and ("phrase", tokens) clauses. A word the tokenizer cuts
+# in several tokens ("spider-man") is a phrase, a prefix applies to its last token.
+def parse_query(query):
+    clauses = []
+    for phrase, word in CLAUSE_PATTERN.findall(query):
+        tokens = tokenize(phrase if phrase else word)
+        if not tokens:
+            continue
+        if word.endswith("*"):
+            clauses.extend(("term", token) for token in tokens[:-1])
+            clauses.append(("prefix", tokens[-1]))
+        elif len(tokens) > 1:
+            clauses.append(("phrase", tokens))
+        else:
+            clauses.append(("term", tokens[0]))
+    return clauses
+
+
+# Read-only view of a search index built by build_search_index. Every clause of a query gives the sorted documents it
+# matches with their BM25 scores, and the clauses are intersected, so the cost follows the posting lists of the query
+# terms and not the size of the catalogue.
+class SearchIndex:
+    def __init__(self, directory=os.path.join(SCRIPT_DIRECTORY, SEARCH_DIRECTORY)):
+        with open(os.path.join(directory, "index.json"), encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        if self.manifest["version"] != SEARCH_VERSION:
+            raise ValueError(f"Search index version {self.manifest['version']} in {directory}, "
+                             f"expected {SEARCH_VERSION}")
+        self.arrays = map_arrays(directory)
+        self.genre_codes = {value: code for code, value in enumerate(self.manifest["genres"])}
+
+    def term_index(self, token):
+        terms = self.arrays["terms"]
+        i = int(terms.searchsorted(token.encode('utf-8')))
+        if i < len(terms) and terms[i] == token.encode('utf-8'):
+            return i
+        return None
+
+    # Documents of term i, their BM25 scores and the index of their first posting
+    def term_postings(self, i):
+        start, end = self.arrays["postings.offsets"][i:i + 2].tolist()
+        documents = self.arrays["postings.documents"][start:end].astype(np.int64)
+        tf = (self.manifest["title_weight"] * self.arrays["postings.title_tf"][start:end].astype(np.float64)
+              + self.arrays["postings.description_tf"][start:end])
+        k1, b = self.manifest["k1"], self.manifest["b"]
+        idf = math.log(1 + (self.manifest["documents"] - len(documents) + 0.5) / (len(documents) + 0.5))
+        norm = k1 * (1 - b + b * self.arrays["documents.length"][documents] / self.manifest["average_length"])
+        return documents, idf * tf * (k1 + 1) / (tf + norm), start
+
+    def term(self, token):
+        i = self.term_index(token)
+        if i is None:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        return self.term_postings(i)[:2]
+
+    # Documents with a term starting with token, scored by the sum of the matching terms
+    def prefix(self, token):
+        terms = self.arrays["terms"]
+        first = int(terms.searchsorted(token.encode('utf-8')))
+        last = int(terms.searchsorted(token.encode('utf-8') + b'\xff'))
+        indexes = np.arange(first, last)
+        if len(indexes) > MAX_PREFIX_TERMS:
+            offsets = self.arrays["postings.offsets"]
+            counts = offsets[first + 1:last + 1] - offsets[first:last]
+            indexes = np.sort(indexes[np.argsort(-counts, kind='stable')[:MAX_PREFIX_TERMS]])
+        postings = [self.term_postings(i)[:2] for i in indexes.tolist()]
+        if not postings:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        documents, inverse = np.unique(np.concatenate([documents for documents, _ in postings]), return_inverse=True)
+        return documents, np.bincount(inverse, weights=np.concatenate([scores for _, scores in postings]))
+
+    # Word positions of an array of postings, concatenated, and the index in postings of each one
+    def posting_positions(self, postings):
+        offsets = self.arrays["positions.offsets"]
+        starts = offsets[postings]
+        counts = offsets[postings + 1] - starts
+        firsts = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=firsts[1:])
+        values = self.arrays["positions.values"][np.repeat(starts - firsts[:-1], counts) + np.arange(firsts[-1])]
+        return values, np.repeat(np.arange(len(postings)), counts)
+
+    # Documents with the tokens at consecutive positions, scored by the sum of the tokens
+    def phrase(self, tokens):
+        documents = scores = None
+        # postings[k][j]: posting of tokens[k] in documents[j]
+        postings = []
+        for token in tokens:
+            i = self.term_index(token)
+            if i is None:
+                return np.empty(0, dtype=np.int64), np.empty(0)
+            token_documents, token_scores, start = self.term_postings(i)
+            token_postings = start + np.arange(len(token_documents))
+            if documents is None:
+                documents, scores = token_documents, token_scores
+            else:
+                documents, kept, matched = np.intersect1d(documents, token_documents, assume_unique=True,
+                                                          return_indices=True)
+                scores = scores[kept] + token_scores[matched]
+                postings = [previous[kept] for previous in postings]
+                token_postings = token_postings[matched]
+            postings.append(token_postings)
+
+        # The phrase starts at position p of documents[j] when tokens[k] is at p + k for every k: the (j, p) pairs
+        # allowed by each token, packed in one int64 (j in the high 32 bits), are intersected
+        phrase_starts = None
+        for k, token_postings in enumerate(postings):
+            values, owners = self.posting_positions(token_postings)
+            keys = (owners << 32) + (values.astype(np.int64) + (len(tokens) - k))
+            phrase_starts = keys if phrase_starts is None else np.intersect1d(phrase_starts, keys, assume_unique=True)
+        keep = np.unique(phrase_starts >> 32)
+        return documents[keep], scores[keep]
+
+    # (title_id, title, score) of the best `limit` titles matching every clause of query (see parse_query), best
+    # first, only among the titles with every genre of genres and of provider_id when given
+    def search(self, query, limit=10, genres=(), provider_id=None):
+        documents = scores = None
+        for kind, value in parse_query(query):
+            clause_documents, clause_scores = getattr(self, kind)(value)
+            if documents is None:
+                documents, scores = clause_documents, clause_scores
+            else:
+                documents, kept, matched = np.intersect1d(documents, clause_documents, assume_unique=True,
+                                                          return_indices=True)
+                scores = scores[kept] + clause_scores[matched]
+            if not len(documents):
+                return []
+        if documents is None:
+            return []
+
+        if genres:
+            if any(genre not in self.genre_codes for genre in genres):
+                return []
+            bitsets = self.arrays["titles.genres"]
+            mask = np.zeros(bitsets.shape[1], dtype=np.uint64)
+            for genre in genres:
+                mask[self.genre_codes[genre] // 64] |= np.uint64(1 << (self.genre_codes[genre] % 64))
+            selected = (bitsets[documents] & mask == mask).all(axis=1)
+            documents, scores = documents[selected], scores[selected]
+        if provider_id is not None:
+            provider_keys = self.arrays["provider_keys"]
+            i = int(provider_keys.searchsorted(int(provider_id)))
+            if i == len(provider_keys) or provider_keys[i] != int(provider_id):
+                return []
+            start, end = self.arrays["provider_titles.offsets"][i:i + 2].tolist()
+            selected = np.isin(documents, self.arrays["provider_titles.titles"][start:end])
+            documents, scores = documents[selected], scores[selected]
+
+        best = np.lexsort((documents, -scores))[:limit]
+        title_offsets, title_data = self.arrays["titles.offsets"], self.arrays["titles.data"]
+        results = []
+        for document, score in zip(documents[best].tolist(), scores[best].tolist()):
+            start, end = title_offsets[document:document + 2].tolist()
+            results.append((self.arrays["title_keys"][document].decode('utf-8'),
+                            title_data[start:end].tobytes().decode('utf-8'), round(score, 4)))
+        return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the full-text search index of the titles")
+    parser.add_argument("--directory", default=SCRIPT_DIRECTORY, help="directory with final_titles.csv")
+    parser.add_argument("--index", help="index directory, default search_index in --directory")
+    parser.add_argument("query", nargs="*", metavar="WORD",
+                        help='words, "quoted phrases" or prefixes (word*); build the index when empty')
+    parser.add_argument("--genre", action="append", default=[], help="only titles with this genre (repeatable)")
+    parser.add_argument("--provider", help="only the titles of this provider ID")
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+    index_directory = args.index or os.path.join(args.directory, SEARCH_DIRECTORY)
+
+    if not args.query:
+        start = time.perf_counter()
+        manifest = build_search_index(args.directory, index_directory)
+        print(f"Search index built in {index_directory} in {time.perf_counter() - start:.2f} s: "
+              f"{search_manifest_summary(manifest)}")
+    else:
+        index = SearchIndex(index_directory)
+        start = time.perf_counter()
+        results = index.search(" ".join(args.query), args.limit, args.genre, args.provider)
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        print(f"{len(results)} results in {(time.perf_counter() - start) * 1000:.1f} ms")
@@ -0,0 +1,175 @@
+import ast
+import functools
+import sys
+
+TITLE_COLUMNS = ['id', 'title', 'type', 'description', 'release_year', 'age_certification', 'runtime', 'genres',
+                 'production_countries', 'seasons', 'imdb_id', 'imdb_score', 'imdb_votes', 'tmdb_popularity',
+                 'tmdb_score']
+INTEGER_COLUMNS = ['release_year', 'runtime']
+FLOAT_COLUMNS = ['seasons', 'imdb_score', 'imdb_votes', 'tmdb_popularity', 'tmdb_score']
+NUMERIC_COLUMNS = INTEGER_COLUMNS + FLOAT_COLUMNS
+# Text columns with few distinct values, every repeated value shares one string object
+INTERNED_COLUMNS = ['type', 'age_certification', 'genres', 'production_countries']
+# Columns holding a list, written as its Python repr ("['drama', 'crime']")
+LIST_COLUMNS = ['genres', 'production_countries']
+
+
+def parse_number(value, column):
+    try:
+        return int(value) if column in INTEGER_COLUMNS else float(value)
+    except ValueError:
+        return None
+
+
+# Text of a column value as written to the CSV files: numbers as they were read, missing values as ''
+def format_value(column, value):
+    if value is None or isinstance(value, str) or column not in NUMERIC_COLUMNS:
+        return value
+    if value != value:  # NaN
+        return ''
+    return str(int(value)) if column in INTEGER_COLUMNS else repr(float(value))
+
+
+# Values of a list column text, parsed once per distinct text (a few thousand for the whole catalogue)
+@functools.lru_cache(maxsize=None)
+def parse_list_text(text):
+    return tuple(ast.literal_eval(text)) if text else ()
+
+
+def list_text(values):
+    return str(list(values))
+
+
+# Distinct values of a list column, each with a code in order of first appearance. A list is stored as a bitset: a
+# Python int with bit `code` set for each of its values, so a union is a bitwise OR and "has all of these values" is
+# (bitset & mask) == mask.
+class Vocabulary:
+    def __init__(self, values=()):
+        self.values = []
+        self.codes = {}
+        self.text_bitsets = {}
+        for value in values:
+            self.code(value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def bitset(self, values):
+        bitset = 0
+        for value in values:
+            bitset |= 1 << self.code(value)
+        return bitset
+
+    # Bitset of a list column text, computed once per distinct text
+    def text_bitset(self, text):
+        bitset = self.text_bitsets.get(text)
+        if bitset is None:
+            bitset = self.text_bitsets[text] = self.bitset(parse_list_text(text))
+        return bitset
+
+    # Values of a bitset, in code order
+    def decode(self, bitset):
+        return [value for code, value in enumerate(self.values) if bitset >> code & 1]
+
+    # Bitsets as a (len(bitsets), words) uint64 array, bit `code` in word code // 64, for vectorized filters
+    def bitset_array(self, bitsets):
+        import numpy as np
+
+        words = max(1, (len(self.values) + 63) // 64)
+        array = np.zeros((len(bitsets), words), dtype=np.uint64)
+        for word in range(words):
+            array[:, word] = [bitset >> (64 * word) & 0xFFFFFFFFFFFFFFFF for bitset in bitsets]
+        return array
+
+
+# Titles stored column by column: numeric columns are numpy arrays parsed once at load, with a mask of missing values,
+# text columns are object arrays. store[i] gives a TitleRecord with the same attributes as a Movie. List columns also
+# have their values interned in a Vocabulary and a bitset (Python int) per title in `bitsets`.
+class TitleStore:
+    def __init__(self, columns, missing):
+        import numpy as np
+
+        self.columns = columns
+        self.missing = missing
+        self.vocabularies = {column: Vocabulary() for column in LIST_COLUMNS}
+        self.bitsets = {column: np.array([self.vocabularies[column].text_bitset(text) for text in columns[column]],
+                                         dtype=object)
+                        for column in LIST_COLUMNS}
+
+    @classmethod
+    def from_rows(cls, rows):
+        import numpy as np
+
+        values = {column: [] for column in TITLE_COLUMNS}
+        for row in rows:
+            for column, value in zip(TITLE_COLUMNS, row):
+                values[column].append(value)
+
+        columns = {}
+        missing = {}
+        for column in TITLE_COLUMNS:
+            if column in NUMERIC_COLUMNS:
+                numbers = [parse_number(value, column) if value else None for value in values[column]]
+                missing[column] = np.array([number is None for number in numbers], dtype=bool)
+                columns[column] = np.array([0 if number is None else number for number in numbers],
+                                           dtype=np.int64 if column in INTEGER_COLUMNS else np.float64)
+            else:
+                text = [sys.intern(value) for value in values[column]] if column in INTERNED_COLUMNS else values[column]
+                columns[column] = np.array(text, dtype=object)
+        return cls(columns, missing)
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    def __getitem__(self, index):
+        return TitleRecord(self, index)
+
+    def __iter__(self):
+        return (TitleRecord(self, index) for index in range(len(self)))
+
+    def get(self, column, index):
+        if column in self.missing:
+            return None if self.missing[column][index] else self.columns[column][index].item()
+        return self.columns[column][index]
+
+    def set(self, column, index, value):
+        if column in self.missing:
+            self.missing[column][index] = value is None
+            self.columns[column][index] = 0 if value is None else value
+        else:
+            self.columns[column][index] = value
+        if column in self.bitsets:
+            vocabulary = self.vocabularies[column]
+            self.bitsets[column][index] = vocabulary.text_bitset(value) if isinstance(value, str) \
+                else vocabulary.bitset(value)
+
+    # Numeric column as float64 with NaN for missing values
+    def numeric_column(self, column):
+        import numpy as np
+
+        return np.where(self.missing[column], np.nan, self.columns[column].astype(np.float64))
+
+
+# View of one title of a TitleStore, reading and writing the store columns through Movie attribute names
+class TitleRecord:
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+
+def column_property(column):
+    return property(lambda record: record.store.get(column, record.index),
+                    lambda record, value: record.store.set(column, record.index, value))
+
+
+for title_column in TITLE_COLUMNS:
+    setattr(TitleRecord, title_column, column_property(title_column))
@@ -3,8 +3,20 @@ import csv
 import glob
 import ast
 
+from Dedup_P1 import unique_rows, record_dedup
+from Instrument_P1 import instrumented, record
+from Intermediate_P1 import read_rows, write_rows
+from Keys_P1 import SurrogateKeys, run_keys
+from Store_P1 import TitleStore, format_value
+from Cache_P1 import CACHE_DIRECTORY, load_manifest, save_manifest, get_cached_files
+from Parallel_P1 import WORKERS
+
 
 class Movie:
+    __slots__ = ('id', 'title', 'type', 'description', 'release_year', 'age_certification', 'runtime', 'genres',
+                 'production_countries', 'seasons', 'imdb_id', 'imdb_score', 'imdb_votes', 'tmdb_popularity',
+                 'tmdb_score')
+
     def __init__(self, id, title, type, description, release_year, age_certification, runtime, genres,
                  production_countries, seasons, imdb_id, imdb_score, imdb_votes, tmdb_popularity, tmdb_score):
         self.id = id
@@ -38,17 +50,6 @@ def read_csv_files_return_titles_as_list(directory):
     return titles
 
 
-def remove_empty_rows(input_file, output_file):
-    with open(input_file, 'r', newline='', encoding='utf-8') as infile:
-        lines = infile.readlines()
-
-    # Remove empty lines
-    non_empty_lines = [line for line in lines if line.strip()]
-
-    with open(output_file, 'w', newline='', encoding='utf-8') as outfile:
-        outfile.writelines(non_empty_lines)
-
-
 def delete_files_with_prefix(directory, prefix):
     for filename in os.listdir(directory):
         if filename.startswith(prefix):
@@ -60,31 +61,46 @@ def delete_files_with_prefix(directory, prefix):
                 print(f"Error deleting file {filename}: {e}")
 
 
-def fix_duplicate_lines_and_fix_description_field(input_file, output_file):
-    # Read the input CSV file
-    with open(input_file, 'r', newline='', encoding='utf-8') as infile:
-        reader = csv.reader(infile)
-        header = next(reader)  # Skip the header row
-        rows = list(reader)
-
+def fix_description_field(rows):
     # Process the description field by replacing newline characters with spaces
     for row in rows:
         row[3] = row[3].replace('\n', ' ')
+        yield row
 
-    # Remove duplicate rows
-    unique_rows = []
-    seen = set()
-    for row in rows:
-        row_tuple = tuple(row)
-        if row_tuple not in seen:
-            unique_rows.append(row)
-            seen.add(row_tuple)
 
-    # Write the cleaned data (without duplicates) to the output CSV file
-    with open(output_file, 'w', newline='', encoding='utf-8') as outfile:
-        writer = csv.writer(outfile)
-        writer.writerow(header)
-        writer.writerows(unique_rows)
+# Lines without the blank ones. The filter runs before CSV parsing, so blank lines inside a multiline description are
+# removed too.
+def non_blank_lines(lines):
+    for line in lines:
+        # Remove empty lines
+        if line.strip():
+            yield line
+
+
+# Header and sanitized rows of an open provider titles file, streamed line by line: blank lines removed, description
+# newlines folded and duplicate rows dropped by digest within the deduplication memory budget (Dedup_P1). stats gets
+# the deduplication counters.
+def sanitized_title_rows(infile, stats=None):
+    reader = csv.reader(non_blank_lines(infile))
+    header = next(reader)  # Skip the header row
+    return header, unique_rows(fix_description_field(reader), stats=stats)
+
+
+# Sanitized rows of a provider titles file, read straight from the raw file without writing any file
+def read_sanitized_titles(input_file):
+    with open(input_file, 'r', newline='', encoding='utf-8') as infile:
+        _, rows = sanitized_title_rows(infile)
+        yield from rows
+
+
+# Sanitize one provider file into output_file (CSV, or Arrow for a ".arrow" output_file) in a single pass
+@instrumented()
+def sanitize_titles_file(input_file, output_file):
+    stats = {}
+    with open(input_file, 'r', newline='', encoding='utf-8') as infile:
+        header, rows = sanitized_title_rows(infile, stats)
+        write_rows(output_file, header, rows)
+    record_dedup(stats)
 
 
 def read_csv_files_with_prefix_as_list(directory, prefix):
@@ -100,24 +116,49 @@ def read_csv_files_with_prefix_as_list(directory, prefix):
                     titles.append(title)
     return titles
 
-def read_movies_from_csv():
-    files = glob.glob('sanitized_*.csv')
+@instrumented()
+def read_movies_from_csv(files=None):
+    if files is None:
+        files = glob.glob('sanitized_*.csv')
     movies = []
 
     for file in files:
-        with open(file, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            next(reader)  # Skip the header row
-            for row in reader:
-                id, title, type, description, release_year, age_certification, runtime, genres, production_countries, seasons, imdb_id, imdb_score, imdb_votes, tmdb_popularity, tmdb_score = row
-                movie = Movie(id, title, type, description, release_year, age_certification, runtime, genres,
-                              production_countries, seasons, imdb_id, imdb_score, imdb_votes, tmdb_popularity,
-                              tmdb_score)
-                movies.append(movie)
-
+        for row in read_rows(file):
+            id, title, type, description, release_year, age_certification, runtime, genres, production_countries, seasons, imdb_id, imdb_score, imdb_votes, tmdb_popularity, tmdb_score = row
+            movie = Movie(id, title, type, description, release_year, age_certification, runtime, genres,
+                          production_countries, seasons, imdb_id, imdb_score, imdb_votes, tmdb_popularity,
+                          tmdb_score)
+            movies.append(movie)
+
+    record(rows_out=len(movies))
     return movies
 
 
+# Movies read from CSV compare their text, TitleRecords compare numbers. A missing number (None) compares below any
+# value, like '' does in text.
+def comparable(value):
+    return float('-inf') if value is None else value
+
+
+# Rows of files, each read with read. title_ids, when given, gets the ids of every file in the order first seen
+# (file -> dict of ids).
+def rows_with_title_ids(files, title_ids=None, read=read_rows):
+    for file in files:
+        ids = title_ids.setdefault(file, {}) if title_ids is not None else {}
+        for row in read(file):
+            ids[row[0]] = None
+            yield row
+
+
+# Titles of sanitized files, or with read=read_sanitized_titles of raw provider files
+@instrumented()
+def read_title_store(files, title_ids=None, read=read_rows):
+    store = TitleStore.from_rows(rows_with_title_ids(files, title_ids, read))
+    record(rows_out=len(store))
+    return store
+
+
+@instrumented()
 def merge_movies(movies):
     merged_movies = {}
     repeated_movies = []
@@ -149,7 +190,8 @@ def merge_movies(movies):
 
             if merged.imdb_id == movie.imdb_id:
                 # More seasons = more recent, more recent release year = more recent. SO we need to replace the old info.
-                if (movie.seasons > merged.seasons or movie.release_year > merged.release_year):
+                if (comparable(movie.seasons) > comparable(merged.seasons) or
+                        comparable(movie.release_year) > comparable(merged.release_year)):
 
                     # Fix seasons
                     merged.seasons = movie.seasons
@@ -158,9 +200,11 @@ def merge_movies(movies):
                     # a newer version of the same title shall not have less restriction as it also contains all episodes of previous seasons.
                     merged.age_certification = movie.age_certification
 
-                    # Merge genres, production_countries
-                    merged.genres = list(set(merged.genres + movie.genres))
-                    merged.production_countries = list(set(merged.production_countries + movie.production_countries))
+                    # Merge genres, production_countries (union in first-seen order, so the output does not depend on
+                    # string hashing)
+                    merged.genres = list(dict.fromkeys(merged.genres + movie.genres))
+                    merged.production_countries = list(
+                        dict.fromkeys(merged.production_countries + movie.production_countries))
 
                     # Leave newest description
                     merged.description = movie.description
@@ -179,7 +223,8 @@ def merge_movies(movies):
             # Check for different imdb_id, leave the one with most votes
             if movie.imdb_id != merged.imdb_id and movie.release_year == merged.release_year:
                 # We take the one with more votes, as it means it is more recent.
-                if movie.imdb_votes > merged.imdb_votes and movie.seasons >= merged.seasons:
+                if comparable(movie.imdb_votes) > comparable(merged.imdb_votes) and \
+                        comparable(movie.seasons) >= comparable(merged.seasons):
 
                     merged.imdb_votes = movie.imdb_votes
                     merged.imdb_id = movie.imdb_id
@@ -193,9 +238,10 @@ def merge_movies(movies):
                     merged.age_certification = movie.age_certification
 
                     # Merge genres, production_countries
-                    merged.genres = list(set(merged.genres + movie.genres))
-                    merged.production_countries = list(set(merged.production_countries + movie.production_countries))
-                    merged.age_certification = list(set(merged.age_certification + movie.age_certification))
+                    merged.genres = list(dict.fromkeys(merged.genres + movie.genres))
+                    merged.production_countries = list(
+                        dict.fromkeys(merged.production_countries + movie.production_countries))
+                    merged.age_certification = list(dict.fromkeys(merged.age_certification + movie.age_certification))
 
                     # Leave newest description
                     merged.description = movie.description
@@ -212,23 +258,22 @@ def merge_movies(movies):
 
 
             repeated_movies.append(movie)
+    record(rows_in=len(movies), rows_out=len(merged_movies), duplicates_dropped=len(movies) - len(merged_movies))
     return list(merged_movies.values())
 
-def remove_empty_lists_from_file(filename='final_titles.csv'):
-    try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        # Remove empty lists from each line
-        cleaned_lines = [line.replace('[]', '') for line in lines]
-        with open(filename, 'w', encoding='utf-8') as f:
-            f.writelines(cleaned_lines)
-        print(f"Empty lists removed from {filename}.")
-    except FileNotFoundError:
-        print(f"File '{filename}' not found.")
-
-def save_movies_to_csv(movies, filename='final_titles.csv'):
+# Value as written to the CSV file, without its empty lists ("[]"). Merged titles can hold actual lists.
+def without_empty_lists(value):
+    if isinstance(value, list):
+        value = str(value)
+    return value.replace('[]', '') if isinstance(value, str) else value
+
+
+@instrumented()
+def save_movies_to_csv(movies, filename='final_titles.csv', remove_empty_lists=False):
     with open(filename, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
+        # With remove_empty_lists, empty lists ("[]") are removed from the values as they are written, and lines end
+        # with "\n" like the file the former remove_empty_lists_from_file pass rewrote
+        writer = csv.writer(f, lineterminator='\n') if remove_empty_lists else csv.writer(f)
         # Write the header
         writer.writerow(['id', 'title', 'type', 'description', 'release_year', 'age_certification', 'runtime', 'genres',
                          'production_countries', 'seasons', 'imdb_id', 'imdb_score', 'imdb_votes', 'tmdb_popularity',
@@ -240,121 +285,190 @@ def save_movies_to_csv(movies, filename='final_titles.csv'):
                 age_cert_str = ', '.join(movie.age_certification)
             else:
                 age_cert_str = movie.age_certification
-            writer.writerow(
-                [movie.id, movie.title, movie.type, movie.description, movie.release_year, age_cert_str, movie.runtime,
-                 movie.genres, movie.production_countries, movie.seasons, movie.imdb_id, movie.imdb_score,
-                 movie.imdb_votes, movie.tmdb_popularity, movie.tmdb_score])
-
-
-def get_unique_ids_from_csv(filename):
-    ids = set()  # Initialize an empty set to store unique ids
-
-    # Get the full path to the CSV file
-    file_path = os.path.join(os.path.dirname(__file__), filename)
-
-    # Read the CSV file
-    with open(file_path, newline='', encoding='utf-8') as csvfile:
+            # Numeric values of a TitleStore are written back as text, Movie attributes are already text
+            row = [movie.id, movie.title, movie.type, movie.description,
+                   format_value('release_year', movie.release_year), age_cert_str,
+                   format_value('runtime', movie.runtime), movie.genres, movie.production_countries,
+                   format_value('seasons', movie.seasons), movie.imdb_id, format_value('imdb_score', movie.imdb_score),
+                   format_value('imdb_votes', movie.imdb_votes), format_value('tmdb_popularity', movie.tmdb_popularity),
+                   format_value('tmdb_score', movie.tmdb_score)]
+            if remove_empty_lists:
+                row = [without_empty_lists(value) for value in row]
+            writer.writerow(row)
+
+
+# Ids of the titles of a provider titles file, in the order first listed. Blank rows are skipped.
+def read_title_ids(filename):
+    with open(filename, newline='', encoding='utf-8') as csvfile:
         reader = csv.reader(csvfile)
-        next(reader)  # Skip the header row if it exists
-        for row in reader:
-            ids.add(row[0])  # Add the id from each row to the set
+        next(reader)  # Skip the header row
+        return dict.fromkeys(row[0] for row in reader if row)
 
-    return ids
 
+# "Titles.csv" files of directory, in the order they are merged
+def list_titles_files(directory):
+    return [os.path.join(directory, filename) for filename in sorted(os.listdir(directory))
+            if filename.endswith("Titles.csv")]
 
-def create_provider_titles_csv(provider, providerId, titles_set):
-    file_name = f"provider_{provider}_titles.csv"
 
-    # Write to the CSV file
-    with open(file_name, mode='w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.writer(csvfile)
-
-        # Write the data rows
-        for title_id in titles_set:
-            id_value = f"{providerId}_{title_id}"
-            writer.writerow([id_value, title_id, providerId])
+# Provider ids and names, one row per provider. The titles file of a provider is "<provider_name>_Titles.csv".
+PROVIDERS_FILE = "unique_providers.csv"
 
 
-def merge_provider_csv_files():
-    # Define the output filename
-    output_filename = "final_provider_movie.csv"
+# (provider_id, provider_name, titles file) of the providers of unique_providers.csv in directory, their titles file
+# matched ignoring case. Providers without a titles file are left out.
+def read_providers(directory):
+    titles_files = {os.path.basename(file).lower(): file for file in list_titles_files(directory)}
+    providers = []
+    with open(os.path.join(directory, PROVIDERS_FILE), newline='', encoding='utf-8') as csvfile:
+        reader = csv.reader(csvfile)
+        next(reader)  # Skip the header row
+        for row in reader:
+            if not row:
+                continue
+            provider_id, provider_name = row[0], row[1]
+            titles_file = titles_files.get(f"{provider_name}_titles.csv".lower())
+            if titles_file is None:
+                print(f"No titles file for provider {provider_name}")
+                continue
+            providers.append((provider_id, provider_name, titles_file))
+    return providers
+
+
+# Write final_provider_movie.csv, one row per provider and title, in a single pass. title_ids maps titles files to
+# their ids when they were already collected while the titles were loaded, the other files are read here.
+# canonical_ids maps the ids of titles matched to another title (Match_P1) to the id they were merged into. Titles are
+# deduplicated on their surrogate ids (Keys_P1) and every (provider, title) row gets one too.
+@instrumented()
+def create_provider_movie_table(directory, canonical_ids=None, title_ids=None, keys=None,
+                                filename="final_provider_movie.csv"):
+    canonical_ids = canonical_ids or {}
+    title_ids = title_ids or {}
+    keys = keys or SurrogateKeys()
+    encode_title, encode_provider_title, titles = keys.titles.encode, keys.provider_titles.encode, keys.titles.keys
+    rows_in = 0
+    rows_out = 0
+    with open(filename, mode='w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['id', 'title_id', 'provider_id'])
+        for provider_id, provider_name, titles_file in read_providers(directory):
+            ids = title_ids.get(titles_file)
+            if ids is None:
+                ids = read_title_ids(titles_file)
+            # Two titles of a provider matched to each other are listed once, under their canonical id
+            canonical = dict.fromkeys(encode_title(canonical_ids.get(title_id, title_id)) for title_id in ids)
+            for title in canonical:
+                encode_provider_title((int(provider_id), title))
+            writer.writerows([f"{provider_id}_{titles[title]}", titles[title], provider_id] for title in canonical)
+            rows_in += len(ids)
+            rows_out += len(canonical)
+    keys.save()
+    record(rows_in=rows_in, rows_out=rows_out)
+
+
+# Pipeline stages, in the order they run. Every stage takes the directory of the provider files and a state dict
+# shared by the stages of one run: what an earlier stage of the run computed is taken from the state, anything else
+# is read from the files earlier runs left behind, so any stage can be run on its own (see Pipeline_P1.py).
+# Merge_P1 and Match_P1 (and so pandas) are only imported by the stages that need them.
+
+# Sanitized provider files, cached by content hash: only changed providers are processed again. Providers are
+# sanitized in parallel and sorted, so merge_movies always sees them in the same order.
+def sanitized_titles_files(directory, state):
+    if 'sanitized_files' not in state:
+        cache_directory = os.path.join(directory, CACHE_DIRECTORY)
+        manifest = load_manifest(cache_directory)
+        state['sanitized_files'] = get_cached_files(cache_directory, manifest, "sanitized",
+                                                    list_titles_files(directory), sanitize_titles_file,
+                                                    workers=state.get('workers', WORKERS))
+        save_manifest(cache_directory, manifest)
+    return state['sanitized_files']
+
+
+def loaded_titles_table(directory, state):
+    from Merge_P1 import titles_table
+
+    if 'table' not in state:
+        title_ids = {}
+        if state.get('use_cache', True):
+            sanitized_files = sanitized_titles_files(directory, state)
+            state['table'] = titles_table(read_title_store(sanitized_files, title_ids))
+            title_ids = {titles_file: title_ids[sanitized_file] for titles_file, sanitized_file
+                         in zip(list_titles_files(directory), sanitized_files)}
+        else:
+            # Without the cache the raw files are sanitized on the fly, no file is written
+            state['table'] = titles_table(read_title_store(list_titles_files(directory), title_ids,
+                                                           read_sanitized_titles))
+        # The ids of every provider file, collected in the same pass, for the provider table
+        state['title_ids'] = title_ids
+    return state['table']
 
-    # Get the list of files in the directory
-    files = os.listdir()
 
-    # Filter files with the "provider_" prefix
-    provider_files = [file for file in files if file.startswith("provider_")]
+# id -> canonical id of the titles matched to another one, from this run or from the last title_matches.csv
+def canonical_title_ids(directory, state):
+    from Match_P1 import matches_file, read_title_matches
 
-    # Create an empty list to store all data rows
-    all_rows = []
+    if 'canonical_ids' not in state:
+        state['canonical_ids'] = read_title_matches(matches_file(directory))
+    return state['canonical_ids']
 
-    # Iterate over each provider file
-    for file in provider_files:
-        with open(file, mode='r', newline='', encoding='utf-8') as csvfile:
-            reader = csv.reader(csvfile)
-            next(reader)  # Skip the header row
-            for row in reader:
-                all_rows.append(row)
 
-    # Write all data to the output file
-    with open(output_filename, mode='w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.writer(csvfile)
+@instrumented()
+def sanitize_stage(directory, state):
+    prefix_to_match = "sanitized_"
+    delete_files_with_prefix(directory, prefix_to_match)
+    prefix_to_match = "final_csv"
+    delete_files_with_prefix(directory, prefix_to_match)
+    if state.get('use_cache', True):
+        sanitized_titles_files(directory, state)
+    else:
+        print("Cache disabled, the titles are sanitized while they are loaded")
 
-        # Write the header row
-        writer.writerow(['id', 'title_id', 'provider_id'])
 
-        # Write all data rows
-        writer.writerows(all_rows)
+# Titles listed under different ids by different providers, merged later like titles sharing an id
+@instrumented()
+def match_titles_stage(directory, state):
+    from Match_P1 import match_titles, matches_file, save_title_matches
 
-if __name__ == "__main__":
-    script_directory = os.path.dirname(os.path.abspath(__file__))
-    prefix_to_match = "sanitized_"
-    delete_files_with_prefix(script_directory, prefix_to_match)
-    prefix_to_match = "final_csv"
-    delete_files_with_prefix(script_directory, prefix_to_match)
+    matches = match_titles(loaded_titles_table(directory, state))
+    save_title_matches(matches, matches_file(directory))
+    state['canonical_ids'] = {title_id: canonical_id for title_id, canonical_id, _, _ in matches}
 
-    for filename in os.listdir(script_directory):
-        if filename.endswith("Titles.csv"):
-            input_filename = filename
-            output_filename = "titles_wo_space_" + filename
-            remove_empty_rows(input_filename, output_filename)
-            input_filename = output_filename
-            output_filename = "sanitized_" + filename
-            fix_duplicate_lines_and_fix_description_field(input_filename, output_filename)
 
-    prefix_to_match = "titles_wo_space_"
-    delete_files_with_prefix(script_directory, prefix_to_match)
+# Group-by merge engine with numeric comparisons (Merge_P1), same policy as merge_movies
+@instrumented()
+def merge_movies_stage(directory, state):
+    from Match_P1 import apply_title_matches
+    from Merge_P1 import merge_titles_table, table_to_movies
 
-    movies = read_movies_from_csv()
-    movies = merge_movies(movies)
-    save_movies_to_csv(movies)
-    remove_empty_lists_from_file()
-    prefix_to_match = "sanitized"
-    delete_files_with_prefix(script_directory, prefix_to_match)
+    table = apply_title_matches(loaded_titles_table(directory, state), canonical_title_ids(directory, state))
+    save_movies_to_csv(table_to_movies(merge_titles_table(table)), os.path.join(directory, 'final_titles.csv'),
+                       remove_empty_lists=True)
 
-    # get provider_movie table
-    title_set = get_unique_ids_from_csv("Amazon_Prime_Titles.csv")
-    create_provider_titles_csv("Amazon_Prime", 1, title_set)
 
-    title_set = get_unique_ids_from_csv("HBOMax_Titles.csv")
-    create_provider_titles_csv("hbo_max", 2, title_set)
+@instrumented()
+def provider_table_stage(directory, state):
+    create_provider_movie_table(directory, canonical_title_ids(directory, state), state.get('title_ids'),
+                                run_keys(directory, state), os.path.join(directory, "final_provider_movie.csv"))
 
-    title_set = get_unique_ids_from_csv("Disney_Plus_Titles.csv")
-    create_provider_titles_csv("disney_plus", 3, title_set)
 
-    title_set = get_unique_ids_from_csv("HuluTV_Titles.csv")
-    create_provider_titles_csv("hulutv", 4, title_set)
+# Full-text index of the titles merge_movies and provider_table wrote to directory (Search_P1)
+@instrumented()
+def search_index_stage(directory, state):
+    from Search_P1 import build_search_index, search_manifest_summary
 
-    title_set = get_unique_ids_from_csv("Netflix_Titles.csv")
-    create_provider_titles_csv("netflix", 5, title_set)
+    manifest = build_search_index(directory)
+    print(f"Search index built: {search_manifest_summary(manifest)}")
 
-    title_set = get_unique_ids_from_csv("ParamountTV_Titles.csv")
-    create_provider_titles_csv("paramountTV", 6, title_set)
 
-    title_set = get_unique_ids_from_csv("Rakuten_Viki_Titles.csv")
-    create_provider_titles_csv("rakuten", 7, title_set)
+TITLES_STAGES = [
+    ("sanitize", sanitize_stage),
+    ("match_titles", match_titles_stage),
+    ("merge_movies", merge_movies_stage),
+    ("provider_table", provider_table_stage),
+    ("search_index", search_index_stage),
+]
 
-    merge_provider_csv_files()
+if __name__ == "__main__":
+    from Pipeline_P1 import run_stages
 
-    prefix_to_match = "provider_"
-    delete_files_with_prefix(script_directory, prefix_to_match)
\ No newline at end of file
+    run_stages(TITLES_STAGES, os.path.dirname(os.path.abspath(__file__)))
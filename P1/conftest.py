@@ -0,0 +1,13 @@
+import pytest
+
+import Instrument_P1
+
+
+# No metrics from the tests, whatever P1_METRICS_FILE says: session scoped, so it is in place before the module
+# scoped fixtures run instrumented stages. Pool workers started by the tests read the environment.
+@pytest.fixture(scope="session", autouse=True)
+def no_metrics():
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(Instrument_P1, "METRICS_FILE", "")
+        patch.setenv("P1_METRICS_FILE", "")
+        yield
@@ -0,0 +1,155 @@
+# Frozen copy of the title merge of the baseline Titles_P1.py: Movie, merge_movies, remove_empty_lists_from_file and
+# save_movies_to_csv, unchanged. test_merge.py holds the merge engine of Merge_P1 to it. Values are text, so numbers
+# compare as text, and lists are merged through sets. Do not edit: it is the behaviour the pipeline started from.
+import ast
+import csv
+
+
+class Movie:
+    def __init__(self, id, title, type, description, release_year, age_certification, runtime, genres,
+                 production_countries, seasons, imdb_id, imdb_score, imdb_votes, tmdb_popularity, tmdb_score):
+        self.id = id
+        self.title = title
+        self.type = type
+        self.description = description
+        self.release_year = release_year
+        self.age_certification = age_certification
+        self.runtime = runtime
+        self.genres = genres
+        self.production_countries = production_countries
+        self.seasons = seasons
+        self.imdb_id = imdb_id
+        self.imdb_score = imdb_score
+        self.imdb_votes = imdb_votes
+        self.tmdb_popularity = tmdb_popularity
+        self.tmdb_score = tmdb_score
+
+
+
+def merge_movies(movies):
+    merged_movies = {}
+    repeated_movies = []
+
+    for movie in movies:
+        if movie.id not in merged_movies:
+            merged_movies[movie.id] = movie
+        else:
+            merged = merged_movies[movie.id]
+
+            # Convert genres and production_countries to lists if they are strings
+            if isinstance(merged.genres, str):
+                merged.genres = ast.literal_eval(merged.genres)
+            if isinstance(movie.genres, str):
+                movie.genres = ast.literal_eval(movie.genres)
+            if isinstance(merged.production_countries, str):
+                merged.production_countries = ast.literal_eval(merged.production_countries)
+            if isinstance(movie.production_countries, str):
+                movie.production_countries = ast.literal_eval(movie.production_countries)
+
+            # Convert age_certification to a list if it's a string
+            if isinstance(merged.age_certification, str):
+                merged.age_certification = [merged.age_certification]
+            if isinstance(movie.age_certification, str):
+                movie.age_certification = [movie.age_certification]
+
+            # Criteria to detect same movie (repeated): it has same id and same imdb_id, if it is a remake, it should have a different imdb_id.
+            # There can be a show released in different years because one provider has more recent seasons, but it has same id and imdb id.
+
+            if merged.imdb_id == movie.imdb_id:
+                # More seasons = more recent, more recent release year = more recent. SO we need to replace the old info.
+                if (movie.seasons > merged.seasons or movie.release_year > merged.release_year):
+
+                    # Fix seasons
+                    merged.seasons = movie.seasons
+
+                    # Leave the age restriction of the newer title, as it may add new seasons with more age restriction,
+                    # a newer version of the same title shall not have less restriction as it also contains all episodes of previous seasons.
+                    merged.age_certification = movie.age_certification
+
+                    # Merge genres, production_countries
+                    merged.genres = list(set(merged.genres + movie.genres))
+                    merged.production_countries = list(set(merged.production_countries + movie.production_countries))
+
+                    # Leave newest description
+                    merged.description = movie.description
+
+                    # Leave the most recent runtime
+                    merged.runtime = movie.runtime
+
+                    # Leave most recent tmdb information
+                    merged.tmdb_popularity = movie.tmdb_popularity
+                    merged.tmdb_score = movie.tmdb_score
+
+                    # Leave most recent release_year
+                    merged.release_year = movie.release_year
+
+
+            # Check for different imdb_id, leave the one with most votes
+            if movie.imdb_id != merged.imdb_id and movie.release_year == merged.release_year:
+                # We take the one with more votes, as it means it is more recent.
+                if movie.imdb_votes > merged.imdb_votes and movie.seasons >= merged.seasons:
+
+                    merged.imdb_votes = movie.imdb_votes
+                    merged.imdb_id = movie.imdb_id
+                    merged.imdb_score = movie.imdb_score
+
+                    # Fix seasons
+                    merged.seasons = movie.seasons
+
+                    # Leave the age restriction of the newer title, as it may add new seasons with more age restriction,
+                    # a newer version of the same title shall not have less restriction as it also contains all episodes of previous seasons.
+                    merged.age_certification = movie.age_certification
+
+                    # Merge genres, production_countries
+                    merged.genres = list(set(merged.genres + movie.genres))
+                    merged.production_countries = list(set(merged.production_countries + movie.production_countries))
+                    merged.age_certification = list(set(merged.age_certification + movie.age_certification))
+
+                    # Leave newest description
+                    merged.description = movie.description
+
+                    # Leave the most recent runtime
+                    merged.runtime = movie.runtime
+
+                    # Leave most recent tmdb information
+                    merged.tmdb_popularity = movie.tmdb_popularity
+                    merged.tmdb_score = movie.tmdb_score
+
+                    # Leave most recent release_year
+                    merged.release_year = movie.release_year
+
+
+            repeated_movies.append(movie)
+    return list(merged_movies.values())
+
+def remove_empty_lists_from_file(filename='final_titles.csv'):
+    try:
+        with open(filename, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        # Remove empty lists from each line
+        cleaned_lines = [line.replace('[]', '') for line in lines]
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.writelines(cleaned_lines)
+        print(f"Empty lists removed from {filename}.")
+    except FileNotFoundError:
+        print(f"File '{filename}' not found.")
+
+def save_movies_to_csv(movies, filename='final_titles.csv'):
+    with open(filename, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        # Write the header
+        writer.writerow(['id', 'title', 'type', 'description', 'release_year', 'age_certification', 'runtime', 'genres',
+                         'production_countries', 'seasons', 'imdb_id', 'imdb_score', 'imdb_votes', 'tmdb_popularity',
+                         'tmdb_score'])
+        # Write the movie data
+        for movie in movies:
+            # Convert age_certification to a single string (if it's a list)
+            if isinstance(movie.age_certification, list):
+                age_cert_str = ', '.join(movie.age_certification)
+            else:
+                age_cert_str = movie.age_certification
+            writer.writerow(
+                [movie.id, movie.title, movie.type, movie.description, movie.release_year, age_cert_str, movie.runtime,
+                 movie.genres, movie.production_countries, movie.seasons, movie.imdb_id, movie.imdb_score,
+                 movie.imdb_votes, movie.tmdb_popularity, movie.tmdb_score])
+
@@ -0,0 +1,76 @@
+import csv
+import io
+
+import pytest
+
+import Chunks_P1
+from Chunks_P1 import record_boundaries, record_ranges, parse_record_range, read_csv_batches
+
+# Quoted fields with newlines, escaped quotes right before and after a newline, a field holding only a quote, a
+# comma and a blank field, as csv.writer writes them
+ROWS = [['id', 'description', 'note'],
+        ['1', 'plain', 'x'],
+        ['2', 'line one\nline two', 'y'],
+        ['3', 'say "hi"\n"then" bye', 'z'],
+        ['4', '"\n"', '\n'],
+        ['5', 'ends with a newline\n', ''],
+        ['6', '', '"'],
+        ['7', 'a,b', '""\n""']]
+
+
+@pytest.fixture(params=['\r\n', '\n'])
+def csv_file(tmp_path, request):
+    path = str(tmp_path / "feed.csv")
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f, lineterminator=request.param).writerows(ROWS)
+    return path
+
+
+def read_all(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.reader(f))
+
+
+@pytest.mark.parametrize("block_bytes", [1, 2, 7, 1 << 20])
+def test_cut_at_any_byte_parses_like_csv_reader(csv_file, monkeypatch, block_bytes):
+    # Small scan blocks put every quote and newline at a block edge once
+    monkeypatch.setattr(Chunks_P1, "SCAN_BLOCK_BYTES", block_bytes)
+    expected = read_all(csv_file)
+    with open(csv_file, 'rb') as f:
+        size = len(f.read())
+    data_start = record_boundaries(csv_file, [0])[0]
+
+    for target in range(data_start, size):
+        cuts = [data_start] + record_boundaries(csv_file, [target]) + [size]
+        rows = [row for start, end in zip(cuts, cuts[1:]) for row in parse_record_range(csv_file, start, end)]
+        assert [expected[0]] + rows == expected, f"cut at {target}"
+
+
+def test_quoted_newline_is_not_a_boundary(csv_file):
+    with open(csv_file, 'rb') as f:
+        data = f.read()
+    inside = data.index(b'line one\n') + len(b'line one')
+    after_escaped_quote = data.index(b'say ""hi""\n') + len(b'say ""hi""')
+
+    assert record_boundaries(csv_file, [inside]) == [data.index(b'3,')]
+    assert record_boundaries(csv_file, [after_escaped_quote]) == [data.index(b'4,')]
+
+
+def test_ranges_cover_the_records(csv_file):
+    ranges = record_ranges(csv_file, workers=4, min_chunk_bytes=1)
+
+    assert len(ranges) > 1
+    assert [row for start, end in ranges for row in parse_record_range(csv_file, start, end)] == read_all(csv_file)[1:]
+
+
+def first_and_last(header, rows):
+    return ([row[0], row[-1]] for row in rows)
+
+
+def test_batches_from_a_pool_keep_file_order(csv_file):
+    header, batches = read_csv_batches(csv_file, workers=3, min_chunk_bytes=1)
+    assert header == ROWS[0]
+    assert [row for batch in batches for row in batch] == ROWS[1:]
+
+    _, batches = read_csv_batches(csv_file, workers=3, min_chunk_bytes=1, transform=first_and_last)
+    assert [row for batch in batches for row in batch] == [[row[0], row[-1]] for row in ROWS[1:]]
@@ -0,0 +1,34 @@
+import csv
+
+import pytest
+
+import Credits_P1
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.reader(f))
+
+
+# A provider file whose last row stops after the name, as a truncated export would
+@pytest.fixture
+def short_row_directory(tmp_path):
+    directory = tmp_path / "feeds"
+    directory.mkdir()
+    with open(directory / "Test_Credits.csv", 'w', newline='', encoding='utf-8') as f:
+        f.write("person_id,id,name,character,role\n1,tm1,Ann Lee,Hero,ACTOR\n2,tm1,Bob Stone\n")
+    return str(directory)
+
+
+@pytest.mark.parametrize("use_cache", [True, False])
+def test_missing_fields_are_written_blank(short_row_directory, tmp_path, monkeypatch, use_cache):
+    monkeypatch.chdir(tmp_path)
+    Credits_P1.process_credits_streaming(short_row_directory, use_cache=use_cache, workers=1, resolve=False)
+
+    assert read_csv("person_characters.csv")[1:] == [['1_hero', '1_tm1', 'hero'], ['2_', '2_tm1', '']]
+    assert read_csv("unique_persons.csv")[1:] == [['1', 'ann lee'], ['2', 'bob stone']]
+
+
+def test_missing_field_normalizes_like_pandas_na():
+    assert Credits_P1.normalize_credit_field(None) == ''
+    assert Credits_P1.normalize_credit_field('NaN') == ''
@@ -0,0 +1,34 @@
+import os
+import random
+
+from Dedup_P1 import unique_rows, DIGEST_ENTRY_BYTES
+
+
+def feed(count=5000, distinct=700, seed=0):
+    rng = random.Random(seed)
+    values = [[f"tm{i}", f"person {i % 97}", "ACTOR" if i % 3 else "DIRECTOR"] for i in range(distinct)]
+    # A blank line and a row with one empty field are different rows
+    values += [[], ['']]
+    return [list(rng.choice(values)) for _ in range(count)]
+
+
+def test_spilled_dedup_gives_the_in_memory_result(tmp_path):
+    rows = feed()
+    in_memory_stats, spilled_stats = {}, {}
+    in_memory = list(unique_rows(rows, stats=in_memory_stats))
+    spilled = list(unique_rows(rows, memory_budget=50 * DIGEST_ENTRY_BYTES, spill_directory=str(tmp_path),
+                               stats=spilled_stats))
+
+    assert not in_memory_stats['spilled'] and spilled_stats['spilled']
+    assert spilled == in_memory
+    assert len(in_memory) == len({tuple(row) for row in rows})
+    assert spilled_stats == {**in_memory_stats, 'spilled': True}
+    # The spill files are removed
+    assert os.listdir(tmp_path) == []
+
+
+def test_spill_right_at_the_budget(tmp_path):
+    rows = [[str(i % 10)] for i in range(100)]
+
+    assert list(unique_rows(rows, memory_budget=10 * DIGEST_ENTRY_BYTES, spill_directory=str(tmp_path))) == \
+        [[str(i)] for i in range(10)]
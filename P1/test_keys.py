@@ -0,0 +1,73 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import Keys_P1
+from Keys_P1 import KeyDictionary, SurrogateKeys
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+# A run in another process: encodes the keys given after the directory and saves them
+OTHER_RUN = """
+import sys
+from Keys_P1 import SurrogateKeys
+keys = SurrogateKeys(sys.argv[1])
+for key in sys.argv[2:]:
+    keys.titles.encode(key)
+keys.save()
+"""
+
+
+def saved_titles(directory):
+    return KeyDictionary("titles", ["title_id"], directory).keys[1:]
+
+
+def test_ids_follow_on_between_runs(tmp_path):
+    directory = str(tmp_path / "keys")
+    keys = SurrogateKeys(directory)
+    assert [keys.titles.encode(key) for key in ["tm1", "tm2", "tm1"]] == [1, 2, 1]
+    keys.save()
+
+    again = SurrogateKeys(directory)
+    assert [again.titles.encode(key) for key in ["tm2", "tm3"]] == [2, 3]
+    again.save()
+    assert saved_titles(directory) == ["tm1", "tm2", "tm3"]
+
+
+def test_keys_used_after_save_read_what_other_runs_appended(tmp_path):
+    directory = str(tmp_path / "keys")
+    keys = SurrogateKeys(directory)
+    keys.titles.encode("tm1")
+    keys.save()
+
+    other = SurrogateKeys(directory)
+    other.titles.encode("tm2")
+    other.save()
+
+    assert keys.titles.encode("tm3") == 3
+    assert keys.titles.encode("tm2") == 2
+    keys.save()
+    assert saved_titles(directory) == ["tm1", "tm2", "tm3"]
+
+
+@pytest.mark.skipif(Keys_P1.fcntl is None, reason="no advisory file locks on this platform")
+def test_concurrent_run_waits_for_the_keys(tmp_path):
+    directory = str(tmp_path / "keys")
+    keys = SurrogateKeys(directory)
+    keys.titles.encode("tm1")
+
+    other = subprocess.Popen([sys.executable, "-c", OTHER_RUN, directory, "tm2", "tm3"], cwd=SCRIPT_DIRECTORY)
+    try:
+        time.sleep(1)
+        # Still waiting for the lock: without it both runs would append id 1
+        assert other.poll() is None
+        keys.titles.encode("tm2")
+        keys.save()
+        assert other.wait(timeout=30) == 0
+    finally:
+        if other.poll() is None:
+            other.kill()
+
+    assert saved_titles(directory) == ["tm1", "tm2", "tm3"]
@@ -0,0 +1,42 @@
+from Match_P1 import match_titles
+from Merge_P1 import titles_table
+from Store_P1 import TITLE_COLUMNS, TitleStore
+
+
+# Titles table of listings given as dicts of the columns that differ from a plain movie
+def table_of(*listings):
+    plain = {'title': 'Same Title', 'type': 'MOVIE', 'description': '', 'release_year': '2020',
+             'age_certification': '', 'runtime': '90', 'genres': "['drama']", 'production_countries': "['US']",
+             'seasons': '', 'imdb_id': '', 'imdb_score': '', 'imdb_votes': '', 'tmdb_popularity': '',
+             'tmdb_score': ''}
+    rows = [[{**plain, **listing}[column] for column in TITLE_COLUMNS] for listing in listings]
+    return titles_table(TitleStore.from_rows(rows))
+
+
+def merged(matches):
+    return [(title_id, canonical_id) for title_id, canonical_id, _, _ in matches]
+
+
+def test_different_imdb_ids_are_not_merged_through_a_title_without_one():
+    chain = table_of({'id': 'tm1', 'imdb_id': 'tt1'}, {'id': 'tm2'}, {'id': 'tm3', 'imdb_id': 'tt2'})
+
+    assert merged(match_titles(chain)) == [('tm2', 'tm1')]
+
+
+def test_title_without_imdb_id_listed_first_joins_one_side_only():
+    chain = table_of({'id': 'tm2'}, {'id': 'tm1', 'imdb_id': 'tt1'}, {'id': 'tm3', 'imdb_id': 'tt2'})
+
+    assert merged(match_titles(chain)) == [('tm1', 'tm2')]
+
+
+def test_same_imdb_id_still_merges_transitively():
+    chain = table_of({'id': 'tm1', 'imdb_id': 'tt1'}, {'id': 'tm2'}, {'id': 'tm3', 'imdb_id': 'tt1'})
+
+    assert merged(match_titles(chain)) == [('tm2', 'tm1'), ('tm3', 'tm1')]
+
+
+def test_every_title_of_a_cluster_gets_a_row():
+    # tm1 and tm2 are too far apart in runtime to match each other, both match tm3
+    table = table_of({'id': 'tm1', 'runtime': '100'}, {'id': 'tm2', 'runtime': '50'}, {'id': 'tm3', 'runtime': '70'})
+
+    assert merged(match_titles(table)) == [('tm2', 'tm1'), ('tm3', 'tm1')]
@@ -0,0 +1,192 @@
+import ast
+import csv
+import os
+
+import pytest
+
+import Titles_P1
+from fixtures import baseline_titles
+from Intermediate_P1 import read_rows
+from Merge_P1 import titles_table, merge_titles_table, table_to_movies
+from Store_P1 import TITLE_COLUMNS, LIST_COLUMNS, TitleStore
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+AGE_COLUMN = TITLE_COLUMNS.index('age_certification')
+LIST_INDEXES = [TITLE_COLUMNS.index(column) for column in LIST_COLUMNS]
+
+# Titles of the bundled files the baseline merges differently because it compares numbers as text ('9651.0' >
+# '10022.0', '9.0' > '10.0'), with the columns that differ
+NUMERIC_DIFFERENCES = {
+    'ts35201': ['imdb_id', 'imdb_votes', 'tmdb_popularity'],
+    'ts521': ['runtime', 'seasons', 'imdb_id', 'imdb_votes', 'tmdb_popularity'],
+}
+# Titles of the bundled files whose genres or production countries the baseline merges through set(), so their order
+# follows the string hash seed. With the builtin set about 14 of them come out in another order than the engine's
+# first-seen union, how many depends on PYTHONHASHSEED.
+SET_ORDER_TITLES = ['tm242765', 'ts20351', 'ts20371', 'ts20433', 'ts20458', 'ts20526', 'ts21223', 'ts21469',
+                    'ts271247', 'ts37143', 'ts38116', 'ts42014', 'ts42062', 'ts5145', 'ts90311']
+
+
+# Stand-ins for set() in the baseline merge, to pin the order its lists come out in
+def first_seen(items):
+    return dict.fromkeys(items)
+
+
+def last_seen_first(items):
+    return reversed(dict.fromkeys(items))
+
+
+# Row of a sanitized titles file, every value as text
+def title_row(id='tm1', description='first', release_year='2020', age_certification='PG', runtime='90',
+              genres="['drama']", production_countries="['US']", seasons='', imdb_id='tt1', imdb_score='7.0',
+              imdb_votes='100.0', tmdb_popularity='1.0', tmdb_score='7.0'):
+    return [id, 'Title', 'MOVIE', description, release_year, age_certification, runtime, genres,
+            production_countries, seasons, imdb_id, imdb_score, imdb_votes, tmdb_popularity, tmdb_score]
+
+
+def csv_rows(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.reader(f))[1:]
+
+
+def merged_by_engine(rows, tmp_path):
+    path = str(tmp_path / "engine.csv")
+    Titles_P1.save_movies_to_csv(table_to_movies(merge_titles_table(titles_table(TitleStore.from_rows(rows)))), path,
+                                 remove_empty_lists=True)
+    return csv_rows(path)
+
+
+# final_titles.csv rows of the baseline pipeline (fixtures/baseline_titles.py), with order standing in for set() in
+# its merge, or the builtin set when None
+def merged_by_baseline(rows, tmp_path, monkeypatch, order=first_seen):
+    path = str(tmp_path / "baseline.csv")
+    if order:
+        monkeypatch.setattr(baseline_titles, "set", order, raising=False)
+    else:
+        monkeypatch.delattr(baseline_titles, "set", raising=False)
+    baseline_titles.save_movies_to_csv(baseline_titles.merge_movies([baseline_titles.Movie(*row) for row in rows]),
+                                       path)
+    baseline_titles.remove_empty_lists_from_file(path)
+    return csv_rows(path)
+
+
+# id -> names of the columns that differ, for the titles of two merges (in the same order) that differ
+def differences(rows, other_rows):
+    assert [row[0] for row in rows] == [row[0] for row in other_rows]
+    return {row[0]: [column for column, value, other in zip(TITLE_COLUMNS, row, other_row) if value != other]
+            for row, other_row in zip(rows, other_rows) if row != other_row}
+
+
+def without_age(row):
+    return row[:AGE_COLUMN] + row[AGE_COLUMN + 1:]
+
+
+def same_values(list_text, other_list_text):
+    return sorted(ast.literal_eval(list_text or '[]')) == sorted(ast.literal_eval(other_list_text or '[]'))
+
+
+@pytest.fixture(scope="module")
+def bundled_rows(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("sanitized")
+    rows = []
+    for titles_file in Titles_P1.list_titles_files(SCRIPT_DIRECTORY):
+        sanitized_file = str(directory / ("sanitized_" + os.path.basename(titles_file)))
+        Titles_P1.sanitize_titles_file(titles_file, sanitized_file)
+        rows.extend(read_rows(sanitized_file))
+    return rows
+
+
+def test_bundled_files_merge_like_the_baseline(bundled_rows, tmp_path, monkeypatch):
+    engine = merged_by_engine(bundled_rows, tmp_path)
+    baseline = merged_by_baseline(bundled_rows, tmp_path, monkeypatch)
+
+    assert differences(baseline, engine) == NUMERIC_DIFFERENCES
+
+
+def test_baseline_list_order_follows_set_order(bundled_rows, tmp_path, monkeypatch):
+    engine = merged_by_engine(bundled_rows, tmp_path)
+    first = merged_by_baseline(bundled_rows, tmp_path, monkeypatch, first_seen)
+    last = merged_by_baseline(bundled_rows, tmp_path, monkeypatch, last_seen_first)
+    assert sorted(differences(first, last)) == SET_ORDER_TITLES
+
+    # With the builtin set: the numeric differences, and lists in another order for some of SET_ORDER_TITLES
+    baseline = {row[0]: row for row in merged_by_baseline(bundled_rows, tmp_path, monkeypatch, None)}
+    order_only = differences(list(baseline.values()), engine)
+    for title_id, columns in NUMERIC_DIFFERENCES.items():
+        assert order_only.pop(title_id) == columns
+    assert set(order_only) <= set(SET_ORDER_TITLES)
+    for row in engine:
+        if row[0] in order_only:
+            assert set(order_only[row[0]]) <= set(LIST_COLUMNS)
+            assert all(same_values(baseline[row[0]][i], row[i]) for i in LIST_INDEXES)
+
+
+def test_newest_wins_on_more_seasons(tmp_path, monkeypatch):
+    rows = [title_row(seasons='1.0', description='old', age_certification='TV-14', runtime='40'),
+            title_row(seasons='2.0', description='new', age_certification='TV-MA', runtime='45')]
+    [merged] = merged_by_engine(rows, tmp_path)
+
+    assert (merged[3], merged[6], merged[9], merged[AGE_COLUMN]) == ('new', '45', '2.0', 'TV-MA')
+    assert without_age(merged) == without_age(merged_by_baseline(rows, tmp_path, monkeypatch)[0])
+
+
+def test_newest_wins_on_later_release_year_only(tmp_path):
+    newer_first = [title_row(release_year='2021', description='new'), title_row(release_year='2020', description='old')]
+    older_first = list(reversed(newer_first))
+
+    assert merged_by_engine(newer_first, tmp_path)[0][3:5] == ['new', '2021']
+    assert merged_by_engine(older_first, tmp_path)[0][3:5] == ['new', '2021']
+
+
+def test_max_votes_wins_between_imdb_ids(tmp_path, monkeypatch):
+    rows = [title_row(imdb_id='tt1', imdb_votes='100.0', imdb_score='5.0'),
+            title_row(imdb_id='tt2', imdb_votes='200.0', imdb_score='8.0')]
+    [merged] = merged_by_engine(rows, tmp_path)
+
+    assert (merged[10], merged[11], merged[12]) == ('tt2', '8.0', '200.0')
+    assert without_age(merged) == without_age(merged_by_baseline(rows, tmp_path, monkeypatch)[0])
+    # Fewer votes: the first listing stays
+    assert merged_by_engine(list(reversed(rows)), tmp_path)[0][10] == 'tt2'
+
+
+def test_lists_are_unions_in_first_seen_order(tmp_path, monkeypatch):
+    rows = [title_row(seasons='1.0', genres="['drama', 'crime']", production_countries="['US']"),
+            title_row(seasons='2.0', genres="['comedy', 'drama']", production_countries="['GB', 'US']")]
+    [merged] = merged_by_engine(rows, tmp_path)
+
+    assert (merged[7], merged[8]) == ("['drama', 'crime', 'comedy']", "['US', 'GB']")
+    assert merged == merged_by_baseline(rows, tmp_path, monkeypatch)[0]
+
+
+def test_numbers_compare_as_numbers(tmp_path, monkeypatch):
+    seasons = [title_row(seasons='9.0', description='nine'), title_row(seasons='10.0', description='ten')]
+    votes = [title_row(imdb_id='tt1', imdb_votes='9651.0'), title_row(imdb_id='tt2', imdb_votes='10022.0')]
+
+    assert merged_by_engine(seasons, tmp_path)[0][3] == 'ten'
+    assert merged_by_engine(votes, tmp_path)[0][10] == 'tt2'
+    # As text '10' < '9', so the baseline keeps the first listing
+    assert merged_by_baseline(seasons, tmp_path, monkeypatch)[0][3] == 'nine'
+    assert merged_by_baseline(votes, tmp_path, monkeypatch)[0][10] == 'tt1'
+
+
+def test_age_certification_is_the_strictest(tmp_path):
+    less_restricted_update = [title_row(seasons='1.0', age_certification='TV-MA'),
+                              title_row(seasons='2.0', age_certification='TV-14')]
+    unrated_first = [title_row(imdb_id='tt1', age_certification=''),
+                     title_row(imdb_id='tt2', imdb_votes='200.0', age_certification='PG-13')]
+    not_merged = [title_row(release_year='2021', age_certification='G'),
+                  title_row(release_year='2020', age_certification='NC-17')]
+
+    assert merged_by_engine(less_restricted_update, tmp_path)[0][AGE_COLUMN] == 'TV-MA'
+    assert merged_by_engine(unrated_first, tmp_path)[0][AGE_COLUMN] == 'PG-13'
+    assert merged_by_engine(not_merged, tmp_path)[0][AGE_COLUMN] == 'G'
+
+
+def test_several_listings_of_one_title(tmp_path, monkeypatch):
+    rows = [title_row(id='tm1', seasons='1.0', description='one'), title_row(id='tm2', description='other'),
+            title_row(id='tm1', seasons='3.0', description='three'),
+            title_row(id='tm1', seasons='2.0', description='two')]
+    merged = merged_by_engine(rows, tmp_path)
+
+    assert [(row[0], row[3], row[9]) for row in merged] == [('tm1', 'three', '3.0'), ('tm2', 'other', '')]
+    assert merged == merged_by_baseline(rows, tmp_path, monkeypatch)
@@ -0,0 +1,26 @@
+import csv
+
+from Search_P1 import SearchIndex, build_search_index, tokenize
+from Store_P1 import TITLE_COLUMNS
+
+
+def test_transliterated_capitals_are_words():
+    assert tokenize("你好, Wörld") == ['ni', 'hao', 'world']
+    assert tokenize("Ǆungla Ⅻ") == ['dzungla', 'xii']
+
+
+def test_titles_in_other_scripts_are_found(tmp_path):
+    titles = [['tm1', '東京物語', 'A family visits Tokyo'], ['tm2', 'Paris Story', 'A family visits Paris']]
+    with open(tmp_path / "final_titles.csv", 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(TITLE_COLUMNS)
+        writer.writerows([id, title, 'MOVIE', description] + [''] * (len(TITLE_COLUMNS) - 4)
+                         for id, title, description in titles)
+    with open(tmp_path / "final_provider_movie.csv", 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerows([['id', 'title_id', 'provider_id'], ['1_tm1', 'tm1', '1'], ['1_tm2', 'tm2', '1']])
+    build_search_index(str(tmp_path))
+    index = SearchIndex(str(tmp_path / "search_index"))
+
+    assert [key for key, _, _ in index.search("東京")] == ['tm1']
+    assert [key for key, _, _ in index.search("dong jing")] == ['tm1']
+    assert sorted(key for key, _, _ in index.search("family")) == ['tm1', 'tm2']
@@ -0,0 +1,140 @@
+import asyncio
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+MYSQL_CONFIG = {"user": "root", "password": "root", "host": "127.0.0.1", "database": "project01"}
+
+
+def connect_mysql(**kwargs):
+    import mysql.connector as db
+    return db.connect(**{**MYSQL_CONFIG, **kwargs})
+
+
+# Pool of up to `size` connections made by connect(). A connection is taken from the pool for one query (or one
+# streamed result) and given back afterwards, so no query pays for connection setup once the pool is warm.
+# With prepared, statements run on server-side prepared cursors (MySQL), kept per connection and statement so each
+# statement is only prepared once per connection.
+# When all `size` connections are in use, acquire waits up to `timeout` seconds for one to be given back and then
+# raises TimeoutError instead of waiting forever.
+class ConnectionPool:
+    def __init__(self, connect, size=5, prepared=False, timeout=30):
+        self.connect = connect
+        self.size = size
+        self.prepared = prepared
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+        self.prepared_cursors = {}
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            create = self.created < self.size
+            if create:
+                self.created += 1
+        if create:
+            try:
+                return self.connect()
+            except Exception:
+                with self.lock:
+                    self.created -= 1
+                raise
+        try:
+            return self.idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No free connection in the pool of {self.size} after {self.timeout} s, "
+                               f"is a stream left unfinished?") from None
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        except BaseException:
+            connection.rollback()
+            raise
+        finally:
+            self.idle.put(connection)
+
+    # Close the idle connections. Their prepared cursors are dropped too: they are keyed on id(connection), which a
+    # connection made later may get again.
+    def close(self):
+        while True:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            for key in [key for key in self.prepared_cursors if key[0] == id(connection)]:
+                del self.prepared_cursors[key]
+            connection.close()
+            with self.lock:
+                self.created -= 1
+
+    def cursor(self, connection, statement):
+        if not self.prepared:
+            return connection.cursor()
+        key = (id(connection), statement)
+        if key not in self.prepared_cursors:
+            self.prepared_cursors[key] = connection.cursor(prepared=True)
+        return self.prepared_cursors[key]
+
+    def release_cursor(self, connection, cursor):
+        # An unbuffered MySQL result has to be read to the end before the connection runs anything else
+        if hasattr(connection, "consume_results"):
+            connection.consume_results()
+        if not self.prepared:
+            cursor.close()
+
+    # Yield the result of statement as lists of at most batch_size rows. The cursor is unbuffered, so only one batch
+    # is held in client memory at a time. The stream holds its connection until it is read to the end or closed: on
+    # a pool of size streams left open, every other query waits and fails after the pool timeout.
+    def stream(self, statement, params=(), batch_size=1000):
+        with self.connection() as connection:
+            cursor = self.cursor(connection, statement)
+            try:
+                cursor.execute(statement, params)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield rows
+            finally:
+                self.release_cursor(connection, cursor)
+
+    def rows(self, statement, params=(), batch_size=1000):
+        for batch in self.stream(statement, params, batch_size):
+            yield from batch
+
+    def fetch_all(self, statement, params=()):
+        return list(self.rows(statement, params))
+
+    # asyncio versions: the blocking calls run in worker threads, so queries started with asyncio.gather run
+    # concurrently on different pooled connections
+    async def stream_async(self, statement, params=(), batch_size=1000):
+        batches = self.stream(statement, params, batch_size)
+        try:
+            while True:
+                batch = await asyncio.to_thread(next, batches, None)
+                if batch is None:
+                    break
+                yield batch
+        finally:
+            await asyncio.to_thread(batches.close)
+
+    async def fetch_all_async(self, statement, params=()):
+        return await asyncio.to_thread(self.fetch_all, statement, params)
+
+
+def mysql_pool(size=5, prepared=True, timeout=30, **kwargs):
+    return ConnectionPool(lambda: connect_mysql(**kwargs), size, prepared, timeout)
+
+
+# SQLite stand-in with the same interface (sqlite3 keeps its own prepared statement cache per connection)
+def sqlite_pool(database, size=5, timeout=30):
+    return ConnectionPool(lambda: sqlite3.connect(database, check_same_thread=False), size, timeout=timeout)
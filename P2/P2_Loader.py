@@ -0,0 +1,248 @@
+import argparse
+import csv
+import os
+import sqlite3
+import time
+
+from P2_Database import connect_mysql
+
+P1_DIRECTORY = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "P1"))
+
+# Tables in load order: every table comes after the tables its foreign keys point at
+LOAD_ORDER = [
+    ("providers", "unique_providers.csv"),
+    ("movies", "final_titles.csv"),
+    ("persons", "unique_persons.csv"),
+    ("provider_movie", "final_provider_movie.csv"),
+    ("person_titles", "person_titles.csv"),
+    ("person_characters", "person_characters.csv"),
+]
+BOOLEAN_COLUMNS = {"person_titles": ["actor", "director"]}
+
+# Works on MySQL/MariaDB and SQLite. The same character can be played in several titles, so person_characters is
+# keyed on (id, person_title_id).
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS `providers` (
+        `provider_id` INT PRIMARY KEY,
+        `provider_name` VARCHAR(100))""",
+    """CREATE TABLE IF NOT EXISTS `movies` (
+        `id` VARCHAR(20) PRIMARY KEY,
+        `title` VARCHAR(500),
+        `type` VARCHAR(10),
+        `description` TEXT,
+        `release_year` INT,
+        `age_certification` VARCHAR(50),
+        `runtime` INT,
+        `genres` TEXT,
+        `production_countries` TEXT,
+        `seasons` DOUBLE,
+        `imdb_id` VARCHAR(20),
+        `imdb_score` DOUBLE,
+        `imdb_votes` DOUBLE,
+        `tmdb_popularity` DOUBLE,
+        `tmdb_score` DOUBLE)""",
+    """CREATE TABLE IF NOT EXISTS `persons` (
+        `id` INT PRIMARY KEY,
+        `name` VARCHAR(255))""",
+    """CREATE TABLE IF NOT EXISTS `provider_movie` (
+        `id` VARCHAR(40) PRIMARY KEY,
+        `title_id` VARCHAR(20),
+        `provider_id` INT,
+        FOREIGN KEY (`title_id`) REFERENCES `movies` (`id`),
+        FOREIGN KEY (`provider_id`) REFERENCES `providers` (`provider_id`))""",
+    """CREATE TABLE IF NOT EXISTS `person_titles` (
+        `id` VARCHAR(60) PRIMARY KEY,
+        `title_id` VARCHAR(20),
+        `person_id` INT,
+        `actor` BOOLEAN,
+        `director` BOOLEAN,
+        FOREIGN KEY (`title_id`) REFERENCES `movies` (`id`),
+        FOREIGN KEY (`person_id`) REFERENCES `persons` (`id`))""",
+    """CREATE TABLE IF NOT EXISTS `person_characters` (
+        `id` VARCHAR(512),
+        `person_title_id` VARCHAR(60),
+        `character` TEXT,
+        PRIMARY KEY (`id`, `person_title_id`),
+        FOREIGN KEY (`person_title_id`) REFERENCES `person_titles` (`id`))""",
+]
+
+# Statements run around the whole load and around each table. Foreign key and unique checks are switched off while
+# loading (the tables are loaded parents first, so the data stays consistent) and non-unique index maintenance is
+# deferred to the end of each table where the engine supports it.
+DIALECTS = {
+    "mysql": {
+        "placeholder": "%s",
+        "before_load": ["SET foreign_key_checks = 0", "SET unique_checks = 0"],
+        "after_load": ["SET unique_checks = 1", "SET foreign_key_checks = 1"],
+        "before_table": ["ALTER TABLE `{table}` DISABLE KEYS"],
+        "after_table": ["ALTER TABLE `{table}` ENABLE KEYS"],
+    },
+    "sqlite": {
+        "placeholder": "?",
+        "before_load": ["PRAGMA foreign_keys = OFF"],
+        "after_load": ["PRAGMA foreign_keys = ON"],
+        "before_table": [],
+        "after_table": [],
+    },
+}
+
+
+def create_schema(connection):
+    cursor = connection.cursor()
+    for statement in SCHEMA:
+        cursor.execute(statement)
+    connection.commit()
+
+
+def run_statements(connection, statements, table=None):
+    cursor = connection.cursor()
+    for statement in statements:
+        cursor.execute(statement.format(table=table))
+
+
+# Header and rows of a pipeline output, with '' as NULL and "True"/"False" as 1/0 in the boolean columns
+def read_table_rows(csv_file, table):
+    with open(csv_file, newline='', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        yield header
+        booleans = [i for i, column in enumerate(header) if column in BOOLEAN_COLUMNS.get(table, [])]
+        for row in reader:
+            if not row:
+                continue
+            values = [value if value != '' else None for value in row]
+            for i in booleans:
+                values[i] = 1 if values[i] == 'True' else 0
+            yield values
+
+
+def insert_statement(dialect, table, columns):
+    placeholders = ", ".join([DIALECTS[dialect]["placeholder"]] * len(columns))
+    column_list = ", ".join(f"`{column}`" for column in columns)
+    return f"INSERT INTO `{table}` ({column_list}) VALUES ({placeholders})"
+
+
+# Insert the rows of csv_file into table, batch_size rows per executemany call (mysql.connector turns each call
+# into one multi-row INSERT) and one commit every transaction_size rows. Returns the number of rows loaded.
+def load_table(connection, dialect, table, csv_file, batch_size=5000, transaction_size=50000):
+    rows = read_table_rows(csv_file, table)
+    statement = insert_statement(dialect, table, next(rows))
+    cursor = connection.cursor()
+    loaded = 0
+    uncommitted = 0
+    batch = []
+
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            cursor.executemany(statement, batch)
+            loaded += len(batch)
+            uncommitted += len(batch)
+            batch = []
+            if uncommitted >= transaction_size:
+                connection.commit()
+                uncommitted = 0
+    if batch:
+        cursor.executemany(statement, batch)
+        loaded += len(batch)
+    connection.commit()
+    return loaded
+
+
+# Line terminator of csv_file, as its header line ends. The pipeline outputs are written by csv.writer with its
+# default '\r\n', except final_titles.csv (Titles_P1.save_movies_to_csv passes lineterminator='\n');
+# unique_providers.csv is not written by the pipeline, the copy bundled with P1 ends its lines with '\n'.
+def line_terminator(csv_file):
+    with open(csv_file, 'rb') as file:
+        return '\r\n' if file.readline().endswith(b'\r\n') else '\n'
+
+
+# MySQL only: let the server parse the file with LOAD DATA LOCAL INFILE (the connection needs
+# allow_local_infile=True). Empty fields become NULL and the boolean columns 1/0, like load_table.
+def load_table_infile(connection, table, csv_file):
+    with open(csv_file, newline='', encoding='utf-8') as file:
+        header = next(csv.reader(file))
+    terminator = line_terminator(csv_file).encode('unicode_escape').decode('ascii')
+    variables = ", ".join(f"@v{i}" for i in range(len(header)))
+    booleans = BOOLEAN_COLUMNS.get(table, [])
+    assignments = ", ".join(f"`{column}` = (@v{i} = 'True')" if column in booleans
+                            else f"`{column}` = NULLIF(@v{i}, '')"
+                            for i, column in enumerate(header))
+    cursor = connection.cursor()
+    cursor.execute(f"LOAD DATA LOCAL INFILE %s INTO TABLE `{table}` CHARACTER SET utf8mb4 "
+                   f"FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' "
+                   f"LINES TERMINATED BY '{terminator}' IGNORE 1 LINES ({variables}) SET {assignments}",
+                   (os.path.abspath(csv_file),))
+    connection.commit()
+    return cursor.rowcount
+
+
+# Load every table of LOAD_ORDER found in directory and return the throughput report (one dict per table).
+# With replace, existing rows are deleted first, children before parents.
+def bulk_load(connection, dialect, directory=P1_DIRECTORY, batch_size=5000, transaction_size=50000,
+              use_infile=False, replace=True):
+    report = []
+    run_statements(connection, DIALECTS[dialect]["before_load"])
+    try:
+        if replace:
+            cursor = connection.cursor()
+            for table, _ in reversed(LOAD_ORDER):
+                cursor.execute(f"DELETE FROM `{table}`")
+            connection.commit()
+
+        for table, filename in LOAD_ORDER:
+            csv_file = os.path.join(directory, filename)
+            if not os.path.exists(csv_file):
+                print(f"Skipping {table}: {csv_file} not found")
+                continue
+            start = time.perf_counter()
+            run_statements(connection, DIALECTS[dialect]["before_table"], table)
+            if use_infile and dialect == "mysql":
+                rows = load_table_infile(connection, table, csv_file)
+            else:
+                rows = load_table(connection, dialect, table, csv_file, batch_size, transaction_size)
+            run_statements(connection, DIALECTS[dialect]["after_table"], table)
+            seconds = time.perf_counter() - start
+            report.append({"table": table, "rows": rows, "seconds": seconds,
+                           "rows_per_second": rows / seconds if seconds else float('inf')})
+    finally:
+        run_statements(connection, DIALECTS[dialect]["after_load"])
+    return report
+
+
+def print_report(report):
+    print(f"{'table':<20}{'rows':>10}{'seconds':>10}{'rows/s':>12}")
+    for entry in report:
+        print(f"{entry['table']:<20}{entry['rows']:>10}{entry['seconds']:>10.2f}{entry['rows_per_second']:>12.0f}")
+    rows = sum(entry['rows'] for entry in report)
+    seconds = sum(entry['seconds'] for entry in report)
+    print(f"{'total':<20}{rows:>10}{seconds:>10.2f}{(rows / seconds if seconds else 0):>12.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk load the P1 pipeline outputs into the project01 database")
+    parser.add_argument("--directory", default=P1_DIRECTORY, help="directory with the P1 output CSV files")
+    parser.add_argument("--sqlite", metavar="FILE", help="load into this SQLite file instead of MySQL")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--transaction-size", type=int, default=50000)
+    parser.add_argument("--infile", action="store_true", help="use LOAD DATA LOCAL INFILE (MySQL only)")
+    parser.add_argument("--create-schema", action="store_true", help="create the tables if they do not exist")
+    parser.add_argument("--snapshot", default=None,
+                        help="directory of the snapshot P2_Sync.py compares the next outputs with, default P2/snapshot")
+    args = parser.parse_args()
+
+    if args.sqlite:
+        dialect = "sqlite"
+        sql = sqlite3.connect(args.sqlite)
+    else:
+        dialect = "mysql"
+        sql = connect_mysql(allow_local_infile=args.infile)
+
+    if args.create_schema:
+        create_schema(sql)
+    print_report(bulk_load(sql, dialect, args.directory, args.batch_size, args.transaction_size, args.infile))
+    sql.close()
+
+    # The database now holds exactly these outputs: later refreshes only need a delta sync
+    from P2_Sync import SNAPSHOT_DIRECTORY, save_snapshots
+    save_snapshots(args.directory, args.snapshot or SNAPSHOT_DIRECTORY)
@@ -1,11 +1,10 @@
-import mysql.connector as db
+from P2_Database import mysql_pool
 
 
 if __name__ == "__main__":
-    sql = db.connect(user="root", password="root", host="127.0.0.1", database="project01")
-    cursor = sql.cursor()
+    pool = mysql_pool(user="root", password="root", host="127.0.0.1", database="project01")
 
-    cursor.execute("SELECT ID FROM movies")
-    rows = cursor.fetchall()
+    for rows in pool.stream("SELECT ID FROM movies", batch_size=1000):
+        print(rows)
 
-    print(rows)
+    pool.close()
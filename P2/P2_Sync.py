@@ -0,0 +1,236 @@
+import argparse
+import csv
+import hashlib
+import os
+import sqlite3
+import time
+
+from P2_Database import connect_mysql
+from P2_Loader import P1_DIRECTORY, LOAD_ORDER, DIALECTS, read_table_rows, insert_statement
+
+SNAPSHOT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshot")
+# Primary key columns of every table, as declared in P2_Loader.SCHEMA
+PRIMARY_KEYS = {
+    "providers": ["provider_id"],
+    "movies": ["id"],
+    "persons": ["id"],
+    "provider_movie": ["id"],
+    "person_titles": ["id"],
+    "person_characters": ["id", "person_title_id"],
+}
+# Changed keys listed per table and kind of change in the diff report
+REPORT_SAMPLES = 5
+
+# The snapshot of a table is the primary key and a row hash of every row as it was last loaded, one CSV file per
+# table. Comparing a new pipeline output with it gives the inserts (new keys), updates (known keys, other hash) and
+# deletes (keys no longer there). Only hashes are kept, so the snapshot is small next to the tables.
+
+
+def row_hash(values):
+    text = "\x1f".join("\0" if value is None else str(value) for value in values)
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def snapshot_file(snapshot_directory, table):
+    return os.path.join(snapshot_directory, f"{table}.csv")
+
+
+# primary key (tuple) -> row hash of the rows of table when it was last loaded, empty when there is no snapshot
+def read_snapshot(snapshot_directory, table):
+    hashes = {}
+    try:
+        with open(snapshot_file(snapshot_directory, table), newline='', encoding='utf-8') as file:
+            reader = csv.reader(file)
+            next(reader)
+            for row in reader:
+                if row:
+                    hashes[tuple(row[:-1])] = row[-1]
+    except FileNotFoundError:
+        pass
+    return hashes
+
+
+def write_snapshot(snapshot_directory, table, hashes):
+    os.makedirs(snapshot_directory, exist_ok=True)
+    path = snapshot_file(snapshot_directory, table)
+    temp_file = path + '.tmp'
+    with open(temp_file, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(PRIMARY_KEYS[table] + ["hash"])
+        writer.writerows([*key, digest] for key, digest in hashes.items())
+    os.replace(temp_file, path)
+
+
+# Columns of csv_file and a generator of the (primary key, row hash, values) of its rows
+def hashed_rows(table, csv_file):
+    rows = read_table_rows(csv_file, table)
+    columns = next(rows)
+    key_positions = [columns.index(column) for column in PRIMARY_KEYS[table]]
+    return columns, ((tuple('' if values[i] is None else str(values[i]) for i in key_positions), row_hash(values),
+                      values) for values in rows)
+
+
+# Changes of table between its snapshot and csv_file: the rows to insert or update (full rows, in file order), the
+# keys to delete and the hashes of the new snapshot. A key listed twice in csv_file keeps its first row, like the
+# primary key would.
+def diff_table(table, csv_file, snapshot_directory):
+    old_hashes = read_snapshot(snapshot_directory, table)
+    columns, rows = hashed_rows(table, csv_file)
+
+    new_hashes = {}
+    upserts = []
+    inserted = []
+    updated = []
+    unchanged = 0
+    duplicates = 0
+    for key, digest, values in rows:
+        if key in new_hashes:
+            duplicates += 1
+            continue
+        new_hashes[key] = digest
+        old_digest = old_hashes.get(key)
+        if old_digest == digest:
+            unchanged += 1
+            continue
+        upserts.append(values)
+        (inserted if old_digest is None else updated).append(key)
+    deletes = [key for key in old_hashes if key not in new_hashes]
+
+    return {"table": table, "columns": columns, "upserts": upserts, "deletes": deletes, "hashes": new_hashes,
+            "inserts": len(inserted), "updates": len(updated), "deleted": len(deletes), "unchanged": unchanged,
+            "duplicates": duplicates, "samples": {"insert": inserted[:REPORT_SAMPLES],
+                                                  "update": updated[:REPORT_SAMPLES],
+                                                  "delete": deletes[:REPORT_SAMPLES]}}
+
+
+# Inserts and updates in one statement, so applying the same changes again (after a failed sync) does no harm
+def upsert_statement(dialect, table, columns):
+    keys = PRIMARY_KEYS[table]
+    others = [column for column in columns if column not in keys]
+    statement = insert_statement(dialect, table, columns)
+    if dialect == "mysql":
+        if not others:
+            return statement.replace("INSERT", "INSERT IGNORE", 1)
+        return statement + " ON DUPLICATE KEY UPDATE " + ", ".join(f"`{column}` = VALUES(`{column}`)"
+                                                                  for column in others)
+    key_list = ", ".join(f"`{column}`" for column in keys)
+    if not others:
+        return statement + f" ON CONFLICT ({key_list}) DO NOTHING"
+    return statement + f" ON CONFLICT ({key_list}) DO UPDATE SET " + ", ".join(f"`{column}` = excluded.`{column}`"
+                                                                              for column in others)
+
+
+def delete_statement(dialect, table):
+    placeholder = DIALECTS[dialect]["placeholder"]
+    conditions = " AND ".join(f"`{column}` = {placeholder}" for column in PRIMARY_KEYS[table])
+    return f"DELETE FROM `{table}` WHERE {conditions}"
+
+
+# Run statement for every row, batch_size rows per executemany call and one commit every transaction_size rows
+def execute_batches(connection, statement, rows, batch_size=5000, transaction_size=50000):
+    cursor = connection.cursor()
+    uncommitted = 0
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        cursor.executemany(statement, batch)
+        uncommitted += len(batch)
+        if uncommitted >= transaction_size:
+            connection.commit()
+            uncommitted = 0
+    connection.commit()
+
+
+# Compare the pipeline outputs in directory with the snapshot of the last load and, unless dry_run, apply the
+# changes: deletes children first, then inserts and updates parents first, so foreign keys hold all along. The
+# snapshot is only replaced once every change is committed; an interrupted sync is simply run again. Tables whose
+# output file is missing are left alone. Returns the diff report (one dict per table).
+def delta_sync(connection, dialect, directory=P1_DIRECTORY, snapshot_directory=SNAPSHOT_DIRECTORY, dry_run=False,
+               batch_size=5000, transaction_size=50000):
+    diffs = []
+    for table, filename in LOAD_ORDER:
+        csv_file = os.path.join(directory, filename)
+        if not os.path.exists(csv_file):
+            print(f"Skipping {table}: {csv_file} not found")
+            continue
+        start = time.perf_counter()
+        diff = diff_table(table, csv_file, snapshot_directory)
+        diff["diff_seconds"] = time.perf_counter() - start
+        diffs.append(diff)
+    if dry_run:
+        return [report_entry(diff) for diff in diffs]
+
+    for diff in reversed(diffs):
+        start = time.perf_counter()
+        execute_batches(connection, delete_statement(dialect, diff["table"]), diff["deletes"], batch_size,
+                        transaction_size)
+        diff["apply_seconds"] = time.perf_counter() - start
+    for diff in diffs:
+        start = time.perf_counter()
+        execute_batches(connection, upsert_statement(dialect, diff["table"], diff["columns"]), diff["upserts"],
+                        batch_size, transaction_size)
+        diff["apply_seconds"] += time.perf_counter() - start
+    for diff in diffs:
+        write_snapshot(snapshot_directory, diff["table"], diff["hashes"])
+    return [report_entry(diff) for diff in diffs]
+
+
+def report_entry(diff):
+    return {key: value for key, value in diff.items() if key not in ("columns", "upserts", "deletes", "hashes")}
+
+
+# Write the snapshot of the outputs in directory as they are, without touching the database: after a full load
+# (P2_Loader.py does it) or for a database loaded before delta syncs were used
+def save_snapshots(directory=P1_DIRECTORY, snapshot_directory=SNAPSHOT_DIRECTORY):
+    for table, filename in LOAD_ORDER:
+        csv_file = os.path.join(directory, filename)
+        if os.path.exists(csv_file):
+            hashes = {}
+            for key, digest, _ in hashed_rows(table, csv_file)[1]:
+                hashes.setdefault(key, digest)
+            write_snapshot(snapshot_directory, table, hashes)
+
+
+def print_sync_report(report, dry_run=False):
+    print(f"{'table':<20}{'inserts':>10}{'updates':>10}{'deletes':>10}{'unchanged':>11}{'seconds':>10}")
+    for entry in report:
+        seconds = entry["diff_seconds"] + entry.get("apply_seconds", 0)
+        print(f"{entry['table']:<20}{entry['inserts']:>10}{entry['updates']:>10}{entry['deleted']:>10}"
+              f"{entry['unchanged']:>11}{seconds:>10.2f}")
+        if entry["duplicates"]:
+            print(f"  {entry['duplicates']} rows with an already listed primary key ignored")
+        if dry_run:
+            for kind, keys in entry["samples"].items():
+                if keys:
+                    print(f"  {kind}: {', '.join('/'.join(key) for key in keys)}")
+    if dry_run:
+        print("Dry run, nothing was applied")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply the changes of the P1 pipeline outputs since the last load "
+                                                 "to the project01 database")
+    parser.add_argument("--directory", default=P1_DIRECTORY, help="directory with the P1 output CSV files")
+    parser.add_argument("--snapshot", default=SNAPSHOT_DIRECTORY, help="directory of the snapshot of the last load")
+    parser.add_argument("--sqlite", metavar="FILE", help="sync this SQLite file instead of MySQL")
+    parser.add_argument("--dry-run", action="store_true", help="only report the changes")
+    parser.add_argument("--init", action="store_true",
+                        help="only record the current outputs as loaded, for a database loaded without a snapshot")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--transaction-size", type=int, default=50000)
+    args = parser.parse_args()
+
+    if args.init:
+        save_snapshots(args.directory, args.snapshot)
+        print(f"Snapshot of {args.directory} saved to {args.snapshot}")
+        parser.exit()
+
+    dialect = "sqlite" if args.sqlite else "mysql"
+    # A dry run only reads the snapshot and the outputs
+    sql = None
+    if not args.dry_run:
+        sql = sqlite3.connect(args.sqlite) if args.sqlite else connect_mysql()
+
+    print_sync_report(delta_sync(sql, dialect, args.directory, args.snapshot, args.dry_run, args.batch_size,
+                                 args.transaction_size), args.dry_run)
+    if sql is not None:
+        sql.close()
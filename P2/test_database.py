@@ -0,0 +1,62 @@
+import sqlite3
+
+import pytest
+
+from P2_Database import ConnectionPool, sqlite_pool
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / "catalogue.db")
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE providers (provider_id INT PRIMARY KEY, provider_name TEXT)")
+    connection.executemany("INSERT INTO providers VALUES (?, ?)", [(i, f"provider {i}") for i in range(10)])
+    connection.commit()
+    connection.close()
+    return path
+
+
+# Stand-in for a MySQL connection, enough for the prepared cursor bookkeeping of the pool
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def cursor(self, prepared=False):
+        return object()
+
+    def close(self):
+        self.closed = True
+
+
+def test_open_stream_on_a_full_pool_times_out(database):
+    pool = sqlite_pool(database, size=1, timeout=0.2)
+    stream = pool.stream("SELECT * FROM providers ORDER BY provider_id", batch_size=3)
+    assert len(next(stream)) == 3
+
+    with pytest.raises(TimeoutError):
+        pool.fetch_all("SELECT COUNT(*) FROM providers")
+
+    stream.close()
+    assert pool.fetch_all("SELECT COUNT(*) FROM providers") == [(10,)]
+    pool.close()
+
+
+def test_stream_read_to_the_end_gives_its_connection_back(database):
+    pool = sqlite_pool(database, size=1, timeout=0.2)
+
+    assert sum(len(batch) for batch in pool.stream("SELECT * FROM providers", batch_size=4)) == 10
+    assert pool.fetch_all("SELECT COUNT(*) FROM providers") == [(10,)]
+    pool.close()
+
+
+def test_close_drops_the_prepared_cursors_of_closed_connections():
+    pool = ConnectionPool(FakeConnection, size=2, prepared=True)
+    with pool.connection() as connection:
+        cursor = pool.cursor(connection, "SELECT 1")
+        assert pool.cursor(connection, "SELECT 1") is cursor
+
+    pool.close()
+
+    assert connection.closed
+    assert pool.prepared_cursors == {}
+    assert pool.created == 0
@@ -0,0 +1,67 @@
+import csv
+import sqlite3
+
+import pytest
+
+from P2_Loader import line_terminator, load_table_infile, load_table, create_schema
+
+
+# Connection that records the statements load_table_infile sends instead of running them
+class RecordingConnection:
+    def __init__(self):
+        self.statements = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, statement, parameters=()):
+        self.statements.append((statement, parameters))
+
+    def commit(self):
+        pass
+
+    rowcount = 0
+
+
+def write_csv(path, rows, lineterminator):
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        csv.writer(file, lineterminator=lineterminator).writerows(rows)
+    return str(path)
+
+
+PROVIDER_ROWS = [['provider_id', 'provider_name'], ['1', 'Netflix'], ['2', 'Hulu']]
+
+
+@pytest.mark.parametrize("lineterminator", ['\n', '\r\n'])
+def test_line_terminator_follows_the_file(tmp_path, lineterminator):
+    assert line_terminator(write_csv(tmp_path / "providers.csv", PROVIDER_ROWS, lineterminator)) == lineterminator
+
+
+def test_quoted_newlines_do_not_change_the_terminator(tmp_path):
+    rows = [['id', 'description'], ['tm1', 'first line\r\nsecond line']]
+
+    assert line_terminator(write_csv(tmp_path / "titles.csv", rows, '\n')) == '\n'
+
+
+@pytest.mark.parametrize("lineterminator, clause", [('\n', "LINES TERMINATED BY '\\n' "),
+                                                    ('\r\n', "LINES TERMINATED BY '\\r\\n' ")])
+def test_infile_statement_uses_the_file_terminator(tmp_path, lineterminator, clause):
+    csv_file = write_csv(tmp_path / "providers.csv", PROVIDER_ROWS, lineterminator)
+    connection = RecordingConnection()
+    load_table_infile(connection, "providers", csv_file)
+
+    [(statement, parameters)] = connection.statements
+    assert clause in statement
+    assert "IGNORE 1 LINES (@v0, @v1)" in statement
+    assert parameters == (csv_file,)
+
+
+@pytest.mark.parametrize("lineterminator", ['\n', '\r\n'])
+def test_both_terminators_load_the_same_rows(tmp_path, lineterminator):
+    connection = sqlite3.connect(":memory:")
+    create_schema(connection)
+
+    assert load_table(connection, "sqlite", "providers",
+                      write_csv(tmp_path / "providers.csv", PROVIDER_ROWS, lineterminator)) == 2
+    assert connection.execute("SELECT * FROM providers ORDER BY provider_id").fetchall() == [(1, 'Netflix'),
+                                                                                            (2, 'Hulu')]
@@ -0,0 +1,111 @@
+import csv
+import sqlite3
+
+import pytest
+
+from P2_Loader import LOAD_ORDER, create_schema, bulk_load
+from P2_Sync import delta_sync, save_snapshots
+
+TABLES = [table for table, _ in LOAD_ORDER]
+TITLE_COLUMNS = ['id', 'title', 'type', 'description', 'release_year', 'age_certification', 'runtime', 'genres',
+                 'production_countries', 'seasons', 'imdb_id', 'imdb_score', 'imdb_votes', 'tmdb_popularity',
+                 'tmdb_score']
+
+
+def title(id, name, votes='100.0'):
+    return [id, name, 'MOVIE', f'About {name}', '2020', 'PG', '90', "['drama']", "['US']", '', f'tt{id[2:]}', '7.0',
+            votes, '1.0', '7.0']
+
+
+# Rows of the pipeline outputs, per table
+def outputs():
+    return {
+        "providers": [['provider_id', 'provider_name'], ['1', 'Netflix'], ['2', 'Hulu']],
+        "movies": [TITLE_COLUMNS, title('tm1', 'One'), title('tm2', 'Two'), title('tm3', 'Three')],
+        "persons": [['id', 'name'], ['10', 'ann lee'], ['11', 'bob stone'], ['12', 'cy young']],
+        "provider_movie": [['id', 'title_id', 'provider_id'], ['1_tm1', 'tm1', '1'], ['1_tm2', 'tm2', '1'],
+                           ['2_tm3', 'tm3', '2']],
+        "person_titles": [['id', 'title_id', 'person_id', 'actor', 'director'],
+                          ['10_tm1', 'tm1', '10', 'True', 'False'], ['11_tm2', 'tm2', '11', 'True', 'False'],
+                          ['12_tm2', 'tm2', '12', 'False', 'True'], ['11_tm3', 'tm3', '11', 'True', 'False']],
+        "person_characters": [['id', 'person_title_id', 'character'], ['10_hero', '10_tm1', 'hero'],
+                              ['11_villain', '11_tm2', 'villain'], ['11_villain', '11_tm3', 'villain']],
+    }
+
+
+def write_outputs(directory, tables):
+    directory.mkdir(exist_ok=True)
+    for table, filename in LOAD_ORDER:
+        with open(directory / filename, 'w', newline='', encoding='utf-8') as file:
+            csv.writer(file).writerows(tables[table])
+    return str(directory)
+
+
+def load(directory):
+    connection = sqlite3.connect(":memory:")
+    create_schema(connection)
+    bulk_load(connection, "sqlite", directory)
+    return connection
+
+
+def contents(connection):
+    return {table: sorted(connection.execute(f"SELECT * FROM `{table}`").fetchall(), key=repr) for table in TABLES}
+
+
+@pytest.fixture
+def loaded(tmp_path):
+    directory = write_outputs(tmp_path / "outputs", outputs())
+    snapshot_directory = str(tmp_path / "snapshot")
+    connection = load(directory)
+    save_snapshots(directory, snapshot_directory)
+    # bulk_load leaves foreign keys on, so the sync has to delete and insert in an order that keeps them
+    assert connection.execute("PRAGMA foreign_keys").fetchone() == (1,)
+    yield connection, snapshot_directory
+    connection.close()
+
+
+def test_sync_gives_a_fresh_load(tmp_path, loaded):
+    connection, snapshot_directory = loaded
+    tables = outputs()
+    # tm2 is gone, with its provider and person rows and the character played in it
+    tables["movies"] = [row for row in tables["movies"] if row[0] != 'tm2']
+    tables["provider_movie"] = [row for row in tables["provider_movie"] if row[1] != 'tm2']
+    tables["person_titles"] = [row for row in tables["person_titles"] if row[1] != 'tm2']
+    tables["person_characters"] = [row for row in tables["person_characters"] if row[1] != '11_tm2']
+    # Updates, and a new title with a new person
+    tables["movies"][1] = title('tm1', 'One', votes='250.0')
+    tables["providers"][2] = ['2', 'Hulu TV']
+    tables["movies"].append(title('tm4', 'Four'))
+    tables["persons"].append(['13', 'dee moss'])
+    tables["provider_movie"].append(['2_tm4', 'tm4', '2'])
+    tables["person_titles"].append(['13_tm4', 'tm4', '13', 'True', 'True'])
+    tables["person_characters"][1] = ['10_hero', '10_tm1', 'the hero']
+    tables["person_characters"].append(['13_sidekick', '13_tm4', 'sidekick'])
+    directory = write_outputs(tmp_path / "next", tables)
+
+    report = {entry["table"]: entry for entry in delta_sync(connection, "sqlite", directory, snapshot_directory,
+                                                            batch_size=2, transaction_size=3)}
+
+    assert contents(connection) == contents(load(directory))
+    assert [(report[table]["inserts"], report[table]["updates"], report[table]["deleted"]) for table in TABLES] == \
+        [(0, 1, 0), (1, 1, 1), (1, 0, 0), (1, 0, 1), (1, 0, 2), (1, 1, 1)]
+    assert connection.execute("PRAGMA foreign_key_check").fetchall() == []
+
+    # Synced again, nothing changes
+    report = delta_sync(connection, "sqlite", directory, snapshot_directory)
+    assert all(entry["inserts"] == entry["updates"] == entry["deleted"] == 0 for entry in report)
+
+
+def test_dry_run_applies_nothing(tmp_path, loaded):
+    connection, snapshot_directory = loaded
+    tables = outputs()
+    tables["persons"] = tables["persons"][:-1]
+    tables["person_titles"] = [row for row in tables["person_titles"] if row[2] != '12']
+    before = contents(connection)
+
+    report = delta_sync(connection, "sqlite", write_outputs(tmp_path / "next", tables), snapshot_directory,
+                        dry_run=True)
+
+    assert contents(connection) == before
+    assert {entry["table"]: entry["samples"]["delete"] for entry in report if entry["deleted"]} == \
+        {"persons": [('12',)], "person_titles": [('12_tm2',)]}